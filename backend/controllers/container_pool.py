@@ -0,0 +1,191 @@
+import os
+import uuid
+import asyncio
+import shutil
+import tempfile
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+from controllers.render_pool import render_pool
+from utils.process import run_process
+
+USE_CONTAINER_POOL = os.getenv("USE_CONTAINER_POOL", "true").lower() == "true"
+CONTAINER_POOL_MAX_JOBS = int(os.getenv("CONTAINER_POOL_MAX_JOBS", "25"))
+CONTAINER_POOL_ROOT = os.getenv("CONTAINER_POOL_ROOT", os.path.join(tempfile.gettempdir(), "manim-pool"))
+MANIM_IMAGE = os.getenv("MANIM_IMAGE", "manim-image:latest")
+
+
+class SandboxContainer:
+    """
+    A long-lived, network-less manim-image container idling on `sleep infinity`.
+    Its private host directory is mounted at /work; each job gets a scratch
+    subdirectory. The root filesystem is read-only and /tmp is a tmpfs, and reset()
+    restarts the container between jobs, so nothing one job leaves behind (processes,
+    files, edited packages or config) reaches the next job, which may be another user's.
+    """
+    def __init__(self):
+        self.name = f"manimpool-{uuid.uuid4().hex[:12]}"
+        self.host_dir = os.path.join(CONTAINER_POOL_ROOT, self.name)
+        self.jobs = 0
+        self.healthy = True
+
+    async def start(self):
+        os.makedirs(self.host_dir, exist_ok=True)
+        cmd = [
+            "docker", "run", "-d",
+            "--name", self.name,
+            "--read-only",
+            "--tmpfs", "/tmp",
+            "-e", "HOME=/tmp",
+            "--network", "none",
+            "-v", f"{self.host_dir}:/work",
+            "--entrypoint", "sleep",
+            MANIM_IMAGE, "infinity",
+        ]
+        returncode, stdout, stderr = await run_process(cmd, 60, container_name=self.name)
+        if returncode != 0:
+            shutil.rmtree(self.host_dir, ignore_errors=True)
+            raise RuntimeError(f"failed to start sandbox container: {stderr.strip()}")
+
+    async def reset(self):
+        """Empty /work and restart the container: kills every process and clears the /tmp tmpfs."""
+        for name in os.listdir(self.host_dir):
+            path = os.path.join(self.host_dir, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+        returncode, _, stderr = await run_process(["docker", "restart", "-t", "0", self.name], 60)
+        if returncode != 0:
+            raise RuntimeError(f"failed to reset sandbox container: {stderr.strip()}")
+
+    async def stop(self):
+        await run_process(["docker", "rm", "-f", self.name], 60)
+        shutil.rmtree(self.host_dir, ignore_errors=True)
+
+    async def render(self, tmp: str, filename: str, scene_class: str, quality_flag: str,
+                     out_name: str, timeout: float, extra_args: List[str] | None = None,
+                     on_output: Callable[[str], None] | None = None) -> Tuple[int, str, str]:
+        """
+        Copy the script (and any existing `tmp/media`) in, run manim via `docker exec`, and move
+        the media tree back to `tmp/media`.
+        A timeout removes the whole container, since killing `docker exec` leaves the process running.
+        """
+        job = uuid.uuid4().hex[:12]
+        scratch = os.path.join(self.host_dir, job)
+        os.makedirs(scratch)
+        try:
+            shutil.copy2(os.path.join(tmp, filename), os.path.join(scratch, filename))
+            if os.path.isdir(os.path.join(tmp, "media")):
+                # Carry over a cached media dir so manim can reuse its partial movies.
+                shutil.move(os.path.join(tmp, "media"), os.path.join(scratch, "media"))
+            cmd = [
+                "docker", "exec", self.name,
+                "manim", quality_flag, f"/work/{job}/{filename}", scene_class,
+                "--media_dir", f"/work/{job}/media",
+                "-o", out_name,
+                *(extra_args or []),
+            ]
+            try:
+                result = await run_process(cmd, timeout, container_name=self.name, on_output=on_output)
+            except BaseException:
+                self.healthy = False
+                raise
+            self.jobs += 1
+            return result
+        finally:
+            media = os.path.join(scratch, "media")
+            if os.path.isdir(media):
+                shutil.move(media, os.path.join(tmp, "media"))
+            shutil.rmtree(scratch, ignore_errors=True)
+
+
+class ContainerPool:
+    """
+    Reuses sandbox containers across renders to skip per-job container create/destroy.
+    Like the Manim worker pool, concurrency is bounded by the render slot pool, so acquiring
+    takes an idle container or starts one. After each job a container is reset in the
+    background before it goes back to the idle list. Containers are recycled after
+    CONTAINER_POOL_MAX_JOBS jobs or after a timeout/failure.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: List[SandboxContainer] = []
+        self._resets: Set[asyncio.Task] = set()
+        self.busy = 0
+        self.started = 0
+        self.recycled = 0
+
+    async def _spawn(self) -> SandboxContainer:
+        container = SandboxContainer()
+        await container.start()
+        self.started += 1
+        return container
+
+    async def _acquire(self) -> SandboxContainer:
+        if self._idle:
+            return self._idle.pop()
+        return await self._spawn()
+
+    async def _release(self, container: SandboxContainer):
+        if (not container.healthy or container.jobs >= CONTAINER_POOL_MAX_JOBS
+                or len(self._idle) + len(self._resets) >= self.size):
+            self.recycled += 1
+            await container.stop()
+            return
+        task = asyncio.create_task(self._reset(container))
+        self._resets.add(task)
+        task.add_done_callback(self._resets.discard)
+
+    async def _reset(self, container: SandboxContainer):
+        try:
+            await container.reset()
+        except Exception as e:
+            print(f"Sandbox container {container.name}: {e}")
+            self.recycled += 1
+            await container.stop()
+            return
+        self._idle.append(container)
+
+    async def settle(self):
+        """Wait for containers being reset to return to the idle list."""
+        while self._resets:
+            await asyncio.gather(*self._resets, return_exceptions=True)
+
+    async def warm(self):
+        try:
+            while len(self._idle) + len(self._resets) + self.busy < self.size:
+                self._idle.append(await self._spawn())
+        except Exception as e:
+            print(f"Failed to pre-start sandbox containers: {e}")
+
+    async def shutdown(self):
+        await self.settle()
+        idle, self._idle = self._idle, []
+        for container in idle:
+            await container.stop()
+
+    async def render(self, tmp: str, filename: str, scene_class: str, quality_flag: str,
+                     out_name: str, timeout: float, extra_args: List[str] | None = None,
+                     on_output: Callable[[str], None] | None = None) -> Tuple[int, str, str]:
+        """Render in a pooled container; same contract as utils.process.run_process."""
+        container = await self._acquire()
+        self.busy += 1
+        try:
+            return await container.render(tmp, filename, scene_class, quality_flag, out_name, timeout, extra_args, on_output)
+        finally:
+            self.busy -= 1
+            await self._release(container)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "busy": self.busy,
+            "resetting": len(self._resets),
+            "started": self.started,
+            "recycled": self.recycled,
+            "max_jobs": CONTAINER_POOL_MAX_JOBS,
+        }
+
+
+container_pool = ContainerPool(size=int(os.getenv("CONTAINER_POOL_SIZE", str(render_pool.slots))))
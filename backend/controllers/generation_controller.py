@@ -1,7 +1,10 @@
 import os
 import re
 import json
-from typing import Dict, Any
+import asyncio
+from typing import Callable, Dict, Any, Optional
+
+from utils.llm_cache import llm_cache
 
 try:
     from dotenv import load_dotenv, find_dotenv
@@ -23,10 +26,11 @@ def get_genai_client():
             return genai.Client(api_key=api_key)
         raise ValueError("Set GENAI_API_KEY or configure Vertex AI ADC (gcloud or service account).")
 
-def generate_manim_code(user_prompt: str) -> Dict[str, Any]:
-    client = get_genai_client()
+GENAI_MODEL = os.getenv("GENAI_MODEL", "gemini-2.5-flash")
+# Stream generations in generate-and-render so validation and rendering start as soon as the code block closes.
+GENAI_STREAM = os.getenv("GENAI_STREAM", "true").lower() == "true"
 
-    prompt = f"""
+PROMPT_TEMPLATE = """
 You are an expert Python code generator for Manim Community (2D) scenes. Produce clean, runnable Manim code that follows these strict rules.
 
 OUTPUT FORMAT (MANDATORY):
@@ -93,13 +97,36 @@ class GeneratedScene(Scene):
 Prompt: {user_prompt}
 """
 
+def _save_script(code: str) -> str:
+    os.makedirs("generated_scripts", exist_ok=True)
+    path = os.path.join("generated_scripts", "generated_scene.py")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(code)
+    return path
+
+def generate_manim_code(user_prompt: str, use_cache: bool = True, store: bool = True) -> Dict[str, Any]:
+    """
+    Ask Gemini for a Manim scene. Responses are cached on the normalized prompt,
+    model and template; pass use_cache=False to force a fresh generation, and
+    store=False to leave the cache alone (see remember_generation).
+    """
+    cache_key = llm_cache.key(user_prompt, GENAI_MODEL, PROMPT_TEMPLATE)
+    if use_cache:
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            print("[LLM] Cache hit for prompt:", user_prompt)
+            return {"path": _save_script(cached["code"]), "code": cached["code"], "metadata": cached["metadata"], "cached": True}
+
+    client = get_genai_client()
+    prompt = PROMPT_TEMPLATE.format(user_prompt=user_prompt)
+
     try:
         print("[LLM] Prompt:", user_prompt)
     except Exception:
         pass
 
     resp = client.models.generate_content(
-        model="gemini-2.5-flash",
+        model=GENAI_MODEL,
         contents=prompt
     )
 
@@ -116,22 +143,105 @@ Prompt: {user_prompt}
     except Exception:
         pass
 
-    m = re.search(r"```(?:python)?\n(.*?)\n```", text, re.S)
-    if not m:
+    code = _extract_code(text)
+    if code is None:
         raise ValueError("No fenced python code block found in model output.")
-    code = m.group(1).strip()
-
-    meta = {}
-    mm = re.search(r"///METADATA///\s*(\{.*?\})", text)
+    meta = _extract_metadata(text)
+
+    if store:
+        llm_cache.put(cache_key, GENAI_MODEL, user_prompt, code, meta)
+
+    return {"path": _save_script(code), "code": code, "metadata": meta, "cached": False}
+
+def remember_generation(user_prompt: str, result: Dict[str, Any]):
+    """
+    Cache a generation made with store=False once it is known to work, e.g. the candidate
+    that won a speculative race or code that rendered. A streamed result whose metadata is
+    still arriving is cached when its stream ends.
+    """
+    if result.get("cached"):
+        return
+    stream = result.get("stream")
+    if stream is not None and not stream.done():
+        stream.add_done_callback(lambda task: _remember_streamed(user_prompt, task))
+        return
+    llm_cache.put(llm_cache.key(user_prompt, GENAI_MODEL, PROMPT_TEMPLATE), GENAI_MODEL, user_prompt,
+                      result["code"], result.get("metadata") or {})
+
+def _remember_streamed(user_prompt: str, task: asyncio.Task):
+    if not task.cancelled() and task.exception() is None:
+        remember_generation(user_prompt, task.result())
+
+def _extract_code(text: str) -> Optional[str]:
+    m = re.search(r"```(?:python)?\n(.*?)\n```", text or "", re.S)
+    return m.group(1).strip() if m else None
+
+def _extract_metadata(text: str) -> Dict[str, Any]:
+    mm = re.search(r"///METADATA///\s*(\{.*?\})", text or "")
     if mm:
         try:
-            meta = json.loads(mm.group(1))
+            return json.loads(mm.group(1))
         except Exception:
-            meta = {}
-
-    os.makedirs("generated_scripts", exist_ok=True)
-    path = os.path.join("generated_scripts", "generated_scene.py")
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(code)
-
-    return {"path": path, "code": code, "metadata": meta}
+            pass
+    return {}
+
+def _stream_generation(user_prompt: str, cache_key: str, on_code: Callable[[str], None],
+                       store: bool = True) -> Dict[str, Any]:
+    """
+    Blocking: stream a Gemini generation, calling `on_code` once the fenced code block
+    has closed, then read the rest (the metadata line) and, with `store`, cache the full result.
+    """
+    client = get_genai_client()
+    prompt = PROMPT_TEMPLATE.format(user_prompt=user_prompt)
+    print("[LLM] Streaming prompt:", user_prompt)
+
+    text, code = "", None
+    for chunk in client.models.generate_content_stream(model=GENAI_MODEL, contents=prompt):
+        text += getattr(chunk, "text", None) or ""
+        if code is None:
+            code = _extract_code(text)
+            if code is not None:
+                print(f"[LLM] Code block complete after {len(text)} characters")
+                on_code(code)
+
+    if code is None:
+        print("[LLM] Response text:\n", text[:1200])
+        raise ValueError("No fenced python code block found in model output.")
+    meta = _extract_metadata(text)
+    if store:
+        llm_cache.put(cache_key, GENAI_MODEL, user_prompt, code, meta)
+    return {"path": _save_script(code), "code": code, "metadata": meta, "cached": False}
+
+def _log_background_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[LLM] Streaming generation failed after the code was delivered: {task.exception()}")
+
+async def stream_manim_code(user_prompt: str, use_cache: bool = True, store: bool = True) -> Dict[str, Any]:
+    """
+    Like generate_manim_code, but returns as soon as the code block is complete instead of
+    waiting for the whole response. The trailing metadata is still read (and with `store`
+    the result cached) in the background; `metadata` is only filled in when the stream had
+    already ended, otherwise `stream` is the task still reading it (see remember_generation).
+    """
+    cache_key = llm_cache.key(user_prompt, GENAI_MODEL, PROMPT_TEMPLATE)
+    if use_cache:
+        cached = await asyncio.to_thread(llm_cache.get, cache_key)
+        if cached is not None:
+            print("[LLM] Cache hit for prompt:", user_prompt)
+            return {"path": _save_script(cached["code"]), "code": cached["code"], "metadata": cached["metadata"], "cached": True}
+
+    loop = asyncio.get_running_loop()
+    code_ready = loop.create_future()
+
+    def on_code(code: str):
+        loop.call_soon_threadsafe(lambda: code_ready.done() or code_ready.set_result(code))
+
+    generation = asyncio.ensure_future(asyncio.to_thread(_stream_generation, user_prompt, cache_key, on_code, store))
+    await asyncio.wait({generation, code_ready}, return_when=asyncio.FIRST_COMPLETED)
+    if generation.done():
+        code_ready.cancel()
+        return generation.result()
+
+    generation.add_done_callback(_log_background_failure)
+    code = code_ready.result()
+    return {"path": _save_script(code), "code": code, "metadata": {}, "cached": False, "stream": generation}
@@ -0,0 +1,235 @@
+import os
+import time
+import uuid
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from utils import progress
+from controllers.render_pool import render_pool
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+# A render that prints no progress for this long is reported as stalled to event subscribers.
+RENDER_STALL_SECONDS = int(os.getenv("RENDER_STALL_SECONDS", "60"))
+KEEPALIVE_SECONDS = 15
+
+# In-memory job table. Job IDs are random uuid4 hex strings, so knowing an ID
+# is what grants access to its status (same model as the generated video names).
+_jobs: Dict[str, Dict[str, Any]] = {}
+_queue: Optional[asyncio.Queue] = None
+_workers: list = []
+_loop: Optional[asyncio.AbstractEventLoop] = None
+# Live event queues of the clients streaming a job, by job ID.
+_subscribers: Dict[str, List[asyncio.Queue]] = {}
+# Tasks of the jobs currently running, by job ID, so they can be cancelled.
+_running: Dict[str, asyncio.Task] = {}
+# Jobs holding a render_pool admission (see submit_admitted_job), released once they finish or are cancelled.
+_admitted: set = set()
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+def _now() -> float:
+    return time.time()
+
+
+def _prune_jobs():
+    """Drop finished jobs older than JOB_TTL_SECONDS."""
+    cutoff = _now() - JOB_TTL_SECONDS
+    for job_id in [j["id"] for j in _jobs.values() if j["status"] in FINISHED and j["updated_at"] < cutoff]:
+        _jobs.pop(job_id, None)
+
+
+def _ensure_workers():
+    """
+    Start the worker pool on the running event loop.
+    Workers are (re)created lazily so the pool always belongs to the loop that serves requests.
+    """
+    global _queue, _workers, _loop
+    loop = asyncio.get_running_loop()
+    if _loop is loop and _queue is not None:
+        return
+    _loop = loop
+    _queue = asyncio.Queue()
+    _workers = [loop.create_task(_worker(i)) for i in range(max(1, JOB_WORKERS))]
+
+
+def _publish(job: Dict[str, Any], event: Dict[str, Any]):
+    job["last_event_at"] = _now()
+    for queue in _subscribers.get(job["id"], []):
+        queue.put_nowait(event)
+
+
+def _done_event(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {"type": "done", "status": job["status"], "error": job["error"], "result": job["result"]}
+
+
+def _set_stage(job: Dict[str, Any], stage: str):
+    job["stage"] = stage
+    job["updated_at"] = _now()
+    print(f"[JOB {job['id']}] stage={stage}")
+    _publish(job, {"type": "stage", "stage": stage})
+
+
+def _set_progress(job: Dict[str, Any], event: Dict[str, Any]):
+    job["progress"] = event
+    _publish(job, event)
+
+
+async def _run_job(job: Dict[str, Any], fn: Callable, args: tuple, kwargs: dict):
+    job["status"] = "running"
+    _set_stage(job, "started")
+    token = progress.listen(lambda event: _set_progress(job, event))
+    try:
+        result = await fn(*args, on_stage=lambda stage: _set_stage(job, stage), **kwargs)
+        if isinstance(result, dict) and result.get("success") is False:
+            job["status"] = "failed"
+            job["error"] = result.get("error")
+        else:
+            job["status"] = "succeeded"
+        job["result"] = result
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+        raise
+    except HTTPException as e:
+        job["status"] = "failed"
+        job["error"] = str(e.detail)
+    except Exception as e:
+        print(f"[JOB {job['id']}] failed: {type(e).__name__}: {e}")
+        job["status"] = "failed"
+        job["error"] = f"Unexpected error: {str(e)}"
+    finally:
+        progress.stop_listening(token)
+        _set_stage(job, "done")
+        _publish(job, _done_event(job))
+
+
+def _release_admission(job: Dict[str, Any]):
+    if job["id"] in _admitted:
+        _admitted.discard(job["id"])
+        render_pool.release()
+
+
+async def _worker(index: int):
+    while True:
+        job, fn, args, kwargs = await _queue.get()
+        try:
+            if job["status"] == "cancelled":
+                continue
+            task = asyncio.ensure_future(_run_job(job, fn, args, kwargs))
+            _running[job["id"]] = task
+            # wait() rather than await, so cancelling the job does not cancel the worker
+            await asyncio.wait({task})
+            if job["status"] not in FINISHED:
+                # Cancelled before it got to run
+                job["status"] = "cancelled"
+                _set_stage(job, "done")
+                _publish(job, _done_event(job))
+        finally:
+            _running.pop(job["id"], None)
+            _release_admission(job)
+            _queue.task_done()
+
+
+async def submit_job(kind: str, fn: Callable, *args, **kwargs) -> Dict[str, Any]:
+    """
+    Queue `fn(*args, on_stage=..., **kwargs)` on the worker pool and return the job record.
+    `fn` must be an async callable accepting an `on_stage(stage: str)` callback.
+    """
+    return await _submit(kind, fn, args, kwargs)
+
+
+async def submit_admitted_job(kind: str, fn: Callable, *args, **kwargs) -> Dict[str, Any]:
+    """
+    submit_job for render work: takes a render_pool admission first (429 when the queue is
+    full) and holds it until the job finishes, or until it is cancelled while still queued.
+    """
+    render_pool.admit()
+    try:
+        return await _submit(kind, fn, args, kwargs, admitted=True)
+    except BaseException:
+        render_pool.release()
+        raise
+
+
+async def _submit(kind: str, fn: Callable, args: tuple, kwargs: dict, admitted: bool = False) -> Dict[str, Any]:
+    _ensure_workers()
+    _prune_jobs()
+    job = {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "status": "queued",
+        "stage": "queued",
+        "result": None,
+        "error": None,
+        "progress": None,
+        "created_at": _now(),
+        "updated_at": _now(),
+        "last_event_at": _now(),
+    }
+    _jobs[job["id"]] = job
+    if admitted:
+        _admitted.add(job["id"])
+    await _queue.put((job, fn, args, kwargs))
+    return job
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    return _jobs.get(job_id)
+
+
+def cancel_job(job: Dict[str, Any]) -> bool:
+    """Cancel a queued or running job; returns False if it had already finished."""
+    if job["status"] in FINISHED:
+        return False
+    task = _running.get(job["id"])
+    if task is not None:
+        task.cancel()
+    else:
+        job["status"] = "cancelled"
+        # The worker skips it later; give its admission back now
+        _release_admission(job)
+        _set_stage(job, "done")
+        _publish(job, _done_event(job))
+    print(f"[JOB {job['id']}] cancelled")
+    return True
+
+
+async def job_events(job: Dict[str, Any]) -> AsyncIterator[Optional[Dict[str, Any]]]:
+    """
+    Yield a job's events as they happen, starting with its current stage and progress and
+    ending with a "done" event. While a render prints nothing for RENDER_STALL_SECONDS a
+    "stalled" event is yielded; None is yielded periodically as a keepalive.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    _subscribers.setdefault(job["id"], []).append(queue)
+    try:
+        yield {"type": "stage", "stage": job["stage"]}
+        if job["progress"] is not None:
+            yield job["progress"]
+        if job["status"] in FINISHED:
+            yield _done_event(job)
+            return
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=min(KEEPALIVE_SECONDS, RENDER_STALL_SECONDS))
+            except asyncio.TimeoutError:
+                idle = _now() - job["last_event_at"]
+                if job["stage"] == "render" and idle >= RENDER_STALL_SECONDS:
+                    yield {"type": "stalled", "stage": job["stage"], "idle_seconds": round(idle)}
+                else:
+                    yield None
+                continue
+            yield event
+            if event["type"] == "done":
+                return
+    finally:
+        _subscribers[job["id"]].remove(queue)
+        if not _subscribers[job["id"]]:
+            del _subscribers[job["id"]]
+
+
+def queue_depth() -> int:
+    return _queue.qsize() if _queue is not None else 0
@@ -0,0 +1,164 @@
+import os
+import uuid
+import shutil
+import asyncio
+import subprocess
+
+from controllers.render_pool import render_pool
+from controllers.manim_workers import manim_workers, USE_MANIM_WORKERS
+from controllers.container_pool import container_pool, USE_CONTAINER_POOL, MANIM_IMAGE
+from utils.process import run_process
+from utils.progress import ManimProgress, listening, tail_file
+
+RENDER_TIMEOUT_SECONDS = int(os.getenv("RENDER_TIMEOUT_SECONDS", "600"))
+
+# "preview" is the first tier of a preview-then-final render: low quality at a smaller size and frame rate.
+QUALITY_FLAGS = {"preview": "-ql", "low": "-ql", "medium": "-qm", "high": "-qh"}
+PREVIEW_RESOLUTION = os.getenv("PREVIEW_RESOLUTION", "320,180")
+PREVIEW_FPS = int(os.getenv("PREVIEW_FPS", "10"))
+
+
+def use_native_manim() -> bool:
+    return os.getenv("USE_NATIVE_MANIM", "false").lower() == "true"
+
+
+def quality_overrides(quality: str) -> dict:
+    """Manim config applied on top of the quality preset (only the preview tier has any)."""
+    if quality != "preview":
+        return {}
+    width, height = (int(v) for v in PREVIEW_RESOLUTION.split(","))
+    return {"pixel_width": width, "pixel_height": height, "frame_rate": PREVIEW_FPS}
+
+
+def manim_extra_args(animation_range: tuple[int, int] | None, dry_run: bool = False,
+                     quality: str | None = None) -> list[str]:
+    """
+    CLI flags for rendering only animations `start..end` (inclusive; earlier ones are skipped
+    without writing frames), for a dry run that executes construct() without writing any,
+    and for the preview tier's resolution and frame rate.
+    """
+    args = ["--dry_run"] if dry_run else []
+    if animation_range is not None:
+        start, end = animation_range
+        args += ["-n", f"{start},{end}"]
+    if quality == "preview":
+        args += ["-r", PREVIEW_RESOLUTION, "--fps", str(PREVIEW_FPS)]
+    return args
+
+
+def build_render_cmd(tmp: str, filename: str, scene_class: str, quality_flag: str, out_name: str,
+                     container_name: str | None, extra_args: list[str] | None = None) -> list[str]:
+    """Build the Manim command line, either native or inside the sandbox container."""
+    extra_args = extra_args or []
+    if use_native_manim():
+        # Run Manim directly in this environment
+        # Ensure manim is installed: pip install manim
+        # Manim CLI: manim -ql filename.py SceneName -o outputname --media_dir ...
+        return [
+            "manim",
+            quality_flag,
+            os.path.join(tmp, filename),
+            scene_class,
+            "--media_dir", os.path.join(tmp, "media"),
+            "-o", out_name,
+            *extra_args
+        ]
+    # Use Docker (Default for local dev if they have the image)
+    return [
+        "docker", "run", "--rm",
+        "--name", container_name,
+        "--read-only=false",
+        "--network", "none",
+        "-v", f"{tmp}:/work",
+        MANIM_IMAGE,
+        quality_flag, f"/work/{filename}", scene_class,
+        "--media_dir", "/work/media",
+        "-o", out_name,
+        *extra_args
+    ]
+
+
+def render_container_name(tmp: str) -> str | None:
+    """Unique docker container name for a one-off render, or None for native renders."""
+    if use_native_manim():
+        return None
+    return f"manimjob-{uuid.uuid4().hex[:12]}"
+
+
+async def run_manim(tmp: str, filename: str, scene_class: str, quality: str, out_name: str,
+                    animation_range: tuple[int, int] | None = None,
+                    total_animations: int | None = None, dry_run: bool = False,
+                    timeout: float | None = None) -> tuple[int, str, str]:
+    """
+    Render `tmp/filename` into `tmp/media`, holding a render slot while it runs.
+    Native renders go to a warm worker process and docker renders to a pooled sandbox
+    container; either falls back to a one-off manim/docker run if the pool cannot start one.
+    Manim's progress bars are reported through utils.progress while a listener is installed.
+    `dry_run` only executes construct() to surface runtime errors; nothing is written.
+    Returns (returncode, stdout, stderr).
+    """
+    use_native = use_native_manim()
+    extra_args = manim_extra_args(animation_range, dry_run, quality)
+    timeout = timeout or RENDER_TIMEOUT_SECONDS
+    on_output = ManimProgress(total_animations, animation_range).feed if listening() and not dry_run else None
+    async with render_pool.slot():
+        if use_native and USE_MANIM_WORKERS:
+            log_path = os.path.join(tmp, "render.log")
+            tail = asyncio.create_task(tail_file(log_path, on_output)) if on_output else None
+            try:
+                return await manim_workers.render(
+                    os.path.join(tmp, filename), scene_class, quality,
+                    os.path.join(tmp, "media"), out_name, log_path,
+                    timeout, animation_range=animation_range, dry_run=dry_run,
+                    config=quality_overrides(quality),
+                )
+            except subprocess.TimeoutExpired:
+                raise
+            except Exception as e:
+                print(f"Manim worker unavailable ({type(e).__name__}: {e}), falling back to the manim CLI")
+            finally:
+                if tail is not None:
+                    tail.cancel()
+
+        quality_flag = QUALITY_FLAGS.get(quality, "-ql")
+        if not use_native and USE_CONTAINER_POOL:
+            try:
+                return await container_pool.render(tmp, filename, scene_class, quality_flag, out_name,
+                                                   timeout, extra_args=extra_args, on_output=on_output)
+            except subprocess.TimeoutExpired:
+                raise
+            except Exception as e:
+                print(f"Sandbox container pool unavailable ({type(e).__name__}: {e}), falling back to docker run")
+
+        container_name = render_container_name(tmp)
+        cmd = build_render_cmd(tmp, filename, scene_class, quality_flag, out_name, container_name, extra_args)
+        return await run_process(cmd, timeout, container_name=container_name, on_output=on_output)
+
+
+_warned_ffmpeg_container = False
+
+
+async def run_ffmpeg(args: list[str], workdir: str, timeout: float = 300) -> tuple[int, str, str]:
+    """
+    Run ffmpeg with paths relative to `workdir`. Uses the host ffmpeg when installed (the
+    API image ships one), otherwise the one in the Manim image via a one-off container per
+    call (no network, workdir mounted at /work).
+    """
+    global _warned_ffmpeg_container
+    if shutil.which("ffmpeg"):
+        return await run_process(["ffmpeg", "-hide_banner", "-y", *args], timeout, cwd=workdir)
+    if not _warned_ffmpeg_container:
+        _warned_ffmpeg_container = True
+        print("ffmpeg is not installed; running it in a container per call (install ffmpeg to avoid this)")
+    container_name = f"ffmpeg-{uuid.uuid4().hex[:12]}"
+    cmd = [
+        "docker", "run", "--rm",
+        "--name", container_name,
+        "--network", "none",
+        "-v", f"{workdir}:/work",
+        "-w", "/work",
+        "--entrypoint", "ffmpeg",
+        MANIM_IMAGE,
+        "-hide_banner", "-y", *args,
+    ]
+    return await run_process(cmd, timeout, container_name=container_name)
@@ -0,0 +1,191 @@
+import os
+import sys
+import json
+import asyncio
+import subprocess
+from typing import Any, Dict, List, Optional, Tuple
+
+from controllers.render_pool import render_pool
+
+USE_MANIM_WORKERS = os.getenv("USE_MANIM_WORKERS", "true").lower() == "true"
+MANIM_WORKER_MAX_JOBS = int(os.getenv("MANIM_WORKER_MAX_JOBS", "50"))
+MANIM_WORKER_MAX_RSS_MB = int(os.getenv("MANIM_WORKER_MAX_RSS_MB", "1024"))
+MANIM_WORKER_START_TIMEOUT = int(os.getenv("MANIM_WORKER_START_TIMEOUT", "120"))
+
+# Reply lines carry a traceback at most (the render log stays in `log_path`), but allow far
+# more than asyncio's 64 KB default so a deep traceback cannot break the protocol.
+PROTOCOL_LINE_LIMIT = 16 * 1024 * 1024
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "utils", "manim_worker.py")
+
+
+class ManimWorker:
+    """One long-lived `utils/manim_worker.py` process with Manim already imported."""
+    def __init__(self, proc: asyncio.subprocess.Process):
+        self.proc = proc
+        self.jobs = 0
+        self.rss_mb = 0.0
+
+    @classmethod
+    async def start(cls) -> "ManimWorker":
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=PROTOCOL_LINE_LIMIT,
+        )
+        worker = cls(proc)
+        try:
+            line = await asyncio.wait_for(proc.stdout.readline(), timeout=MANIM_WORKER_START_TIMEOUT)
+            if not line or not json.loads(line).get("ready"):
+                raise RuntimeError("manim worker exited before becoming ready")
+        except BaseException:
+            await worker.stop()
+            raise
+        return worker
+
+    @property
+    def alive(self) -> bool:
+        return self.proc.returncode is None
+
+    def exhausted(self) -> bool:
+        return self.jobs >= MANIM_WORKER_MAX_JOBS or self.rss_mb > MANIM_WORKER_MAX_RSS_MB
+
+    async def run(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        self.proc.stdin.write((json.dumps(job) + "\n").encode())
+        await self.proc.stdin.drain()
+        line = await self.proc.stdout.readline()
+        if not line:
+            raise RuntimeError(f"manim worker exited with code {await self.proc.wait()}")
+        self.jobs += 1
+        result = json.loads(line)
+        self.rss_mb = result.get("rss_mb") or 0.0
+        return result
+
+    async def stop(self):
+        if self.alive:
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+        await self.proc.wait()
+
+
+def _read_log(log_path: str) -> str:
+    try:
+        with open(log_path, encoding="utf-8", errors="ignore") as log:
+            return log.read()
+    except FileNotFoundError:
+        return ""
+
+
+class ManimWorkerPool:
+    """
+    Keeps up to `size` warm workers. Concurrency is already bounded by the render slot
+    pool, so acquiring never waits: it takes an idle worker or starts a new one.
+    Workers are recycled after MANIM_WORKER_MAX_JOBS jobs or above MANIM_WORKER_MAX_RSS_MB,
+    and killed (then replaced) on timeout, cancellation or crash.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: List[ManimWorker] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.started = 0
+        self.recycled = 0
+        self.busy = 0
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Subprocess transports belong to the loop that created them.
+            for worker in self._idle:
+                try:
+                    worker.proc.kill()
+                except Exception:
+                    pass
+            self._idle = []
+            self._loop = loop
+
+    async def _spawn(self) -> ManimWorker:
+        worker = await ManimWorker.start()
+        self.started += 1
+        return worker
+
+    async def _replenish(self):
+        try:
+            if len(self._idle) + self.busy < self.size:
+                self._idle.append(await self._spawn())
+        except Exception as e:
+            print(f"Failed to pre-start manim worker: {e}")
+
+    async def _acquire(self) -> ManimWorker:
+        self._bind_loop()
+        while self._idle:
+            worker = self._idle.pop()
+            if worker.alive:
+                return worker
+        return await self._spawn()
+
+    async def _release(self, worker: ManimWorker):
+        if worker.exhausted() or not worker.alive or len(self._idle) >= self.size:
+            self.recycled += 1
+            await worker.stop()
+            asyncio.get_running_loop().create_task(self._replenish())
+            return
+        self._idle.append(worker)
+
+    async def warm(self):
+        """Start workers until `size` are idle or busy."""
+        self._bind_loop()
+        try:
+            while len(self._idle) + self.busy < self.size:
+                self._idle.append(await self._spawn())
+        except Exception as e:
+            print(f"Failed to pre-start manim workers: {e}")
+
+    async def render(self, script_path: str, scene_class: str, quality: str, media_dir: str,
+                     output_name: str, log_path: str, timeout: float,
+                     animation_range: Optional[Tuple[int, int]] = None, dry_run: bool = False,
+                     config: Optional[Dict[str, Any]] = None) -> Tuple[int, str, str]:
+        """Render on a warm worker; same contract as utils.process.run_process."""
+        worker = await self._acquire()
+        self.busy += 1
+        job = {
+            "script_path": script_path,
+            "scene_class": scene_class,
+            "quality": quality,
+            "media_dir": media_dir,
+            "output_name": output_name,
+            "log_path": log_path,
+            "animation_range": list(animation_range) if animation_range else None,
+            "dry_run": dry_run,
+            "config": config or {},
+        }
+        try:
+            result = await asyncio.wait_for(worker.run(job), timeout=timeout)
+        except asyncio.TimeoutError:
+            await worker.stop()
+            self.recycled += 1
+            raise subprocess.TimeoutExpired(script_path, timeout)
+        except BaseException:
+            await asyncio.shield(worker.stop())
+            self.recycled += 1
+            raise
+        finally:
+            self.busy -= 1
+        await self._release(worker)
+        return result["returncode"], await asyncio.to_thread(_read_log, log_path), result.get("stderr", "")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "busy": self.busy,
+            "started": self.started,
+            "recycled": self.recycled,
+            "max_jobs": MANIM_WORKER_MAX_JOBS,
+            "max_rss_mb": MANIM_WORKER_MAX_RSS_MB,
+        }
+
+
+manim_workers = ManimWorkerPool(size=int(os.getenv("MANIM_WORKERS", str(render_pool.slots))))
@@ -0,0 +1,130 @@
+import os
+import re
+import shutil
+import asyncio
+import hashlib
+import tempfile
+from contextlib import asynccontextmanager
+from typing import Any, Dict
+
+from controllers.workspace import collect_output, output_path
+
+MEDIA_CACHE_ROOT = os.getenv(
+    "MEDIA_CACHE_ROOT",
+    os.path.join(tempfile.gettempdir(), "manim-media-cache"),
+)
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(5 * 1024 * 1024 * 1024)))
+
+
+def chat_media_key(chat_id: str) -> str:
+    return f"chat-{chat_id}"
+
+
+def lineage_media_key(code: str) -> str:
+    """Key for renders outside a chat: retries and auto-fixes of the same original code share it."""
+    return f"code-{hashlib.sha256(code.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, fn))
+            except OSError:
+                pass
+    return total
+
+
+class MediaCache:
+    """
+    Persistent Manim --media_dir per chat or code lineage, so Manim's own
+    partial_movie_files hashing can skip animations that did not change between
+    retries and follow-up messages. Renders sharing a key are serialized; least
+    recently used directories are removed once the cache exceeds its byte budget.
+    """
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._locks: Dict[str, asyncio.Lock] = {}
+        # Leases holding or waiting for each key's lock; the lock is dropped at zero
+        self._lock_refs: Dict[str, int] = {}
+        self._leased: Dict[str, int] = {}
+        self.evictions = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, re.sub(r"[^A-Za-z0-9_.-]", "_", key))
+
+    @asynccontextmanager
+    async def lease(self, key: str):
+        """Yield the media dir for `key`; it is not evicted while leased."""
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_refs[key] = self._lock_refs.get(key, 0) + 1
+        path = self._path(key)
+        try:
+            async with lock:
+                self._leased[path] = self._leased.get(path, 0) + 1
+                try:
+                    os.makedirs(path, exist_ok=True)
+                    yield path
+                finally:
+                    if os.path.isdir(path):
+                        os.utime(path)
+                    self._leased[path] -= 1
+                    if not self._leased[path]:
+                        del self._leased[path]
+        finally:
+            self._lock_refs[key] -= 1
+            if not self._lock_refs[key]:
+                del self._lock_refs[key]
+                del self._locks[key]
+        await asyncio.to_thread(self.evict)
+
+    @asynccontextmanager
+    async def attach(self, key: str, workdir: str, out_name: str):
+        """
+        Lease `key` and move its media dir in as `workdir/media` for one render. On exit the
+        final `<out_name>.mp4` is moved to `workdir/<out_name>.mp4` and the rest (partial movies,
+        Tex/text caches) goes back into the cache.
+        """
+        media = os.path.join(workdir, "media")
+        async with self.lease(key) as path:
+            await asyncio.to_thread(shutil.move, path, media)
+            try:
+                yield media
+            finally:
+                if os.path.isdir(media):
+                    await asyncio.to_thread(collect_output, media, out_name, output_path(workdir, out_name))
+                    await asyncio.to_thread(shutil.move, media, path)
+                else:
+                    os.makedirs(path, exist_ok=True)
+
+    def evict(self):
+        if not os.path.isdir(self.root):
+            return
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                entries.append((os.path.getmtime(path), path, _dir_size(path)))
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path in self._leased:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        entries = os.listdir(self.root) if os.path.isdir(self.root) else []
+        return {
+            "entries": len(entries),
+            "max_bytes": self.max_bytes,
+            "leased": len(self._leased),
+            "evictions": self.evictions,
+        }
+
+
+media_cache = MediaCache(MEDIA_CACHE_ROOT, MEDIA_CACHE_MAX_BYTES)
@@ -0,0 +1,87 @@
+import os
+import shutil
+
+from controllers.manim_runner import run_ffmpeg
+from controllers.workspace import output_path
+
+# Move the moov atom to the front (no re-encode) so players can start before the whole file arrives.
+VIDEO_FASTSTART = os.getenv("VIDEO_FASTSTART", "true").lower() == "true"
+# Also cut an HLS playlist (stream copy, so segments start on the encoder's keyframes).
+VIDEO_HLS = os.getenv("VIDEO_HLS", "false").lower() == "true"
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", "2"))
+PACKAGING_TIMEOUT_SECONDS = int(os.getenv("PACKAGING_TIMEOUT_SECONDS", "120"))
+
+HLS_DIR = "hls"
+HLS_PLAYLIST = "index.m3u8"
+
+
+async def package_video(workdir: str, out_name: str, hls: bool = VIDEO_HLS) -> bool:
+    """
+    Post-render packaging of `workdir/<out_name>.mp4`, in place: remux with +faststart and,
+    with `hls`, write `workdir/hls/index.m3u8` and its segments. A failed step is logged and
+    skipped, leaving the plain render. Returns whether an HLS package was produced.
+    """
+    name = f"{out_name}.mp4"
+    if VIDEO_FASTSTART:
+        fast = f"{out_name}.faststart.mp4"
+        returncode, _, stderr = await run_ffmpeg(
+            ["-i", name, "-map", "0", "-c", "copy", "-movflags", "+faststart", fast],
+            workdir, timeout=PACKAGING_TIMEOUT_SECONDS,
+        )
+        if returncode == 0 and os.path.exists(os.path.join(workdir, fast)):
+            os.replace(os.path.join(workdir, fast), output_path(workdir, out_name))
+        else:
+            print(f"Faststart remux failed, keeping the original file: {stderr.strip()[-500:]}")
+
+    if not hls:
+        return False
+    os.makedirs(os.path.join(workdir, HLS_DIR), exist_ok=True)
+    returncode, _, stderr = await run_ffmpeg(
+        ["-i", name, "-map", "0", "-c", "copy", "-f", "hls",
+         "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+         "-hls_segment_filename", os.path.join(HLS_DIR, "segment%03d.ts"),
+         os.path.join(HLS_DIR, HLS_PLAYLIST)],
+        workdir, timeout=PACKAGING_TIMEOUT_SECONDS,
+    )
+    if returncode != 0 or not os.path.exists(os.path.join(workdir, HLS_DIR, HLS_PLAYLIST)):
+        print(f"HLS packaging failed, serving the mp4 only: {stderr.strip()[-500:]}")
+        shutil.rmtree(os.path.join(workdir, HLS_DIR), ignore_errors=True)
+        return False
+    return True
+
+
+# Still and animated previews cut from each render, so listings need not load the mp4.
+VIDEO_THUMBNAILS = os.getenv("VIDEO_THUMBNAILS", "true").lower() == "true"
+THUMBNAIL_INTERVAL_SECONDS = int(os.getenv("THUMBNAIL_INTERVAL_SECONDS", "2"))
+ANIMATED_PREVIEW_SECONDS = int(os.getenv("ANIMATED_PREVIEW_SECONDS", "6"))
+
+SPRITE_COLUMNS = 10
+# Artifact kind -> file suffix, stored next to the video as `<video stem>.<suffix>`.
+ARTIFACTS = {"poster": "poster.jpg", "sprite": "sprite.jpg", "animated_preview": "preview.webp"}
+
+
+async def extract_artifacts(workdir: str, out_name: str) -> list[str]:
+    """
+    In one ffmpeg pass over `workdir/<out_name>.mp4`, write `<out_name>.poster.jpg` (the last
+    frame, which for a Manim scene shows the finished diagram), `<out_name>.sprite.jpg` (a
+    10x10 sheet of seek thumbnails, one every THUMBNAIL_INTERVAL_SECONDS) and
+    `<out_name>.preview.webp` (a small looping clip). Returns the artifact kinds produced.
+    """
+    outputs = {kind: f"{out_name}.{suffix}" for kind, suffix in ARTIFACTS.items()}
+    filters = ";".join([
+        "[0:v]split=3[p][s][a]",
+        "[p]fps=2,scale=640:-2[poster]",
+        f"[s]fps=1/{THUMBNAIL_INTERVAL_SECONDS},scale=160:-2,tile={SPRITE_COLUMNS}x{SPRITE_COLUMNS}[sprite]",
+        f"[a]trim=duration={ANIMATED_PREVIEW_SECONDS},fps=10,scale=320:-2[preview]",
+    ])
+    returncode, _, stderr = await run_ffmpeg(
+        ["-i", f"{out_name}.mp4", "-filter_complex", filters,
+         # -update keeps overwriting one image, leaving the last frame
+         "-map", "[poster]", "-update", "1", "-q:v", "3", outputs["poster"],
+         "-map", "[sprite]", "-frames:v", "1", "-q:v", "5", outputs["sprite"],
+         "-map", "[preview]", "-c:v", "libwebp", "-loop", "0", "-quality", "60", outputs["animated_preview"]],
+        workdir, timeout=PACKAGING_TIMEOUT_SECONDS,
+    )
+    if returncode != 0:
+        print(f"Thumbnail extraction failed: {stderr.strip()[-500:]}")
+    return [kind for kind, name in outputs.items() if os.path.exists(os.path.join(workdir, name))]
@@ -1,14 +1,24 @@
 import os
-import tempfile
+import re
 import subprocess
-import shutil
 import uuid
 import ast
-import time
+import asyncio
+import hashlib
+from collections import OrderedDict
 from fastapi import HTTPException
-from fastapi.responses import FileResponse, JSONResponse
-from controllers.generation_controller import generate_manim_code
+from fastapi.responses import JSONResponse
+from controllers.generation_controller import generate_manim_code, stream_manim_code, remember_generation, GENAI_STREAM
 from controllers.validation_controller import sanitize_and_validate
+from controllers.manim_runner import run_manim, RENDER_TIMEOUT_SECONDS
+from controllers.segmented_render import render_segmented, count_animations
+from controllers.media_cache import media_cache, lineage_media_key
+from controllers.workspace import new_workspace, discard_workspace, output_path, collect_output, video_store
+from controllers.packaging import (package_video, extract_artifacts, VIDEO_HLS, HLS_DIR, HLS_PLAYLIST,
+                                  VIDEO_THUMBNAILS, ARTIFACTS)
+from controllers.job_controller import submit_admitted_job
+from controllers.upload_controller import (uploader, WriteBehindQueue, UPLOAD_WRITE_BEHIND, UPLOAD_QUEUE_PATH,
+                                          UPLOAD_MAX_ATTEMPTS, UPLOAD_CONCURRENCY)
 
 try:
     from supabase import create_client
@@ -29,6 +39,197 @@ else:
 
 FORBIDDEN = {"os", "sys", "subprocess", "socket", "open", "__import__", "eval", "exec", "shutil", "pathlib"}
 
+# Speculative generation: race this many LLM candidates through validation and a dry run (1 = off).
+SPECULATIVE_CANDIDATES = int(os.getenv("SPECULATIVE_CANDIDATES", "1"))
+SPECULATIVE_MAX_CANDIDATES = int(os.getenv("SPECULATIVE_MAX_CANDIDATES", "4"))
+DRY_RUN_TIMEOUT_SECONDS = int(os.getenv("DRY_RUN_TIMEOUT_SECONDS", "20"))
+# Dry-run each retry_render attempt first so runtime errors reach fix_manim_code before a real render.
+RENDER_PREFLIGHT = os.getenv("RENDER_PREFLIGHT", "true").lower() == "true"
+
+RENDERER_VERSION = os.getenv("RENDERER_VERSION", "manim-0.19")
+RENDER_CACHE_MAX_ENTRIES = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "256"))
+RENDER_CACHE_MAX_BYTES = int(os.getenv("RENDER_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+class RenderCache:
+    """
+    LRU map from a content hash of (code, scene_class, quality, renderer version)
+    to an already rendered mp4 in generated_videos/ and its Supabase URL.
+    Bounded by entry count and by the total size of the referenced files.
+    Evicting an entry only forgets it; the video file itself is left in place.
+    """
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(code: str, scene_class: str, quality: str) -> str:
+        h = hashlib.sha256()
+        for part in (code, scene_class, quality, RENDERER_VERSION):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is not None and not os.path.exists(entry["local_path"]):
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, local_path: str, supabase_url: str | None):
+        if key in self._entries:
+            self._remove(key)
+        size = os.path.getsize(local_path)
+        self._entries[key] = {"local_path": local_path, "supabase_url": supabase_url, "size": size}
+        self.total_bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry["size"]
+
+    def set_url(self, local_path: str, supabase_url: str):
+        """Record the public URL of a video that was cached while its upload was pending."""
+        for entry in self._entries.values():
+            if entry["local_path"] == local_path:
+                entry["supabase_url"] = supabase_url
+
+    def contains(self, key: str) -> bool:
+        """Like get() without touching recency or the hit/miss counters."""
+        entry = self._entries.get(key)
+        return entry is not None and os.path.exists(entry["local_path"])
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+render_cache = RenderCache(RENDER_CACHE_MAX_ENTRIES, RENDER_CACHE_MAX_BYTES)
+
+def upload_video(dest_path: str) -> str | None:
+    """
+    Upload a rendered video to the Supabase bucket and return its public URL (None if skipped or failed).
+    Blocking (chunked, resumable upload); call it with asyncio.to_thread from async code.
+    """
+    if _supabase is None:
+        print("Supabase client not initialized. Check SUPABASE_URL and SUPABASE_KEY env vars")
+        return None
+    try:
+        bucket = SUPABASE_BUCKET
+        dest_name = f"{uuid.uuid4().hex[:8]}-{os.path.basename(dest_path)}"
+        print(f"Uploading to Supabase bucket '{bucket}' with name '{dest_name}'")
+
+        if uploader is not None:
+            uploader.upload(dest_path, bucket, dest_name)
+        else:
+            with open(dest_path, "rb") as f:
+                result = _supabase.storage.from_(bucket).upload(dest_name, f)
+                print(f"Upload result: {result}")
+
+        supabase_url = _supabase.storage.from_(bucket).get_public_url(dest_name)
+        print(f"Supabase public URL: {supabase_url}")
+        if not supabase_url:
+            print("Warning: Supabase returned empty URL")
+        return supabase_url
+    except Exception as e:
+        print(f"Supabase upload failed: {type(e).__name__}: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+def cache_rendered_video(key: str, dest_path: str, supabase_url: str | None, upload_pending: bool = False):
+    """Remember a render unless its upload was attempted and failed (so a later request retries it)."""
+    if supabase_url or upload_pending or _supabase is None:
+        render_cache.put(key, dest_path, supabase_url)
+
+def local_video_url(filename: str) -> str:
+    """URL of a video served by this API from generated_videos/."""
+    return f"/api/videos/{filename}"
+
+def _video_uploaded(local_path: str, local_url: str, public_url: str):
+    """Swap a write-behind video's local URL for its public one wherever it was stored."""
+    video_store.mark_uploaded(local_path)
+    render_cache.set_url(local_path, public_url)
+    if _supabase is not None:
+        _supabase.table("generated_videos").update({"video_url": public_url}).eq("video_url", local_url).execute()
+
+write_behind = WriteBehindQueue(UPLOAD_QUEUE_PATH, upload_video, _video_uploaded, UPLOAD_MAX_ATTEMPTS, UPLOAD_CONCURRENCY)
+
+async def store_video(dest_path: str) -> tuple[str | None, bool]:
+    """
+    Upload a rendered video, or with UPLOAD_WRITE_BEHIND queue the upload and return at once.
+    Returns (supabase_url, upload_pending); while pending, the video plays from local_video_url.
+    """
+    if UPLOAD_WRITE_BEHIND and _supabase is not None:
+        await write_behind.enqueue(dest_path, local_video_url(os.path.basename(dest_path)))
+        result = None, True
+    else:
+        result = await asyncio.to_thread(upload_video, dest_path), False
+        if result[0]:
+            video_store.mark_uploaded(dest_path)
+    await asyncio.to_thread(evict_videos)
+    return result
+
+def evict_videos():
+    """
+    Keep generated_videos/ within its byte budget. Only videos marked uploaded (by the
+    sync upload or the write-behind queue) are evicted; a failed, pending or skipped
+    upload leaves the local file as the only copy.
+    """
+    video_store.evict()
+
+def _pending(cached: dict) -> bool:
+    return cached["supabase_url"] is None and UPLOAD_WRITE_BEHIND and _supabase is not None
+
+def playback_fields(local_path: str, supabase_url: str | None, upload_pending: bool = False) -> dict:
+    """
+    `video_url` to play a result from: the public URL once uploaded, else the local one;
+    `hls_url` when the render was also packaged as HLS.
+    """
+    filename = os.path.basename(local_path)
+    has_hls = os.path.isdir(video_store.hls_dir(filename))
+    return {
+        "video_url": supabase_url or local_video_url(filename),
+        "hls_url": f"/api/videos/hls/{os.path.splitext(filename)[0]}/{HLS_PLAYLIST}" if has_hls else None,
+        "upload_pending": upload_pending,
+        **artifact_urls(filename),
+    }
+
+# Stored video names; uploaded copies are named `<8 hex>-<stored name>`.
+_STORED_VIDEO_RE = re.compile(r"(render-[0-9a-f]{8})\.mp4$")
+
+def artifact_urls(video_url: str | None) -> dict:
+    """`poster_url`, `sprite_url` and `animated_preview_url` of a stored or uploaded video, where they exist."""
+    urls = {f"{kind}_url": None for kind in ARTIFACTS}
+    m = _STORED_VIDEO_RE.search((video_url or "").split("?")[0])
+    if m is None:
+        return urls
+    for kind, suffix in ARTIFACTS.items():
+        name = video_store.artifact_name(f"{m.group(1)}.mp4", suffix)
+        if os.path.exists(video_store.path(name)):
+            urls[f"{kind}_url"] = local_video_url(name)
+    return urls
+
 def is_code_safe(code: str):
     try:
         tree = ast.parse(code)
@@ -51,114 +252,178 @@ def is_code_safe(code: str):
                 return False, f"forbidden attribute {attr}"
     return True, "ok"
 
+async def render_scene(tmp: str, filename: str, scene_class: str, quality: str, out_name: str,
+                       code: str, segmented: bool = False, media_key: str | None = None) -> tuple[int, str, str]:
+    """
+    Render in one process, or split across processes when `segmented` and the scene allows it.
+    With `media_key`, a single-process render runs on that key's persistent media dir so unchanged
+    animations are reused from earlier renders. Segments render in their own media dirs and skip
+    that cache. Either way the output is left at `tmp/<out_name>.mp4`.
+    """
+    result = None
+    if segmented:
+        result = await render_segmented(tmp, filename, scene_class, quality, out_name, code)
+    if result is None:
+        total_animations = count_animations(code, scene_class)
+        if media_key is not None:
+            async with media_cache.attach(media_key, tmp, out_name):
+                result = await run_manim(tmp, filename, scene_class, quality, out_name,
+                                         total_animations=total_animations)
+        else:
+            result = await run_manim(tmp, filename, scene_class, quality, out_name,
+                                     total_animations=total_animations)
+    media = os.path.join(tmp, "media")
+    if result[0] == 0 and not os.path.exists(output_path(tmp, out_name)) and os.path.isdir(media):
+        await asyncio.to_thread(collect_output, media, out_name, output_path(tmp, out_name))
+    return result
+
+async def store_output(tmp: str, out_name: str, quality: str) -> str:
+    """
+    Package the render in `tmp` for streaming, cut its poster/thumbnails, and move it all into
+    the video store. Packaging and thumbnail failures only cost those extras.
+    """
+    try:
+        has_hls = await package_video(tmp, out_name, hls=VIDEO_HLS and quality != "preview")
+    except Exception as e:
+        print(f"Packaging failed ({type(e).__name__}: {e}), storing the render as is")
+        has_hls = False
+    artifacts = []
+    if VIDEO_THUMBNAILS and quality != "preview":
+        try:
+            artifacts = await extract_artifacts(tmp, out_name)
+        except Exception as e:
+            print(f"Thumbnail extraction failed ({type(e).__name__}: {e})")
+    dest_path = await asyncio.to_thread(video_store.put, output_path(tmp, out_name), out_name)
+    if quality == "preview":
+        # Never uploaded; superseded by the final render
+        await asyncio.to_thread(video_store.mark_disposable, dest_path)
+    if has_hls:
+        await asyncio.to_thread(video_store.put_hls, os.path.join(tmp, HLS_DIR), dest_path)
+    for kind in artifacts:
+        await asyncio.to_thread(video_store.put_artifact, os.path.join(tmp, f"{out_name}.{ARTIFACTS[kind]}"),
+                                dest_path, ARTIFACTS[kind])
+    return dest_path
+
+async def dry_run_scene(code: str, filename: str, scene_class: str) -> tuple[int, str, str]:
+    """Execute the scene's construct() without writing frames; a failure shows up in seconds."""
+    tmp = new_workspace()
+    try:
+        with open(os.path.join(tmp, filename), "w", encoding="utf-8") as f:
+            f.write(code)
+        return await run_manim(tmp, filename, scene_class, "low", "dryrun", dry_run=True,
+                               timeout=DRY_RUN_TIMEOUT_SECONDS)
+    finally:
+        discard_workspace(tmp)
+
+class CandidateRejected(Exception):
+    def __init__(self, code: str | None, reason: str):
+        super().__init__(reason)
+        self.code = code
+
+async def _speculative_candidate(req, index: int) -> tuple[dict, str]:
+    # Only the first candidate may come from the LLM cache; the others must be fresh generations.
+    llm_result = await asyncio.to_thread(generate_manim_code, req.prompt, req.use_cache and index == 0, False)
+    code = llm_result.get("code", "")
+    result = sanitize_and_validate(code)
+    if not result.get("ok"):
+        raise CandidateRejected(code, f"validation failed: {', '.join(result.get('errors', []))}")
+    sanitized_code = result.get("sanitized_code")
+    try:
+        returncode, stdout, stderr = await dry_run_scene(sanitized_code, req.filename, req.scene_class)
+    except subprocess.TimeoutExpired:
+        raise CandidateRejected(code, f"dry run timed out after {DRY_RUN_TIMEOUT_SECONDS} seconds")
+    if returncode != 0:
+        last_line = (stderr.strip().splitlines() or ["no output"])[-1]
+        raise CandidateRejected(code, f"dry run failed: {last_line}")
+    return llm_result, sanitized_code
+
+async def speculative_generate(req, candidates: int) -> tuple[str, str | None]:
+    """
+    Generate `candidates` scripts concurrently and validate + dry-run each as it arrives.
+    The first to pass wins and the rest are cancelled. Returns (code, sanitized_code); when
+    none passes, sanitized_code is None and code is the first generated script, for the
+    regular validate/auto-fix path.
+    """
+    tasks = [asyncio.create_task(_speculative_candidate(req, i)) for i in range(candidates)]
+    rejected = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                llm_result, sanitized_code = await next_done
+            except CandidateRejected as e:
+                print(f"Candidate rejected: {e}")
+                rejected.append(e)
+                continue
+            except Exception as e:
+                print(f"Candidate failed: {type(e).__name__}: {e}")
+                rejected.append(CandidateRejected(None, str(e)))
+                continue
+            print(f"Candidate accepted after {len(rejected)} rejection(s)")
+            remember_generation(req.prompt, llm_result)
+            return llm_result["code"], sanitized_code
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    fallback = next((r.code for r in rejected if r.code), None)
+    if fallback is None:
+        raise RuntimeError(f"all {candidates} candidates failed: {rejected[0] if rejected else 'no result'}")
+    return fallback, None
+
 async def render_code(req):
     safe, msg = is_code_safe(req.code)
     if not safe:
         raise HTTPException(status_code=400, detail=f"code rejected: {msg}")
 
-    tmp = tempfile.mkdtemp(prefix="manimjob-")
+    cache_key = render_cache.key(req.code, req.scene_class, req.quality)
+    cached = render_cache.get(cache_key)
+    if cached is not None:
+        return JSONResponse(status_code=200, content={
+            "filename": os.path.basename(cached["local_path"]),
+            "local_path": cached["local_path"],
+            "supabase_url": cached["supabase_url"],
+            **playback_fields(cached["local_path"], cached["supabase_url"], _pending(cached)),
+            "cached": True,
+        })
+
+    tmp = new_workspace()
     try:
         script_path = os.path.join(tmp, req.filename)
         with open(script_path, "w", encoding="utf-8") as f:
             f.write(req.code)
 
-        quality_flag = {"low": "-ql", "medium": "-pqm", "high": "-pqh"}.get(req.quality, "-pql")
-
-        # Decide whether to use Docker or Native Manim
-        use_native = os.getenv("USE_NATIVE_MANIM", "false").lower() == "true"
+        out_name = "render"
+        returncode, stdout, stderr = await render_scene(tmp, req.filename, req.scene_class, req.quality, out_name,
+                                                        req.code, segmented=req.segmented,
+                                                        media_key=lineage_media_key(req.code))
 
-        if use_native:
-            # Run Manim directly in this environment
-            # Ensure manim is installed: pip install manim
-            output_flag = "-o"
-            # Manim CLI: manim -ql filename.py SceneName -o outputname --media_dir ...
-            cmd = [
-                "manim",
-                quality_flag,
-                script_path,
-                req.scene_class,
-                "--media_dir", os.path.join(tmp, "media"),
-                "-o", out_name
-            ]
-        else:
-            # Use Docker (Default for local dev if they have the image)
-            cmd = [
-                "docker", "run", "--rm",
-                "--read-only=false",
-                "--network", "none",
-                "-v", f"{tmp}:/work",
-                "manim-image:latest",
-                quality_flag, f"/work/{req.filename}", req.scene_class,
-                "--media_dir", "/work/media",
-                "-o", out_name
-            ]
-
-        proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=600)
-        stdout = proc.stdout.decode(errors="ignore")
-        stderr = proc.stderr.decode(errors="ignore")
-
-        if proc.returncode != 0:
+        if returncode != 0:
             return JSONResponse(status_code=500, content={"error": "render failed", "stdout": stdout, "stderr": stderr})
 
-        mp4_path = None
-        for root, dirs, files in os.walk(tmp):
-            for fn in files:
-                if fn.endswith(".mp4"):
-                    mp4_path = os.path.join(root, fn)
-                    break
-            if mp4_path:
-                break
-
-        if not mp4_path or not os.path.exists(mp4_path):
+        mp4_path = output_path(tmp, out_name)
+        if not os.path.exists(mp4_path):
             return JSONResponse(status_code=500, content={"error": "no mp4 produced", "stdout": stdout, "stderr": stderr})
 
-        dest_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "generated_videos")
-        os.makedirs(dest_dir, exist_ok=True)
-        dest_filename = f"{out_name}-{uuid.uuid4().hex[:8]}.mp4"
-        dest_path = os.path.join(dest_dir, dest_filename)
         try:
-            shutil.copy2(mp4_path, dest_path)
+            dest_path = await store_output(tmp, out_name, req.quality)
         except Exception as copy_err:
-            return FileResponse(mp4_path, media_type="video/mp4", filename=os.path.basename(mp4_path))
-
-        supabase_url = None
-        try:
-            if _supabase is not None:
-                bucket = SUPABASE_BUCKET
-                dest_name = f"{uuid.uuid4().hex[:8]}-{os.path.basename(dest_path)}"
-                print(f"Uploading to Supabase bucket '{bucket}' with name '{dest_name}'")
-                
-                with open(dest_path, "rb") as f:
-                    result = _supabase.storage.from_(bucket).upload(dest_name, f)
-                    print(f"Upload result: {result}")
+            return JSONResponse(status_code=500, content={"error": f"failed to save video: {copy_err}"})
 
-                supabase_url = _supabase.storage.from_(bucket).get_public_url(dest_name)
-                print(f"Supabase public URL: {supabase_url}")
-                
-                if supabase_url:
-                    print(f"Uploaded video to Supabase: {supabase_url}")
-                else:
-                    print("Warning: Supabase returned empty URL")
-            else:
-                print("Supabase client not initialized. Check SUPABASE_URL and SUPABASE_KEY env vars")
-        except Exception as e:
-            print(f"Supabase upload failed: {type(e).__name__}: {e}")
-            import traceback
-            traceback.print_exc()
+        supabase_url, upload_pending = await store_video(dest_path)
+        cache_rendered_video(cache_key, dest_path, supabase_url, upload_pending)
 
         response = {
             "filename": os.path.basename(dest_path),
             "local_path": dest_path,
             "supabase_url": supabase_url,
+            **playback_fields(dest_path, supabase_url, upload_pending),
         }
         return JSONResponse(status_code=200, content=response)
     except subprocess.TimeoutExpired:
         raise HTTPException(status_code=504, detail="render timed out")
     finally:
-        try:
-            shutil.rmtree(tmp)
-        except Exception:
-            pass
+        discard_workspace(tmp)
 
 def retry_validation(code: str, max_retries: int = 2) -> tuple[bool, str | None, str | None]:
     for attempt in range(max_retries + 1):
@@ -208,66 +473,78 @@ def fix_manim_code(code: str, error_msg: str) -> str | None:
     
     return None
 
-def retry_render(code: str, filename: str, scene_class: str, quality: str, max_retries: int = 2) -> tuple[bool, str | None, dict | None]:
+def _classify_failure(error_output: str) -> tuple[bool, bool]:
+    """(is_container_error, is_code_error) for the output of a failed manim run."""
+    is_container_error = (
+        "KeyboardInterrupt" in error_output or
+        "ConnectionError" in error_output or
+        "ConnectionRefusedError" in error_output or
+        "docker" in error_output.lower() and "error" in error_output.lower()
+    )
+
+    is_code_error = (
+        "NameError" in error_output or
+        "AttributeError" in error_output or
+        "TypeError" in error_output or
+        "ImportError" in error_output or
+        "IndentationError" in error_output or
+        "SyntaxError" in error_output
+    )
+    return is_container_error, is_code_error
+
+async def preflight_scene(code: str, filename: str, scene_class: str) -> dict | None:
+    """
+    Dry-run the scene before a real render. Returns the logs when construct() raised,
+    or None when it passed or the check itself could not run (timeout, container trouble);
+    the real render then goes ahead as usual.
+    """
+    try:
+        returncode, stdout, stderr = await dry_run_scene(code, filename, scene_class)
+    except subprocess.TimeoutExpired:
+        print(f"Preflight timed out after {DRY_RUN_TIMEOUT_SECONDS} seconds, rendering anyway")
+        return None
+    if returncode == 0:
+        return None
+    is_container_error, _ = _classify_failure(stderr + "\n" + stdout)
+    if is_container_error:
+        return None
+    last_line = (stderr.strip().splitlines() or ["no output"])[-1]
+    return {"stdout": stdout, "stderr": stderr, "error": f"Preflight failed: {last_line}"}
+
+async def retry_render(code: str, filename: str, scene_class: str, quality: str, max_retries: int = 2, segmented: bool = False,
+                       media_key: str | None = None, preflight: bool = True) -> tuple[bool, str | None, dict | None]:
     current_code = code
+    # Auto-fixed retries keep the original code's media dir, so unchanged animations are not re-rendered.
+    media_key = media_key or lineage_media_key(code)
     
     for attempt in range(max_retries + 1):
-        tmp = tempfile.mkdtemp(prefix="manimjob-")
+        tmp = new_workspace()
         try:
             script_path = os.path.join(tmp, filename)
             with open(script_path, "w", encoding="utf-8") as f:
                 f.write(current_code)
 
-            quality_flag = {"low": "-ql", "medium": "-pqm", "high": "-pqh"}.get(quality, "-ql")
+            if preflight and RENDER_PREFLIGHT:
+                preflight_logs = await preflight_scene(current_code, filename, scene_class)
+                if preflight_logs is not None:
+                    error_output = preflight_logs["stderr"] + "\n" + preflight_logs["stdout"]
+                    fixed = fix_manim_code(current_code, error_output) if attempt < max_retries else None
+                    if fixed and fixed != current_code:
+                        print(f"Attempt {attempt + 1}: preflight failed, auto-fix applied. Retrying with fixed code...")
+                        current_code = fixed
+                        continue
+                    print(f"Attempt {attempt + 1}: preflight failed and no auto-fix applies, skipping the render")
+                    return False, None, preflight_logs
+
             out_name = "render"
+            returncode, stdout, stderr = await render_scene(tmp, filename, scene_class, quality, out_name,
+                                                            current_code, segmented=segmented, media_key=media_key)
 
-            # Decide whether to use Docker or Native Manim
-            use_native = os.getenv("USE_NATIVE_MANIM", "false").lower() == "true"
-            
-            if use_native:
-                cmd = [
-                    "manim",
-                    quality_flag,
-                    script_path,
-                    scene_class,
-                    "--media_dir", os.path.join(tmp, "media"),
-                    "-o", out_name
-                ]
-            else:
-                cmd = [
-                    "docker", "run", "--rm",
-                    "--read-only=false",
-                    "--network", "none",
-                    "-v", f"{tmp}:/work",
-                    "manim-image:latest",
-                    quality_flag, f"/work/{filename}", scene_class,
-                    "--media_dir", "/work/media",
-                    "-o", out_name
-                ]
-
-            proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=600)
-            stdout = proc.stdout.decode(errors="ignore")
-            stderr = proc.stderr.decode(errors="ignore")
-
-            if proc.returncode != 0:
+            if returncode != 0:
                 error_output = stderr + "\n" + stdout
                 logs = {"stdout": stdout, "stderr": stderr}
                 
-                is_container_error = (
-                    "KeyboardInterrupt" in error_output or
-                    "ConnectionError" in error_output or
-                    "ConnectionRefusedError" in error_output or
-                    "docker" in error_output.lower() and "error" in error_output.lower()
-                )
-                
-                is_code_error = (
-                    "NameError" in error_output or
-                    "AttributeError" in error_output or
-                    "TypeError" in error_output or
-                    "ImportError" in error_output or
-                    "IndentationError" in error_output or
-                    "SyntaxError" in error_output
-                )
+                is_container_error, is_code_error = _classify_failure(error_output)
                 
                 print(f"Attempt {attempt + 1} failed. Container error: {is_container_error}, Code error: {is_code_error}")
                 
@@ -276,56 +553,31 @@ def retry_render(code: str, filename: str, scene_class: str, quality: str, max_r
                     if fixed and fixed != current_code:
                         print(f"Attempt {attempt + 1}: Auto-fix applied. Retrying with fixed code...")
                         current_code = fixed
-                        try:
-                            shutil.rmtree(tmp)
-                        except Exception:
-                            pass
                         continue
                 
                 if is_container_error and attempt < max_retries:
                     print(f"Attempt {attempt + 1}: Container error detected. Retrying...")
-                    try:
-                        shutil.rmtree(tmp)
-                    except Exception:
-                        pass
-                    time.sleep(2)
+                    await asyncio.sleep(2)
                     continue
                 
-                error_msg = f"Docker render failed with return code {proc.returncode}"
+                error_msg = f"Docker render failed with return code {returncode}"
                 if is_container_error:
                     error_msg += " (Container/Environment Error - may be transient)"
                 print(f"Final error: {error_msg}")
                 return False, None, logs
 
-            mp4_path = None
-            for root, dirs, files in os.walk(tmp):
-                for fn in files:
-                    if fn.endswith(".mp4"):
-                        mp4_path = os.path.join(root, fn)
-                        break
-                if mp4_path:
-                    break
-
-            if not mp4_path or not os.path.exists(mp4_path):
+            mp4_path = output_path(tmp, out_name)
+            if not os.path.exists(mp4_path):
                 error_msg = "No MP4 file produced by Manim"
                 logs = {"stdout": stdout, "stderr": stderr}
                 if attempt < max_retries:
                     print(f"Attempt {attempt + 1} failed: {error_msg}. Retrying...")
                 else:
                     return False, None, logs
-                try:
-                    shutil.rmtree(tmp)
-                except Exception:
-                    pass
                 continue
 
-            dest_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "generated_videos")
-            os.makedirs(dest_dir, exist_ok=True)
-            dest_filename = f"{out_name}-{uuid.uuid4().hex[:8]}.mp4"
-            dest_path = os.path.join(dest_dir, dest_filename)
-            
             try:
-                shutil.copy2(mp4_path, dest_path)
+                dest_path = await store_output(tmp, out_name, quality)
             except Exception as copy_err:
                 error_msg = f"Failed to save video: {str(copy_err)}"
                 logs = {"stdout": stdout, "stderr": stderr}
@@ -333,24 +585,16 @@ def retry_render(code: str, filename: str, scene_class: str, quality: str, max_r
                     print(f"Attempt {attempt + 1} failed: {error_msg}. Retrying...")
                 else:
                     return False, None, logs
-                try:
-                    shutil.rmtree(tmp)
-                except Exception:
-                    pass
                 continue
 
             return True, dest_path, {"stdout": stdout, "stderr": stderr}
 
         except subprocess.TimeoutExpired:
-            error_msg = "Render timed out after 10 minutes"
+            error_msg = f"Render timed out after {RENDER_TIMEOUT_SECONDS} seconds"
             print(f"Attempt {attempt + 1} failed: {error_msg}")
             if attempt < max_retries:
                 print("Retrying...")
-                try:
-                    shutil.rmtree(tmp)
-                except Exception:
-                    pass
-                time.sleep(1)
+                await asyncio.sleep(1)
             else:
                 return False, None, {"error": error_msg}
         except Exception as e:
@@ -358,30 +602,138 @@ def retry_render(code: str, filename: str, scene_class: str, quality: str, max_r
             print(f"Attempt {attempt + 1} failed: {error_msg}")
             if attempt < max_retries:
                 print("Retrying...")
-                try:
-                    shutil.rmtree(tmp)
-                except Exception:
-                    pass
-                time.sleep(1)
+                await asyncio.sleep(1)
             else:
                 return False, None, {"error": error_msg}
         finally:
-            try:
-                shutil.rmtree(tmp)
-            except Exception:
-                pass
+            discard_workspace(tmp)
     
     return False, None, {"error": "Render failed after all retries"}
 
-async def generate_and_render(req):
+async def render_final(sanitized_code: str, req, on_stage=None, media_key=None, preflight: bool = True) -> dict:
+    """
+    Render validated code at `req.quality`, upload it and cache the result. This is the
+    second half of generate_and_render, and the whole of the final tier after a preview.
+    """
+    def stage(name: str):
+        if on_stage is not None:
+            on_stage(name)
+
+    cache_key = render_cache.key(sanitized_code, req.scene_class, req.quality)
+    cached = render_cache.get(cache_key)
+    if cached is not None:
+        print(f"Render cache hit: {cached['local_path']}")
+        return {
+            "success": True,
+            "filename": os.path.basename(cached["local_path"]),
+            "local_path": cached["local_path"],
+            "supabase_url": cached["supabase_url"],
+            **playback_fields(cached["local_path"], cached["supabase_url"], _pending(cached)),
+            "sanitized_code": sanitized_code,
+            "logs": {"cache": "hit"}
+        }
+
+    print("Step 3: Rendering video with retry logic...")
+    stage("render")
+    render_success, dest_path, logs = await retry_render(
+        sanitized_code,
+        req.filename,
+        req.scene_class,
+        req.quality,
+        max_retries=req.max_retries,
+        segmented=req.segmented,
+        media_key=media_key,
+        preflight=preflight
+    )
+    
+    if not render_success:
+        error_msg = f"Render failed: {logs.get('error') or 'Unknown error'}"
+        print(f"ERROR: {error_msg}")
+        return {
+            "success": False,
+            "error": error_msg,
+            "sanitized_code": sanitized_code,
+            "logs": logs
+        }
+    print(f"Render successful: {dest_path}")
+    
+    print("Step 4: Uploading to Supabase...")
+    stage("upload")
+    supabase_url, upload_pending = await store_video(dest_path)
+    cache_rendered_video(cache_key, dest_path, supabase_url, upload_pending)
+
+    print(f"=== Success ===\n")
+    return {
+        "success": True,
+        "filename": os.path.basename(dest_path),
+        "local_path": dest_path,
+        "supabase_url": supabase_url,
+        **playback_fields(dest_path, supabase_url, upload_pending),
+        "sanitized_code": sanitized_code,
+        "logs": logs
+    }
+
+async def _final_tier(sanitized_code: str, req, media_key=None, on_done=None, on_stage=None) -> dict:
+    result = await render_final(sanitized_code, req, on_stage=on_stage, media_key=media_key)
+    if result.get("success") and on_done is not None:
+        await on_done(result)
+    return result
+
+async def schedule_final_render(preview_result: dict, req, media_key=None, on_done=None) -> dict:
+    """
+    Queue the requested-quality render after a preview and record its job ID in
+    `preview_result["final_job_id"]`. `on_done(result)` is awaited once it succeeded;
+    cancelling the job (DELETE /api/jobs/{id}) abandons it. The job takes a render_pool
+    admission like any other render; when the queue is full the preview is all there is
+    and `final_job_id` is None.
+    """
+    try:
+        job = await submit_admitted_job("final_render", _final_tier, preview_result["sanitized_code"], req,
+                                        media_key=media_key, on_done=on_done)
+    except HTTPException as e:
+        if e.status_code != 429:
+            raise
+        print("Render queue full, keeping the preview without a final render")
+        preview_result["final_job_id"] = None
+        return preview_result
+    preview_result["final_job_id"] = job["id"]
+    return preview_result
+
+async def generate_and_render(req, on_stage=None, media_key=None):
+    """
+    Generate, validate, render and upload a scene for `req`.
+    `on_stage(stage)` is called as the pipeline advances (llm, validate, render, upload).
+    `media_key` selects the persistent Manim media dir to render on (e.g. one per chat).
+    With `req.preview`, only a small low-fps preview is rendered (not uploaded) and the result
+    has `preview: True`; the caller queues render_final for the requested quality.
+    The LLM call runs in a worker thread (streamed, so validation starts once the code block
+    closes) and the render runs as an asyncio subprocess, so the event loop stays responsive.
+    """
+    def stage(name: str):
+        if on_stage is not None:
+            on_stage(name)
+
     try:
         print(f"\n=== Combined Generate-Render Request ===")
         print(f"Prompt: {req.prompt}")
         
         print("Step 1: Generating code from prompt...")
+        stage("llm")
+        candidates = min(req.candidates or SPECULATIVE_CANDIDATES, SPECULATIVE_MAX_CANDIDATES)
+        sanitized_code = None
+        dry_run_passed = False
+        # Not cached until it has rendered, so a broken script is not replayed for the prompt
+        llm_result = None
         try:
-            llm_result = generate_manim_code(req.prompt)
-            generated_code = llm_result.get("code", "")
+            if candidates > 1:
+                generated_code, sanitized_code = await speculative_generate(req, candidates)
+                dry_run_passed = sanitized_code is not None
+            else:
+                if GENAI_STREAM:
+                    llm_result = await stream_manim_code(req.prompt, req.use_cache, store=False)
+                else:
+                    llm_result = await asyncio.to_thread(generate_manim_code, req.prompt, req.use_cache, False)
+                generated_code = llm_result.get("code", "")
             print(f"Generated {len(generated_code)} characters of code")
         except Exception as e:
             error_msg = f"LLM generation failed: {str(e)}"
@@ -393,66 +745,61 @@ async def generate_and_render(req):
             }
         
         print("Step 2: Validating code with retry logic...")
-        valid, sanitized_code, validation_error = retry_validation(generated_code, max_retries=req.max_retries)
-        if not valid:
-            error_msg = f"Code validation failed: {validation_error}"
-            print(f"ERROR: {error_msg}")
-            return {
-                "success": False,
-                "error": error_msg,
-                "code": generated_code
-            }
+        stage("validate")
+        if sanitized_code is None:
+            valid, sanitized_code, validation_error = retry_validation(generated_code, max_retries=req.max_retries)
+            if not valid:
+                error_msg = f"Code validation failed: {validation_error}"
+                print(f"ERROR: {error_msg}")
+                return {
+                    "success": False,
+                    "error": error_msg,
+                    "code": generated_code
+                }
         print("Code validation passed")
         
-        print("Step 3: Rendering video with retry logic...")
-        render_success, dest_path, logs = retry_render(
-            sanitized_code,
-            req.filename,
-            req.scene_class,
-            req.quality,
-            max_retries=req.max_retries
-        )
-        
-        if not render_success:
-            error_msg = f"Render failed: {logs.get('error') or 'Unknown error'}"
-            print(f"ERROR: {error_msg}")
+        if req.preview and not render_cache.contains(render_cache.key(sanitized_code, req.scene_class, req.quality)):
+            print("Step 3: Rendering preview...")
+            stage("preview")
+            render_success, dest_path, logs = await retry_render(
+                sanitized_code,
+                req.filename,
+                req.scene_class,
+                "preview",
+                max_retries=req.max_retries,
+                media_key=media_key,
+                preflight=not dry_run_passed
+            )
+            if not render_success:
+                error_msg = f"Preview render failed: {logs.get('error') or 'Unknown error'}"
+                print(f"ERROR: {error_msg}")
+                return {
+                    "success": False,
+                    "error": error_msg,
+                    "code": generated_code,
+                    "sanitized_code": sanitized_code,
+                    "logs": logs
+                }
+            print(f"Preview ready: {dest_path}")
+            if llm_result is not None:
+                remember_generation(req.prompt, llm_result)
             return {
-                "success": False,
-                "error": error_msg,
+                "success": True,
+                "preview": True,
+                "filename": os.path.basename(dest_path),
+                "local_path": dest_path,
+                "supabase_url": None,
+                **playback_fields(dest_path, None),
                 "code": generated_code,
                 "sanitized_code": sanitized_code,
                 "logs": logs
             }
-        print(f"Render successful: {dest_path}")
-        
-        supabase_url = None
-        try:
-            if _supabase is not None:
-                bucket = SUPABASE_BUCKET
-                dest_name = f"{uuid.uuid4().hex[:8]}-{os.path.basename(dest_path)}"
-                print(f"Step 4: Uploading to Supabase bucket '{bucket}'...")
-                
-                with open(dest_path, "rb") as f:
-                    result = _supabase.storage.from_(bucket).upload(dest_name, f)
-                    print(f"Upload result: {result}")
-
-                supabase_url = _supabase.storage.from_(bucket).get_public_url(dest_name)
-                print(f"Supabase public URL: {supabase_url}")
-            else:
-                print("Step 4: Supabase not configured, skipping upload")
-        except Exception as e:
-            print(f"WARNING: Supabase upload failed: {type(e).__name__}: {e}")
 
-        print(f"=== Success ===\n")
-        return {
-            "success": True,
-            "filename": os.path.basename(dest_path),
-            "local_path": dest_path,
-            "supabase_url": supabase_url,
-            "code": generated_code,
-            "sanitized_code": sanitized_code,
-            "logs": logs
-        }
+        result = await render_final(sanitized_code, req, on_stage=on_stage, media_key=media_key,
+                                    preflight=not dry_run_passed)
+        if result.get("success") and llm_result is not None:
+            remember_generation(req.prompt, llm_result)
+        return {**result, "code": generated_code}
 
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
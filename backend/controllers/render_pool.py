@@ -0,0 +1,134 @@
+import os
+import math
+import time
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+RENDER_CPUS_PER_SLOT = float(os.getenv("RENDER_CPUS_PER_SLOT", "1"))
+RENDER_MEMORY_PER_SLOT_MB = int(os.getenv("RENDER_MEMORY_PER_SLOT_MB", "1024"))
+RENDER_RETRY_AFTER_SECONDS = int(os.getenv("RENDER_RETRY_AFTER_SECONDS", "30"))
+
+
+def _available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except Exception:
+        return os.cpu_count() or 1
+
+
+def _available_memory_mb() -> Optional[int]:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except Exception:
+        return None
+
+
+def default_slot_count() -> int:
+    """Slots that fit both the CPU and memory budget of this box (overridable with RENDER_SLOTS)."""
+    configured = os.getenv("RENDER_SLOTS")
+    if configured:
+        return max(1, int(configured))
+    by_cpu = int(_available_cpus() // max(RENDER_CPUS_PER_SLOT, 0.1))
+    memory_mb = _available_memory_mb()
+    by_memory = memory_mb // RENDER_MEMORY_PER_SLOT_MB if memory_mb else by_cpu
+    return max(1, min(by_cpu, by_memory))
+
+
+class RenderSlotPool:
+    """
+    Bounds how many Manim processes run at once.
+    - `admit()` / `admission()` gate work at the API door: once `slots + queue_limit`
+      requests are in flight, new ones get a 429 with Retry-After.
+    - `slot()` is held around each render process; admitted work waits here for a free slot.
+    """
+    def __init__(self, slots: int, queue_limit: int):
+        self.slots = slots
+        self.queue_limit = queue_limit
+        self.admitted = 0
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.completed = 0
+        self._avg_render_seconds: Optional[float] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._sem is None:
+            self._loop = loop
+            self._sem = asyncio.Semaphore(self.slots)
+        return self._sem
+
+    def retry_after(self) -> int:
+        """Rough seconds until a slot frees up, from the running average render time."""
+        if not self._avg_render_seconds:
+            return RENDER_RETRY_AFTER_SECONDS
+        backlog = (self.waiting + 1) / self.slots
+        return max(1, math.ceil(self._avg_render_seconds * backlog))
+
+    def admit(self):
+        if self.admitted >= self.slots + self.queue_limit:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=429,
+                detail="Render queue is full, try again later",
+                headers={"Retry-After": str(self.retry_after())},
+            )
+        self.admitted += 1
+
+    def release(self):
+        self.admitted = max(0, self.admitted - 1)
+
+    @contextmanager
+    def admission(self):
+        self.admit()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        sem = self._semaphore()
+        self.waiting += 1
+        try:
+            await sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self.completed += 1
+            elapsed = time.time() - started
+            if self._avg_render_seconds is None:
+                self._avg_render_seconds = elapsed
+            else:
+                self._avg_render_seconds = 0.8 * self._avg_render_seconds + 0.2 * elapsed
+            sem.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "slots": self.slots,
+            "active": self.active,
+            "waiting": self.waiting,
+            "queue_limit": self.queue_limit,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "avg_render_seconds": round(self._avg_render_seconds, 2) if self._avg_render_seconds else None,
+            "retry_after": self.retry_after(),
+        }
+
+
+_slots = default_slot_count()
+render_pool = RenderSlotPool(
+    slots=_slots,
+    queue_limit=int(os.getenv("RENDER_QUEUE_LIMIT", str(_slots * 4))),
+)
@@ -0,0 +1,128 @@
+import os
+import ast
+import shutil
+import asyncio
+
+from controllers.render_pool import render_pool
+from controllers.manim_runner import run_manim, run_ffmpeg
+
+SEGMENT_MIN_ANIMATIONS = int(os.getenv("SEGMENT_MIN_ANIMATIONS", "2"))
+SEGMENT_MAX_PARALLEL = int(os.getenv("SEGMENT_MAX_PARALLEL", str(render_pool.slots)))
+
+ANIMATION_METHODS = {"play", "wait", "pause", "wait_until"}
+
+
+def _is_animation_call(node: ast.AST) -> bool:
+    return (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and node.func.attr in ANIMATION_METHODS
+        and isinstance(node.func.value, ast.Name)
+        and node.func.value.id == "self"
+    )
+
+
+def count_animations(code: str, scene_class: str) -> int | None:
+    """
+    Number of play/wait calls in `scene_class.construct`, or None when it cannot be known
+    statically (calls inside loops, branches or helper methods).
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    cls = next((n for n in tree.body if isinstance(n, ast.ClassDef) and n.name == scene_class), None)
+    if cls is None:
+        return None
+    construct = next((n for n in cls.body if isinstance(n, ast.FunctionDef) and n.name == "construct"), None)
+    if construct is None:
+        return None
+    total = sum(1 for node in ast.walk(cls) if _is_animation_call(node))
+    top_level = sum(1 for stmt in construct.body if isinstance(stmt, ast.Expr) and _is_animation_call(stmt.value))
+    if top_level == 0 or total != top_level:
+        return None
+    return top_level
+
+
+def plan_segments(num_animations: int, max_parallel: int) -> list[tuple[int, int]]:
+    """Split animations 0..num_animations-1 into contiguous inclusive ranges, one per process."""
+    count = min(max_parallel, num_animations // max(SEGMENT_MIN_ANIMATIONS, 1))
+    if count < 2:
+        return []
+    base, extra = divmod(num_animations, count)
+    ranges, start = [], 0
+    for i in range(count):
+        size = base + (1 if i < extra else 0)
+        ranges.append((start, start + size - 1))
+        start += size
+    return ranges
+
+
+def _find_mp4(root: str) -> str | None:
+    for dirpath, _, files in os.walk(root):
+        for fn in files:
+            if fn.endswith(".mp4"):
+                return os.path.join(dirpath, fn)
+    return None
+
+
+async def render_segmented(tmp: str, filename: str, scene_class: str, quality: str, out_name: str,
+                           code: str) -> tuple[int, str, str] | None:
+    """
+    Render animation ranges of one scene in parallel processes and losslessly concatenate
+    the partial movies into `tmp/<out_name>.mp4`. Each process fast-forwards through
+    the animations before its range without writing frames (manim -n).
+    Returns None when the scene can't be split, so the caller renders it in one piece.
+    """
+    num_animations = count_animations(code, scene_class)
+    segments = plan_segments(num_animations, SEGMENT_MAX_PARALLEL) if num_animations else []
+    if not segments:
+        return None
+    print(f"Segmented render: {num_animations} animations in {len(segments)} segments {segments}")
+
+    seg_root = os.path.join(tmp, "segments")
+    seg_dirs = []
+    for i in range(len(segments)):
+        seg_dir = os.path.join(seg_root, f"seg{i}")
+        os.makedirs(seg_dir)
+        shutil.copy2(os.path.join(tmp, filename), os.path.join(seg_dir, filename))
+        seg_dirs.append(seg_dir)
+
+    # The segment dirs go with the workspace when it is discarded
+    return await _render_and_concat(tmp, filename, scene_class, quality, out_name, segments, seg_root, seg_dirs)
+
+
+async def _render_and_concat(tmp, filename, scene_class, quality, out_name, segments, seg_root, seg_dirs):
+    tasks = [
+        asyncio.create_task(run_manim(seg_dir, filename, scene_class, quality, f"{out_name}-{i}", segment,
+                                      total_animations=segments[-1][1] + 1))
+        for i, (seg_dir, segment) in enumerate(zip(seg_dirs, segments))
+    ]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    stdout = "\n".join(r[1] for r in results)
+    stderr = "\n".join(r[2] for r in results)
+    for returncode, _, _ in results:
+        if returncode != 0:
+            return returncode, stdout, stderr
+
+    list_path = os.path.join(seg_root, "concat.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for i, seg_dir in enumerate(seg_dirs):
+            mp4 = _find_mp4(seg_dir)
+            if mp4 is None:
+                return 1, stdout, stderr + f"\nSegment {i} produced no mp4"
+            f.write(f"file '{os.path.relpath(mp4, seg_root)}'\n")
+
+    returncode, ff_out, ff_err = await run_ffmpeg(
+        ["-f", "concat", "-safe", "0", "-i", os.path.relpath(list_path, tmp),
+         "-c", "copy", f"{out_name}.mp4"],
+        tmp,
+    )
+    return returncode, stdout + "\n" + ff_out, stderr + "\n" + ff_err
@@ -0,0 +1,370 @@
+import os
+import time
+import uuid
+import socket
+import base64
+import sqlite3
+import asyncio
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+# Supabase's resumable endpoint only accepts 6 MB chunks (except for the last one).
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(6 * 1024 * 1024)))
+UPLOAD_CHUNK_RETRIES = int(os.getenv("UPLOAD_CHUNK_RETRIES", "5"))
+UPLOAD_TIMEOUT_SECONDS = float(os.getenv("UPLOAD_TIMEOUT_SECONDS", "60"))
+
+TUS_VERSION = "1.0.0"
+
+
+class UploadError(Exception):
+    pass
+
+
+def _tus_metadata(**fields: str) -> str:
+    return ",".join(f"{k} {base64.b64encode(v.encode('utf-8')).decode('ascii')}" for k, v in fields.items())
+
+
+class ResumableUploader:
+    """
+    Chunked uploads to Supabase Storage over its TUS resumable endpoint.
+    Each file is sent as a sequence of fixed-size chunks, so only one chunk per upload
+    is held in memory. A failed chunk is retried with backoff after asking the server
+    (HEAD) how much it already has, so a network hiccup resumes instead of restarting.
+    TUS has no parallel parts on Supabase; up to UPLOAD_CONCURRENCY files upload at once.
+    Blocking: call it from a worker thread.
+    """
+    def __init__(self, url: str, key: str, concurrency: int, chunk_bytes: int, retries: int,
+                 transport: Optional[httpx.BaseTransport] = None):
+        self.endpoint = f"{url.rstrip('/')}/storage/v1/upload/resumable"
+        self.key = key
+        self.chunk_bytes = chunk_bytes
+        self.retries = retries
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._client = httpx.Client(timeout=UPLOAD_TIMEOUT_SECONDS, transport=transport)
+        self._lock = threading.Lock()
+        self.concurrency = concurrency
+        self.in_flight = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.chunks = 0
+        self.chunk_retries = 0
+        self.bytes_uploaded = 0
+        self.upload_seconds = 0.0
+
+    def _headers(self, **extra: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.key}", "apikey": self.key, "Tus-Resumable": TUS_VERSION, **extra}
+
+    def _create(self, bucket: str, object_name: str, size: int, content_type: str) -> str:
+        resp = self._client.post(self.endpoint, headers=self._headers(**{
+            "Upload-Length": str(size),
+            "Upload-Metadata": _tus_metadata(bucketName=bucket, objectName=object_name,
+                                             contentType=content_type, cacheControl="3600"),
+            "x-upsert": "true",
+        }))
+        if resp.status_code not in (200, 201) or "location" not in resp.headers:
+            raise UploadError(f"create failed: {resp.status_code} {resp.text[:200]}")
+        return str(httpx.URL(self.endpoint).join(resp.headers["location"]))
+
+    def _server_offset(self, location: str) -> int:
+        resp = self._client.head(location, headers=self._headers())
+        if resp.status_code != 200:
+            raise UploadError(f"offset query failed: {resp.status_code}")
+        return int(resp.headers["upload-offset"])
+
+    def _send_chunk(self, location: str, offset: int, chunk: bytes) -> int:
+        resp = self._client.patch(location, content=chunk, headers=self._headers(**{
+            "Upload-Offset": str(offset),
+            "Content-Type": "application/offset+octet-stream",
+        }))
+        if resp.status_code not in (200, 204):
+            raise UploadError(f"chunk at {offset} failed: {resp.status_code} {resp.text[:200]}")
+        return int(resp.headers.get("upload-offset", offset + len(chunk)))
+
+    def _upload(self, path: str, bucket: str, object_name: str, content_type: str):
+        size = os.path.getsize(path)
+        location = self._create(bucket, object_name, size, content_type)
+        offset = 0
+        with open(path, "rb") as f:
+            while offset < size:
+                f.seek(offset)
+                chunk = f.read(self.chunk_bytes)
+                for attempt in range(self.retries + 1):
+                    try:
+                        offset = self._send_chunk(location, offset, chunk)
+                        break
+                    except (httpx.HTTPError, UploadError) as e:
+                        if attempt == self.retries:
+                            raise
+                        with self._lock:
+                            self.chunk_retries += 1
+                        print(f"Upload of {object_name}: {e}; retrying chunk ({attempt + 1}/{self.retries})")
+                        time.sleep(min(0.5 * 2 ** attempt, 8))
+                        try:
+                            # Resume from what the server actually stored
+                            offset = self._server_offset(location)
+                        except (httpx.HTTPError, UploadError):
+                            continue
+                        if offset >= size:
+                            break
+                        f.seek(offset)
+                        chunk = f.read(self.chunk_bytes)
+                with self._lock:
+                    self.chunks += 1
+
+    def upload(self, path: str, bucket: str, object_name: str, content_type: str = "video/mp4"):
+        """Upload `path` to `bucket/object_name`; raises on failure after the chunk retries."""
+        with self._slots:
+            with self._lock:
+                self.in_flight += 1
+            started = time.monotonic()
+            try:
+                self._upload(path, bucket, object_name, content_type)
+            except Exception:
+                with self._lock:
+                    self.failed += 1
+                raise
+            else:
+                with self._lock:
+                    self.succeeded += 1
+                    self.bytes_uploaded += os.path.getsize(path)
+                    self.upload_seconds += time.monotonic() - started
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "chunk_bytes": self.chunk_bytes,
+                "in_flight": self.in_flight,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "chunks": self.chunks,
+                "chunk_retries": self.chunk_retries,
+                "bytes_uploaded": self.bytes_uploaded,
+                "throughput_bytes_per_second": round(self.bytes_uploaded / self.upload_seconds) if self.upload_seconds else None,
+            }
+
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+uploader = (
+    ResumableUploader(SUPABASE_URL, SUPABASE_KEY, UPLOAD_CONCURRENCY, UPLOAD_CHUNK_BYTES, UPLOAD_CHUNK_RETRIES)
+    if SUPABASE_URL and SUPABASE_KEY else None
+)
+
+
+UPLOAD_WRITE_BEHIND = os.getenv("UPLOAD_WRITE_BEHIND", "true").lower() == "true"
+UPLOAD_QUEUE_PATH = os.getenv("UPLOAD_QUEUE_PATH", os.path.join("generated_scripts", "pending_uploads.sqlite3"))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "10"))
+# A row claimed by a process that has not finished it within this long (e.g. it died) is
+# taken over by another process.
+UPLOAD_CLAIM_TTL_SECONDS = int(os.getenv("UPLOAD_CLAIM_TTL_SECONDS", "1800"))
+
+
+class WriteBehindQueue:
+    """
+    Durable queue of videos still to be uploaded. Rows live in SQLite until the upload
+    succeeds, so uploads pending at shutdown are picked up again by the next process.
+    A background task starts up to `concurrency` uploads at a time (each in a worker thread)
+    and calls `on_uploaded(local_path, local_url, public_url)`; failures are retried with
+    backoff up to UPLOAD_MAX_ATTEMPTS times. Several processes (uvicorn workers) may share
+    the file: a row is claimed atomically before it is uploaded, and claims older than
+    `claim_ttl` are taken over.
+    """
+    def __init__(self, path: str, upload_fn: Callable[[str], Optional[str]],
+                 on_uploaded: Callable[[str, str, str], None], max_attempts: int, concurrency: int = 1,
+                 backoff_seconds: float = 5, claim_ttl: float = UPLOAD_CLAIM_TTL_SECONDS):
+        self.path = path
+        self.claim_ttl = claim_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.backoff_seconds = backoff_seconds
+        self.concurrency = concurrency
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.upload_fn = upload_fn
+        self.on_uploaded = on_uploaded
+        self.max_attempts = max_attempts
+        self._initialized = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.uploaded = 0
+        self.failed_attempts = 0
+        # Recently finished uploads, local URL -> public URL (see uploaded_url)
+        self._completed: "OrderedDict[str, str]" = OrderedDict()
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        if not self._initialized:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending_uploads ("
+                " local_path TEXT PRIMARY KEY, local_url TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt_at REAL NOT NULL, last_error TEXT, claimed_by TEXT, claimed_at REAL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(pending_uploads)")}
+            for column, kind in (("claimed_by", "TEXT"), ("claimed_at", "REAL")):
+                if column not in columns:  # queue file from before claims
+                    conn.execute(f"ALTER TABLE pending_uploads ADD COLUMN {column} {kind}")
+            conn.commit()
+            self._initialized = True
+        return conn
+
+    def _add(self, local_path: str, local_url: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pending_uploads (local_path, local_url, attempts, next_attempt_at)"
+                " VALUES (?, ?, 0, ?)",
+                (local_path, local_url, time.time()),
+            )
+
+    def _claim_next(self, skip: Tuple[str, ...] = ()) -> Tuple[Optional[Tuple[str, str, int, float]], bool]:
+        """
+        The unclaimed (or stale) row due first, and whether this queue claimed it. A row not due
+        yet is returned unclaimed; so is a due one another process claimed in the meantime.
+        """
+        now = time.time()
+        stale = now - self.claim_ttl
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT local_path, local_url, attempts, next_attempt_at FROM pending_uploads"
+                " WHERE attempts < ? AND (claimed_by IS NULL OR claimed_at < ?)"
+                f" AND local_path NOT IN ({','.join('?' * len(skip))})"
+                " ORDER BY next_attempt_at LIMIT 1",
+                (self.max_attempts, stale, *skip),
+            ).fetchone()
+            if row is None or row[3] > now:
+                return row, False
+            claimed = conn.execute(
+                "UPDATE pending_uploads SET claimed_by = ?, claimed_at = ?"
+                " WHERE local_path = ? AND (claimed_by IS NULL OR claimed_at < ?)",
+                (self.owner, now, row[0], stale),
+            ).rowcount == 1
+            return row, claimed
+
+    def _release_claims(self):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("UPDATE pending_uploads SET claimed_by = NULL, claimed_at = NULL WHERE claimed_by = ?",
+                         (self.owner,))
+
+    def _done(self, local_path: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM pending_uploads WHERE local_path = ?", (local_path,))
+
+    def _failed(self, local_path: str, attempts: int, error: str):
+        delay = min(self.backoff_seconds * 2 ** attempts, 600)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "UPDATE pending_uploads SET attempts = ?, next_attempt_at = ?, last_error = ?,"
+                " claimed_by = NULL, claimed_at = NULL WHERE local_path = ?",
+                (attempts + 1, time.time() + delay, error, local_path),
+            )
+
+    def uploaded_url(self, local_url: str) -> Optional[str]:
+        """
+        Public URL of a recently finished upload. A caller that stores `local_url` after the
+        upload may already have finished (so on_uploaded missed it) checks here afterwards.
+        """
+        return self._completed.get(local_url)
+
+    def pending_paths(self) -> List[str]:
+        """Local files whose upload has not completed (including ones that gave up)."""
+        with closing(self._connect()) as conn:
+            return [row[0] for row in conn.execute("SELECT local_path FROM pending_uploads")]
+
+    def start(self):
+        """Start (or restart on a new event loop) the background uploader."""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task is not None and not self._task.done():
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        tasks = [t for t in (self._task, *self._in_flight.values()) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._in_flight.clear()
+        # Hand interrupted uploads back to the other processes now rather than after claim_ttl
+        await asyncio.to_thread(self._release_claims)
+
+    async def enqueue(self, local_path: str, local_url: str):
+        await asyncio.to_thread(self._add, local_path, local_url)
+        self.start()
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            timeout = None
+            while len(self._in_flight) < self.concurrency:
+                row, claimed = await asyncio.to_thread(self._claim_next, tuple(self._in_flight))
+                if row is None:
+                    # Rows claimed by other processes come back if those claims go stale
+                    timeout = self.claim_ttl
+                    break
+                if row[3] > time.time():
+                    timeout = row[3] - time.time()
+                    break
+                if not claimed:
+                    continue  # another process took it first
+                self._in_flight[row[0]] = asyncio.ensure_future(self._upload(*row[:3]))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _upload(self, local_path: str, local_url: str, attempts: int):
+        try:
+            if not os.path.exists(local_path):
+                print(f"Write-behind: {local_path} is gone, dropping its upload")
+                await asyncio.to_thread(self._done, local_path)
+                return
+            try:
+                public_url = await asyncio.to_thread(self.upload_fn, local_path)
+                error = None if public_url else "upload returned no URL"
+            except Exception as e:
+                public_url, error = None, f"{type(e).__name__}: {e}"
+            if public_url:
+                try:
+                    await asyncio.to_thread(self.on_uploaded, local_path, local_url, public_url)
+                except Exception as e:
+                    print(f"Write-behind: uploaded {local_path} but updating references failed: {e}")
+                await asyncio.to_thread(self._done, local_path)
+                self._completed[local_url] = public_url
+                while len(self._completed) > 1024:
+                    self._completed.popitem(last=False)
+                self.uploaded += 1
+            else:
+                print(f"Write-behind: upload of {local_path} failed (attempt {attempts + 1}): {error}")
+                await asyncio.to_thread(self._failed, local_path, attempts, error)
+                self.failed_attempts += 1
+        finally:
+            self._in_flight.pop(local_path, None)
+            self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with closing(self._connect()) as conn:
+            pending, gave_up = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(attempts >= ?), 0) FROM pending_uploads", (self.max_attempts,)
+            ).fetchone()
+        return {
+            "enabled": UPLOAD_WRITE_BEHIND,
+            "pending": pending - gave_up,
+            "in_flight": len(self._in_flight),
+            "gave_up": gave_up,
+            "uploaded": self.uploaded,
+            "failed_attempts": self.failed_attempts,
+        }
@@ -0,0 +1,265 @@
+import os
+import time
+import uuid
+import queue
+import shutil
+import tempfile
+import threading
+from typing import Any, Dict
+
+VIDEO_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "generated_videos"))
+# Render workspaces are created here. Keep it on the same filesystem as generated_videos/
+# (and MEDIA_CACHE_ROOT) so finished videos are renamed into the store instead of copied.
+RENDER_WORK_ROOT = os.getenv("RENDER_WORK_ROOT", tempfile.gettempdir())
+# Byte budget of generated_videos/; least recently served videos already uploaded to Supabase
+# are deleted above it. Videos younger than VIDEO_STORE_MIN_AGE_SECONDS are always kept.
+VIDEO_STORE_MAX_BYTES = int(os.getenv("VIDEO_STORE_MAX_BYTES", str(10 * 1024 * 1024 * 1024)))
+VIDEO_STORE_MIN_AGE_SECONDS = int(os.getenv("VIDEO_STORE_MIN_AGE_SECONDS", "600"))
+# Leftover workspaces older than this (e.g. from a crash) are removed at startup.
+WORKSPACE_MAX_AGE_SECONDS = int(os.getenv("WORKSPACE_MAX_AGE_SECONDS", "3600"))
+
+WORKSPACE_PREFIX = "manimjob-"
+# Empty `<video stem>.uploaded` file next to a stored video once it is in Supabase.
+UPLOADED_SUFFIX = "uploaded"
+# Empty `<video stem>.disposable` file next to a preview: evictable without an upload.
+DISPOSABLE_SUFFIX = "disposable"
+
+
+def new_workspace() -> str:
+    os.makedirs(RENDER_WORK_ROOT, exist_ok=True)
+    return tempfile.mkdtemp(prefix=WORKSPACE_PREFIX, dir=RENDER_WORK_ROOT)
+
+
+def output_path(workdir: str, out_name: str) -> str:
+    """Where a render in `workdir` leaves its video (see render_controller.render_scene)."""
+    return os.path.join(workdir, f"{out_name}.mp4")
+
+
+def collect_output(media: str, out_name: str, dest: str):
+    """Move the newest final `<out_name>.mp4` (not a partial movie) out of `media` to `dest`; drop older ones."""
+    found = []
+    for dirpath, dirnames, files in os.walk(media):
+        dirnames[:] = [d for d in dirnames if d != "partial_movie_files"]
+        if f"{out_name}.mp4" in files:
+            path = os.path.join(dirpath, f"{out_name}.mp4")
+            found.append((os.path.getmtime(path), path))
+    found.sort()
+    for _, path in found[:-1]:
+        os.remove(path)
+    if found:
+        os.replace(found[-1][1], dest)
+
+
+def _dir_size(path: str) -> int:
+    if not os.path.isdir(path):
+        return 0
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+class VideoStore:
+    """
+    generated_videos/. A finished render is handed over by renaming it into the store,
+    so the bytes are never copied; only when the workspace is on another filesystem
+    does it fall back to copying (to a temporary name, then renamed into place).
+    The store is kept under `max_bytes` by evicting the least recently used videos
+    (by last download, else by creation) among those marked uploaded or disposable
+    (previews): anything else may be the only copy, so it is never evicted.
+    """
+    def __init__(self, root: str, max_bytes: int = VIDEO_STORE_MAX_BYTES,
+                 min_age: int = VIDEO_STORE_MIN_AGE_SECONDS):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self._last_access: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.renamed = 0
+        self.copied = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def path(self, filename: str) -> str:
+        return os.path.join(self.root, filename)
+
+    def put(self, src: str, out_name: str) -> str:
+        """Move `src` into the store under a new unique name and return its path."""
+        os.makedirs(self.root, exist_ok=True)
+        dest = self.path(f"{out_name}-{uuid.uuid4().hex[:8]}.mp4")
+        try:
+            os.replace(src, dest)
+            self.renamed += 1
+        except OSError:
+            print(f"Video store: {src} is on another filesystem, copying (set RENDER_WORK_ROOT next to {self.root})")
+            partial = dest + ".part"
+            shutil.copyfile(src, partial)
+            os.replace(partial, dest)
+            self.copied += 1
+        return dest
+
+    def hls_dir(self, filename: str) -> str:
+        """Directory of the HLS package of the video `filename` (see packaging.package_video)."""
+        return os.path.join(self.root, "hls", os.path.splitext(filename)[0])
+
+    def put_hls(self, src_dir: str, video_path: str):
+        """Move an HLS package next to the stored video at `video_path`."""
+        dest = self.hls_dir(os.path.basename(video_path))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        os.replace(src_dir, dest)
+
+    def artifact_name(self, filename: str, suffix: str) -> str:
+        return f"{os.path.splitext(filename)[0]}.{suffix}"
+
+    def put_artifact(self, src: str, video_path: str, suffix: str):
+        """
+        Move a poster/thumbnail file next to the stored video at `video_path`. It counts
+        against the budget as part of that video and is evicted with it.
+        """
+        os.replace(src, self.path(self.artifact_name(os.path.basename(video_path), suffix)))
+
+    def mark_uploaded(self, video_path: str):
+        """Record that the stored video at `video_path` has a copy in Supabase, making it evictable."""
+        marker = self.path(self.artifact_name(os.path.basename(video_path), UPLOADED_SUFFIX))
+        open(marker, "w").close()
+
+    def mark_disposable(self, video_path: str):
+        """Record that the stored video at `video_path` is a preview nobody keeps, making it evictable."""
+        marker = self.path(self.artifact_name(os.path.basename(video_path), DISPOSABLE_SUFFIX))
+        open(marker, "w").close()
+
+    def is_uploaded(self, filename: str) -> bool:
+        return os.path.exists(self.path(self.artifact_name(filename, UPLOADED_SUFFIX)))
+
+    def evictable(self, filename: str) -> bool:
+        return self.is_uploaded(filename) or os.path.exists(self.path(self.artifact_name(filename, DISPOSABLE_SUFFIX)))
+
+    def _companions(self, filename: str):
+        """Files stored next to a video as `<video stem>.<suffix>`: posters, thumbnails and markers."""
+        prefix = f"{os.path.splitext(filename)[0]}."
+        return [entry for entry in os.scandir(self.root)
+                if entry.is_file() and entry.name.startswith(prefix) and entry.name != filename]
+
+    def remove(self, filename: str):
+        """Delete a stored video with its HLS package, posters/thumbnails and markers."""
+        paths = [self.path(filename)] + ([entry.path for entry in self._companions(filename)]
+                                         if os.path.isdir(self.root) else [])
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        shutil.rmtree(self.hls_dir(filename), ignore_errors=True)
+        with self._lock:
+            self._last_access.pop(filename, None)
+
+    def touch(self, filename: str):
+        """Record that a video was served, so it is evicted last."""
+        with self._lock:
+            self._last_access[filename] = time.time()
+
+    def _files(self):
+        if not os.path.isdir(self.root):
+            return []
+        with self._lock:
+            last_access = dict(self._last_access)
+        entries = [entry for entry in os.scandir(self.root) if entry.is_file()]
+        # Bytes of each video's companion files (`<stem>.<suffix>`), counted with the video
+        extras: Dict[str, int] = {}
+        for entry in entries:
+            stem, dot, suffix = entry.name.partition(".")
+            if dot and suffix != "mp4":
+                extras[stem] = extras.get(stem, 0) + entry.stat().st_size
+        files = []
+        for entry in entries:
+            if entry.name.endswith(".mp4"):
+                st = entry.stat()
+                stem = os.path.splitext(entry.name)[0]
+                size = st.st_size + _dir_size(self.hls_dir(entry.name)) + extras.get(stem, 0)
+                files.append((max(last_access.get(entry.name, 0), st.st_mtime), entry.path, size, st.st_mtime))
+        return files
+
+    def evict(self):
+        """Delete least recently used uploaded videos until the store fits its budget."""
+        files = self._files()
+        total = sum(size for _, _, size, _ in files)
+        cutoff = time.time() - self.min_age
+        for _, path, size, created in sorted(files):
+            if total <= self.max_bytes:
+                break
+            name = os.path.basename(path)
+            if created > cutoff or not self.evictable(name):
+                continue
+            try:
+                self.remove(name)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+            self.evicted_bytes += size
+            print(f"Video store: evicted {os.path.basename(path)} ({size} bytes)")
+
+    def stats(self) -> Dict[str, Any]:
+        files = self._files()
+        return {
+            "files": len(files),
+            "bytes": sum(size for _, _, size, _ in files),
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "renamed": self.renamed,
+            "copied": self.copied,
+        }
+
+
+class WorkspaceReaper:
+    """
+    Deletes discarded render workspaces on a background thread, so removing a tree of
+    frames and partial movies never delays a response.
+    """
+    def __init__(self, root: str, max_age: int):
+        self.root = root
+        self.max_age = max_age
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.reaped = 0
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="workspace-reaper", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            shutil.rmtree(path, ignore_errors=True)
+            self.reaped += 1
+            self._queue.task_done()
+
+    def discard(self, path: str):
+        self._ensure_thread()
+        self._queue.put(path)
+
+    def sweep(self):
+        """Queue leftover workspaces older than max_age (renders interrupted by a restart)."""
+        if not os.path.isdir(self.root):
+            return
+        cutoff = time.time() - self.max_age
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith(WORKSPACE_PREFIX) and os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+                self.discard(path)
+
+    def drain(self):
+        """Block until every discarded workspace is gone."""
+        self._queue.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"pending": self._queue.qsize(), "reaped": self.reaped}
+
+
+video_store = VideoStore(VIDEO_DIR)
+workspace_reaper = WorkspaceReaper(RENDER_WORK_ROOT, WORKSPACE_MAX_AGE_SECONDS)
+
+
+def discard_workspace(path: str):
+    workspace_reaper.discard(path)
@@ -1,9 +1,41 @@
+from contextlib import asynccontextmanager
+import asyncio
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routes import generation, validation, rendering, protected, auth, chats
+from routes import generation, validation, rendering, protected, auth, chats, jobs
+from controllers.manim_workers import manim_workers, USE_MANIM_WORKERS
+from controllers.container_pool import container_pool, USE_CONTAINER_POOL
+from controllers.render_controller import write_behind
+from controllers.workspace import workspace_reaper
+from utils.supabase_client import open_http_client, close_http_client, close_async_supabase_client
 import os
 
-app = FastAPI(title="Simple Manim Runner")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Pre-start Manim workers / sandbox containers in the background so the first render skips startup cost.
+    use_native = os.getenv("USE_NATIVE_MANIM", "false").lower() == "true"
+    warmup = None
+    if use_native and USE_MANIM_WORKERS:
+        warmup = asyncio.create_task(manim_workers.warm())
+    elif not use_native and USE_CONTAINER_POOL:
+        warmup = asyncio.create_task(container_pool.warm())
+    # Resume uploads left pending by the previous process and clear its leftover render workspaces.
+    write_behind.start()
+    workspace_reaper.sweep()
+    # Pooled keep-alive client for Supabase auth verification
+    await open_http_client()
+    yield
+    await write_behind.stop()
+    await close_http_client()
+    await close_async_supabase_client()
+    if warmup is not None and not warmup.done():
+        warmup.cancel()
+    if not use_native and USE_CONTAINER_POOL:
+        await container_pool.shutdown()
+
+
+app = FastAPI(title="Simple Manim Runner", lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -19,6 +51,7 @@ app.add_middleware(
 app.include_router(generation.router, prefix="/api")
 app.include_router(validation.router, prefix="/api")
 app.include_router(rendering.router, prefix="/api")
+app.include_router(jobs.router, prefix="/api")
 app.include_router(protected.router, prefix="/api")
 app.include_router(auth.router, prefix="/api/auth")
 app.include_router(chats.router, prefix="/api/chats")
@@ -1,5 +1,6 @@
 # middlewares/auth.py
 import os
+import hashlib
 from typing import Optional, Dict, Any
 
 from fastapi import Depends, HTTPException, status
@@ -8,12 +9,23 @@ from jose import jwt, JWTError
 from datetime import datetime, timezone
 
 from utils.supabase_client import get_user_from_supabase
+from utils.ttl_cache import TTLCache
 
 security = HTTPBearer(auto_error=False)
 
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")  # optional, for local HS256 verification
 SUPABASE_AUD = os.getenv("SUPABASE_AUD")  # optional audience check if you set it in Supabase
 # If SUPABASE_JWT_SECRET is not provided, we fall back to calling Supabase admin endpoint.
+AUTH_CACHE_TTL_SECONDS = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+AUTH_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+# Both caches are per process: invalidate_user only clears the worker that handles it, so
+# under several uvicorn workers these TTLs are the real bound on serving a deactivated user.
+ACTIVE_CACHE_TTL_SECONDS = int(os.getenv("ACTIVE_CACHE_TTL_SECONDS", "30"))
+
+# Verified user info by sha256 of the token; an entry never outlives the token's exp claim.
+_token_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, AUTH_CACHE_TTL_SECONDS)
+# profiles.is_active by user ID
+_active_cache = TTLCache(AUTH_CACHE_MAX_ENTRIES, ACTIVE_CACHE_TTL_SECONDS)
 
 class AuthUser:
     """
@@ -49,26 +61,11 @@ async def _verify_jwt_locally(token: str) -> Optional[Dict[str, Any]]:
     except JWTError:
         return None
 
-async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> AuthUser:
-    """
-    Dependency for routes. Returns AuthUser or raises 401.
-    Behavior:
-      - If SUPABASE_JWT_SECRET is set: try local verification (fast).
-      - Otherwise: call Supabase /auth/v1/user endpoint (requires service_role key).
-    """
-    if credentials is None or credentials.scheme.lower() != "bearer":
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing or invalid auth header")
-
-    token = credentials.credentials
-
+async def _verify_token(token: str) -> Optional[Dict[str, Any]]:
+    """Verify `token` locally when possible, else with Supabase. Returns the user info dict or None."""
     # 1) Try local verification if configured
     payload = await _verify_jwt_locally(token)
     if payload:
-        # Check active status
-        user_id = payload.get("sub")
-        if not await check_user_active(user_id):
-             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User account is inactive")
-
         # Optional: basic sanity checks
         exp = payload.get("exp")
         if exp is not None:
@@ -78,39 +75,87 @@ async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] =
 
         # Build AuthUser from payload (Supabase user claims are often inside 'user' or top-level claims)
         # We'll standardize common fields.
-        user_info = {
-            "id": user_id,
+        return {
+            "id": payload.get("sub"),
             "email": payload.get("email"),
             "role": payload.get("role") or payload.get("app_metadata", {}).get("role"),
             **payload
         }
-        return AuthUser(user_info)
 
     # 2) Fall back to Supabase admin verify (server call)
-    user = await get_user_from_supabase(token)
-    if user:
-        user_id = user.get("id")
-        if not await check_user_active(user_id):
-             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User account is inactive")
-        return AuthUser(user)
+    return await get_user_from_supabase(token)
 
-    # If none succeeded, unauthorized
-    raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
-async def check_user_active(user_id: str):
+def _token_expiry(token: str) -> Optional[float]:
+    """The token's exp claim; only bounds how long an already verified token stays cached."""
+    try:
+        exp = jwt.get_unverified_claims(token).get("exp")
+    except JWTError:
+        return None
+    return float(exp) if exp is not None else None
+
+async def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> AuthUser:
     """
-    Helper to check if a user is active in public.profiles.
+    Dependency for routes. Returns AuthUser or raises 401.
+    Behavior:
+      - If SUPABASE_JWT_SECRET is set: try local verification (fast).
+      - Otherwise: call Supabase /auth/v1/user endpoint (requires service_role key).
+    Verified tokens are cached (by hash) for AUTH_CACHE_TTL_SECONDS, never past their expiry,
+    and is_active for ACTIVE_CACHE_TTL_SECONDS, so repeated requests need no network calls.
     """
-    from utils.supabase_client import get_supabase_client
-    supabase = get_supabase_client()
+    if credentials is None or credentials.scheme.lower() != "bearer":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing or invalid auth header")
+
+    token = credentials.credentials
+    key = _token_key(token)
+
+    user_info = _token_cache.get(key)
+    if user_info is None:
+        user_info = await _verify_token(token)
+        if not user_info:
+            # If none succeeded, unauthorized
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
+        _token_cache.put(key, user_info, expires_at=_token_expiry(token))
+
+    # Check active status
+    if not await check_user_active(user_info.get("id")):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User account is inactive")
+    return AuthUser(user_info)
+
+async def _fetch_user_active(user_id: str) -> Optional[bool]:
+    """profiles lookup; None when the answer should not be cached (lookup failed)."""
+    from utils.supabase_client import get_async_supabase_client
     try:
+        supabase = await get_async_supabase_client()
         # Use single() to expected exactly one row
-        res = supabase.table("profiles").select("is_active").eq("id", user_id).single().execute()
+        res = await supabase.table("profiles").select("is_active").eq("id", user_id).single().execute()
         if res.data and not res.data.get("is_active", True):
             return False
         return True
-    except Exception:
+    except Exception as e:
         # If profile doesn't exist, assume active? Or fail? 
         # Safest is to log and proceed or fail. 
         # For now, let's assume if profile missing, they rely on Auth User status.
-        return True
+        if getattr(e, "code", None) == "PGRST116":  # no profile row
+            return True
+        return None
+
+async def check_user_active(user_id: str):
+    """
+    Helper to check if a user is active in public.profiles.
+    Cached for ACTIVE_CACHE_TTL_SECONDS; see invalidate_user.
+    """
+    active = _active_cache.get(user_id)
+    if active is None:
+        active = await _fetch_user_active(user_id)
+        if active is None:
+            return True
+        _active_cache.put(user_id, active)
+    return active
+
+def invalidate_user(user_id: str):
+    """Forget a user's cached is_active status and verified tokens, e.g. after deactivating them."""
+    _active_cache.pop(user_id)
+    _token_cache.pop_where(lambda info: info.get("id") == user_id)
@@ -3,11 +3,16 @@ from typing import List, Optional, Dict, Any
 
 class PromptIn(BaseModel):
     prompt: str
+    use_cache: bool = True
+
+class ChatMessageIn(PromptIn):
+    preview: bool = False
 
 class GenerateResponse(BaseModel):
     path: str
     code: str
     metadata: dict
+    cached: bool = False
 
 class ValidationRequest(BaseModel):
     code: str
@@ -22,6 +27,7 @@ class CodeRequest(BaseModel):
     code: str
     scene_class: str = "GeneratedScene"
     quality: str = "low"
+    segmented: bool = False
 
 class CombinedGenerateRenderRequest(BaseModel):
     prompt: str
@@ -29,16 +35,28 @@ class CombinedGenerateRenderRequest(BaseModel):
     quality: str = "low"
     filename: str = "script.py"
     max_retries: int = 2
+    use_cache: bool = True
+    segmented: bool = False
+    candidates: Optional[int] = None
+    preview: bool = False
 
 class CombinedGenerateRenderResponse(BaseModel):
     success: bool
     filename: Optional[str] = None
     local_path: Optional[str] = None
     supabase_url: Optional[str] = None
+    video_url: Optional[str] = None
+    hls_url: Optional[str] = None
+    poster_url: Optional[str] = None
+    sprite_url: Optional[str] = None
+    animated_preview_url: Optional[str] = None
+    upload_pending: bool = False
     code: Optional[str] = None
     sanitized_code: Optional[str] = None
     error: Optional[str] = None
     logs: Optional[Dict[str, Any]] = None
+    preview: bool = False
+    final_job_id: Optional[str] = None
 
 class UserSignup(BaseModel):
     email: str
@@ -69,7 +87,11 @@ class MessageBase(BaseModel):
 class MessageOut(MessageBase):
     id: str
     video_url: Optional[str] = None
+    poster_url: Optional[str] = None
+    sprite_url: Optional[str] = None
+    animated_preview_url: Optional[str] = None
     sanitized_code: Optional[str] = None
+    final_job_id: Optional[str] = None
     created_at: str
 
 class VideoOut(BaseModel):
@@ -80,9 +102,24 @@ class VideoOut(BaseModel):
 
 class ChatWithMessages(ChatOut):
     messages: List[MessageOut] = []
+    has_more: bool = False
+    next_before: Optional[str] = None
 
 class CreateChatRequest(BaseModel):
     title: Optional[str] = "New Chat"
     initial_prompt: Optional[str] = None
 
+class JobSubmitted(BaseModel):
+    job_id: str
+    status: str
 
+class JobOut(BaseModel):
+    id: str
+    kind: str
+    status: str
+    stage: str
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    progress: Optional[Dict[str, Any]] = None
+    created_at: float
+    updated_at: float
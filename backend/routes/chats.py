@@ -1,35 +1,60 @@
+import os
 import asyncio
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse
+from typing import Dict, List, Optional
 from uuid import UUID
+from datetime import datetime
 
 from middlewares.auth import AuthUser, get_current_user
-from utils.supabase_client import get_supabase_client
-from models.schemas import ChatOut, MessageOut, ChatWithMessages, CreateChatRequest, PromptIn
-from controllers.render_controller import generate_and_render
-from models.schemas import CombinedGenerateRenderRequest
+from utils.supabase_client import get_async_supabase_client
+from models.schemas import ChatOut, MessageOut, ChatWithMessages, CreateChatRequest, ChatMessageIn
+from controllers.render_controller import generate_and_render, schedule_final_render, write_behind, artifact_urls
+from controllers.job_controller import submit_admitted_job, get_job, cancel_job
+from controllers.render_pool import render_pool
+from controllers.media_cache import chat_media_key
+from controllers.workspace import video_store
+from models.schemas import CombinedGenerateRenderRequest, JobSubmitted
 
 # Import controller logic directly if needed, or use service layer.
 # Reusing generation logic from render_controller for now.
 
 router = APIRouter()
 
+# Final-quality render job behind each chat's latest preview. A new message in the
+# chat abandons the previous preview, so its final render is cancelled.
+_final_jobs: Dict[str, str] = {}
+
+def _abandon_final_render(chat_id: str):
+    job_id = _final_jobs.pop(chat_id, None)
+    job = get_job(job_id) if job_id else None
+    if job is not None and cancel_job(job):
+        print(f"Cancelled final render {job_id} of chat {chat_id}")
+
 @router.get("/", response_model=List[ChatOut])
 async def list_chats(user: AuthUser = Depends(get_current_user)):
-    supabase = get_supabase_client()
-    res = supabase.table("chats").select("*").eq("user_id", user.id).order("updated_at", desc=True).execute()
+    supabase = await get_async_supabase_client()
+    res = await supabase.table("chats").select("*").eq("user_id", user.id).order("updated_at", desc=True).execute()
     return res.data
 
 @router.post("/", response_model=ChatOut)
 async def create_chat(req: CreateChatRequest, user: AuthUser = Depends(get_current_user)):
-    supabase = get_supabase_client()
+    """Create a chat; with `initial_prompt` its first message is rendered, admitted like send_message."""
+    if not req.initial_prompt:
+        return await _create_chat(req, user)
+    # Admit before inserting, so a full render queue (429) does not leave an empty chat behind
+    with render_pool.admission():
+        return await _create_chat(req, user)
+
+async def _create_chat(req: CreateChatRequest, user: AuthUser):
+    supabase = await get_async_supabase_client()
     
     # 1. Create Chat
     chat_data = {
         "user_id": user.id,
         "title": req.title or "New Chat"
     }
-    chat_res = supabase.table("chats").insert(chat_data).execute()
+    chat_res = await supabase.table("chats").insert(chat_data).execute()
     chat = chat_res.data[0]
     
     # 2. If initial prompt provided, trigger flow
@@ -45,41 +70,97 @@ async def create_chat(req: CreateChatRequest, user: AuthUser = Depends(get_curre
         
     return chat
 
+# Messages per page of GET /{chat_id} when paging (?limit= or ?before=); without either
+# the whole history is returned.
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "50"))
+CHAT_PAGE_MAX = 200
+CHAT_COLUMNS = "id, title, created_at, updated_at"
+MESSAGE_COLUMNS = "id, role, content, created_at"
+
+def _history_select(include_code: bool) -> str:
+    """Chat row with its messages and each message's video embedded (FK generated_videos.message_id)."""
+    video_columns = "video_url, code" if include_code else "video_url"
+    return f"{CHAT_COLUMNS}, messages({MESSAGE_COLUMNS}, generated_videos({video_columns}))"
+
+def _cursor(msg: dict) -> str:
+    """Page cursor `<created_at>|<id>`: id breaks ties between messages sharing a timestamp."""
+    return f"{msg['created_at']}|{msg['id']}"
+
+def _before_filter(before: str) -> str:
+    """
+    PostgREST logic tree for messages strictly older than the cursor, in (created_at, id) order.
+    Both parts are parsed and re-serialized, so nothing from the client reaches the filter verbatim.
+    """
+    created_at, _, msg_id = before.rpartition("|")
+    try:
+        created_at = datetime.fromisoformat(created_at.replace("Z", "+00:00")).isoformat()
+        msg_id = str(UUID(msg_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{msg_id}")'
+
 @router.get("/{chat_id}", response_model=ChatWithMessages)
-async def get_chat(chat_id: str, user: AuthUser = Depends(get_current_user)):
-    supabase = get_supabase_client()
-    
-    # Verify ownership handled by RLS, but we need to check existence
-    chat_res = supabase.table("chats").select("*").eq("id", chat_id).eq("user_id", user.id).single().execute()
+async def get_chat(chat_id: str, before: Optional[str] = None,
+                   limit: Optional[int] = Query(None, ge=1, le=CHAT_PAGE_MAX),
+                   include_code: bool = False, user: AuthUser = Depends(get_current_user)):
+    """
+    The chat and its messages (oldest first) in one PostgREST request. Without `before` or
+    `limit` that is the whole history; otherwise the newest `limit` (default CHAT_PAGE_SIZE)
+    messages older than the `before` cursor. Pass the returned `next_before` as `before`
+    while `has_more` is true. Generated code is only included with `include_code`.
+    """
+    supabase = await get_async_supabase_client()
+
+    query = supabase.table("chats").select(_history_select(include_code)).eq("id", chat_id).eq("user_id", user.id)
+    query = (query.order("created_at", desc=True, foreign_table="messages")
+             .order("id", desc=True, foreign_table="messages"))
+    paged = before is not None or limit is not None
+    if paged:
+        limit = limit or CHAT_PAGE_SIZE
+        if before:
+            query = query.or_(_before_filter(before), reference_table="messages")
+        # One extra row tells whether an older page exists
+        query = query.limit(limit + 1, foreign_table="messages")
+    chat_res = await query.single().execute()
     if not chat_res.data:
         raise HTTPException(status_code=404, detail="Chat not found")
-        
-    msgs_res = supabase.table("messages").select("*").eq("chat_id", chat_id).order("created_at").execute()
-    messages = msgs_res.data
-    
-    # Fetch videos linked to messages
-    videos_res = supabase.table("generated_videos").select("message_id, video_url, code").eq("chat_id", chat_id).execute()
-    video_map = {v["message_id"]: v for v in videos_res.data}
-    
-    # Merge video data into messages
-    for msg in messages:
-        if msg["id"] in video_map:
-            msg["video_url"] = video_map[msg["id"]]["video_url"]
-            msg["sanitized_code"] = video_map[msg["id"]]["code"]
+
+    chat = chat_res.data
+    rows = chat.pop("messages", None) or []
+    has_more = paged and len(rows) > limit
+    messages = []
+    for msg in reversed(rows[:limit] if paged else rows):
+        videos = msg.pop("generated_videos", None) or []
+        video = videos[0] if isinstance(videos, list) and videos else videos or None
+        if video:
+            msg["video_url"] = video["video_url"]
+            msg["sanitized_code"] = video.get("code")
+            msg.update(artifact_urls(msg["video_url"]))
+        messages.append(msg)
 
     return {
-        **chat_res.data,
-        "messages": messages
+        **chat,
+        "messages": messages,
+        "has_more": has_more,
+        "next_before": _cursor(messages[0]) if has_more else None,
     }
 
-async def process_user_message(chat_id: str, prompt: str, user: AuthUser):
-    supabase = get_supabase_client()
+async def _settle_upload(supabase, message_id: str, video_url: str):
+    """If the write-behind upload of a just-stored local URL already finished, store its public URL."""
+    public_url = write_behind.uploaded_url(video_url)
+    if public_url:
+        await supabase.table("generated_videos").update({"video_url": public_url}).eq("message_id", message_id).execute()
+
+async def process_user_message(chat_id: str, prompt: str, user: AuthUser, on_stage=None, use_cache: bool = True,
+                               preview: bool = False):
+    supabase = await get_async_supabase_client()
+    _abandon_final_render(chat_id)
     
     # 1. Update Chat's updated_at timestamp
     # This ensures the chat moves to the top of the list
     from datetime import datetime, timezone
     now_iso = datetime.now(timezone.utc).isoformat()
-    supabase.table("chats").update({"updated_at": now_iso}).eq("id", chat_id).execute()
+    await supabase.table("chats").update({"updated_at": now_iso}).eq("id", chat_id).execute()
 
     # 2. Save User Message
     user_msg_data = {
@@ -90,30 +171,36 @@ async def process_user_message(chat_id: str, prompt: str, user: AuthUser):
     # Ideally add user_id to messages if the schema supports it for RLS
     # user_msg_data["user_id"] = user.id 
     
-    supabase.table("messages").insert(user_msg_data).execute()
+    await supabase.table("messages").insert(user_msg_data).execute()
     
     # 3. Generate Logic
     try:
         render_req = CombinedGenerateRenderRequest(
             prompt=prompt,
             filename=f"chat_{chat_id}_step.py",
-            max_retries=2
+            max_retries=2,
+            use_cache=use_cache,
+            preview=preview
         )
         
         # Call the heavy lifter
-        result = await generate_and_render(render_req)
+        result = await generate_and_render(render_req, on_stage=on_stage, media_key=chat_media_key(chat_id))
         
         # result is a dict
         is_success = result.get("success", False)
         sanitized_code = result.get("sanitized_code")
         error_msg_val = result.get("error")
-        supabase_url = result.get("supabase_url")
+        is_preview = bool(result.get("preview"))
+        # Previews and videos still uploading play from this API until replaced by their public URL
+        video_url = result.get("video_url")
 
         # 4. Construct Assistant Response
         assistant_content = ""
         
         if is_success:
             assistant_content = f"Here is the generated video for: {prompt}"
+            if is_preview:
+                assistant_content = f"Here is a preview of the video for: {prompt} (the full-quality render replaces it when ready)"
             if sanitized_code:
                  assistant_content += f"\n\nCode used:\n```python\n{sanitized_code}\n```"
         else:
@@ -122,28 +209,47 @@ async def process_user_message(chat_id: str, prompt: str, user: AuthUser):
                  assistant_content += f"\n\nI tried running:\n```python\n{sanitized_code}\n```"
 
         # Save Assistant Message
+        if on_stage is not None:
+            on_stage("save")
         asst_msg_data = {
             "chat_id": chat_id,
             "role": "assistant",
             "content": assistant_content
         }
-        asst_msg_res = supabase.table("messages").insert(asst_msg_data).execute()
+        asst_msg_res = await supabase.table("messages").insert(asst_msg_data).execute()
         asst_msg = asst_msg_res.data[0]
         
         # 5. If success, Save Video Record linked to this message
-        if is_success and supabase_url:
+        if is_success and video_url:
             video_data = {
                 "chat_id": chat_id,
                 "message_id": asst_msg["id"],
                 "user_id": user.id,
                 "prompt": prompt,
                 "code": sanitized_code,
-                "video_url": supabase_url
+                "video_url": video_url
             }
-            supabase.table("generated_videos").insert(video_data).execute()
-            
+            await supabase.table("generated_videos").insert(video_data).execute()
+            await _settle_upload(supabase, asst_msg["id"], video_url)
+
+        # 6. For a preview, render the requested quality in the background and swap the URL in
+        if is_success and is_preview:
+            async def replace_preview(final):
+                final_url = final["video_url"]
+                await supabase.table("generated_videos").update({"video_url": final_url}).eq("message_id", asst_msg["id"]).execute()
+                await _settle_upload(supabase, asst_msg["id"], final_url)
+                # Nothing points at the preview any more
+                await asyncio.to_thread(video_store.remove, os.path.basename(result["local_path"]))
+                print(f"Replaced preview of message {asst_msg['id']} with {final_url}")
+
+            await schedule_final_render(result, render_req, media_key=chat_media_key(chat_id), on_done=replace_preview)
+            if result["final_job_id"]:
+                _final_jobs[chat_id] = result["final_job_id"]
+            asst_msg["final_job_id"] = result["final_job_id"]
+
         # Merge video data into message response
-        asst_msg["video_url"] = supabase_url if is_success else None
+        asst_msg["video_url"] = video_url if is_success else None
+        asst_msg.update(artifact_urls(asst_msg["video_url"]))
         asst_msg["sanitized_code"] = sanitized_code
              
         return asst_msg
@@ -155,22 +261,32 @@ async def process_user_message(chat_id: str, prompt: str, user: AuthUser):
             "role": "assistant", 
             "content": f"System Error: {str(e)}"
         }
-        supabase.table("messages").insert(err_msg).execute()
+        await supabase.table("messages").insert(err_msg).execute()
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/{chat_id}/message")
-async def send_message(chat_id: str, req: PromptIn, user: AuthUser = Depends(get_current_user)):
+async def send_message(chat_id: str, req: ChatMessageIn, background: bool = False, user: AuthUser = Depends(get_current_user)):
     """
     User sends a prompt. 
     1. Saves message. 2. Generates video. 3. Saves response.
     Verifies ownership.
+    With `?background=true` the work is queued and a 202 with a job ID is returned;
+    poll `GET /api/jobs/{job_id}` for the assistant message.
+    With `"preview": true` the message first gets a low-res preview; its `final_job_id`
+    renders the full quality and then replaces the video URL.
     """
-    supabase = get_supabase_client()
+    supabase = await get_async_supabase_client()
     
     # Verify chat ownership first
-    chat_res = supabase.table("chats").select("id").eq("id", chat_id).eq("user_id", user.id).single().execute()
+    chat_res = await supabase.table("chats").select("id").eq("id", chat_id).eq("user_id", user.id).single().execute()
     if not chat_res.data:
          raise HTTPException(status_code=404, detail="Chat not found")
 
-    return await process_user_message(chat_id, req.prompt, user)
+    if background:
+        job = await submit_admitted_job("chat_message", process_user_message, chat_id, req.prompt, user,
+                                        use_cache=req.use_cache, preview=req.preview)
+        return JSONResponse(status_code=202, content=JobSubmitted(job_id=job["id"], status=job["status"]).model_dump())
+
+    with render_pool.admission():
+        return await process_user_message(chat_id, req.prompt, user, use_cache=req.use_cache, preview=req.preview)
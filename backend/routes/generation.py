@@ -8,11 +8,12 @@ router = APIRouter()
 def generate_endpoint(req: PromptIn) -> GenerateResponse:
     try:
         print(req.prompt)
-        result = generate_manim_code(req.prompt)
+        result = generate_manim_code(req.prompt, use_cache=req.use_cache)
         return GenerateResponse(
             path=result["path"],
             code=result.get("code", ""),
             metadata=result.get("metadata", {}),
+            cached=result.get("cached", False),
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
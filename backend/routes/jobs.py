@@ -0,0 +1,41 @@
+import json
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from models.schemas import JobOut
+from controllers.job_controller import get_job, job_events, cancel_job
+
+router = APIRouter()
+
+@router.get("/jobs/{job_id}", response_model=JobOut)
+async def job_status(job_id: str):
+    """Report the stage and, once finished, the result of a queued job."""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.delete("/jobs/{job_id}", response_model=JobOut)
+async def job_cancel(job_id: str):
+    """Cancel a queued or running job (e.g. the final render of an abandoned preview)."""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    cancel_job(job)
+    return job
+
+@router.get("/jobs/{job_id}/events")
+async def job_event_stream(job_id: str):
+    """Stream a job's stage changes, render progress and final result as Server-Sent Events."""
+    job = get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def sse():
+        async for event in job_events(job):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,8 +1,8 @@
 # routes/protected.py
 from fastapi import APIRouter, Depends
-from middlewares.auth import AuthUser, get_current_user
+from middlewares.auth import AuthUser, get_current_user, invalidate_user
 
-router = APIRouter(prefix="/api")
+router = APIRouter()
 
 @router.get("/me")
 async def me(user: AuthUser = Depends(get_current_user)):
@@ -21,3 +21,15 @@ async def admin_only(user: AuthUser = Depends(get_current_user)):
         from fastapi import HTTPException, status
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admins only")
     return {"message": "Welcome admin", "user": user.id}
+
+@router.post("/admin/users/{user_id}/invalidate")
+async def admin_invalidate_user(user_id: str, user: AuthUser = Depends(get_current_user)):
+    """
+    Drop a user's cached auth state so a profile change (e.g. is_active) applies immediately.
+    Only in this worker process; other workers catch up within ACTIVE_CACHE_TTL_SECONDS.
+    """
+    if user.role != "admin":
+        from fastapi import HTTPException, status
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admins only")
+    invalidate_user(user_id)
+    return {"invalidated": user_id}
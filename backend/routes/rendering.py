@@ -1,25 +1,98 @@
-from fastapi import APIRouter
-from models.schemas import CodeRequest, CombinedGenerateRenderRequest, CombinedGenerateRenderResponse
-from controllers.render_controller import render_code, generate_and_render
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Request
+from models.schemas import CodeRequest, CombinedGenerateRenderRequest, CombinedGenerateRenderResponse, JobSubmitted
+from controllers.render_controller import render_code, generate_and_render, render_cache, schedule_final_render, write_behind
+from controllers.job_controller import submit_admitted_job, queue_depth
+from controllers.render_pool import render_pool
+from controllers.manim_workers import manim_workers
+from controllers.container_pool import container_pool
+from controllers.media_cache import media_cache
+from controllers.upload_controller import uploader
+from controllers.workspace import video_store, workspace_reaper
+from utils.video_response import etags, video_response
+from fastapi.responses import JSONResponse
 import os
+import asyncio
 from fastapi import HTTPException
 
 router = APIRouter()
 
 @router.post("/render")
 async def render_endpoint(req: CodeRequest):
-    return await render_code(req)
+    with render_pool.admission():
+        return await render_code(req)
+
+async def _generate_and_render(req: CombinedGenerateRenderRequest, on_stage=None):
+    result = await generate_and_render(req, on_stage=on_stage)
+    if result.get("preview"):
+        await schedule_final_render(result, req)
+    return result
 
 @router.post("/generate-and-render", response_model=CombinedGenerateRenderResponse)
-async def generate_and_render_endpoint(req: CombinedGenerateRenderRequest):
-    return await generate_and_render(req)
-
-@router.get("/videos/{filename}")
-def download_video(filename: str):
-    """Serve a previously generated video file from `generated_videos/`."""
-    dest_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "generated_videos")
-    path = os.path.join(dest_dir, filename)
-    if not os.path.exists(path):
+async def generate_and_render_endpoint(req: CombinedGenerateRenderRequest, background: bool = False):
+    """
+    Run the full pipeline. With `?background=true`, queue it and return 202 with a job ID.
+    With `"preview": true`, return a quick low-res preview plus `final_job_id` of the full render.
+    """
+    if background:
+        job = await submit_admitted_job("generate_and_render", _generate_and_render, req)
+        return JSONResponse(status_code=202, content=JobSubmitted(job_id=job["id"], status=job["status"]).model_dump())
+    with render_pool.admission():
+        return await _generate_and_render(req)
+
+@router.get("/render/pool")
+async def render_pool_status():
+    """Occupancy of the render slot pool and its wait queue, the background job queue, plus the warm workers and containers."""
+    return {
+        **render_pool.stats(),
+        "job_queue": queue_depth(),
+        "workers": manim_workers.stats(),
+        "containers": container_pool.stats(),
+    }
+
+@router.get("/uploads")
+async def upload_stats():
+    """Throughput and failure counters of the resumable Supabase uploader, plus the write-behind queue."""
+    if uploader is None:
+        return {"enabled": False, "write_behind": write_behind.stats()}
+    return {"enabled": True, **uploader.stats(), "write_behind": write_behind.stats()}
+
+@router.get("/render/cache")
+async def render_cache_status():
+    """Size and hit/miss counters of the render result cache, plus the Manim media dir cache and video store."""
+    return {**render_cache.stats(), "media": media_cache.stats(), "store": video_store.stats(),
+            "workspaces": workspace_reaper.stats()}
+
+STORE_MEDIA_TYPES = {".mp4": "video/mp4", ".jpg": "image/jpeg", ".webp": "image/webp"}
+
+@router.api_route("/videos/{filename}", methods=["GET", "HEAD"])
+async def download_video(filename: str, request: Request):
+    """
+    Serve a previously generated video (or its poster/thumbnails) from `generated_videos/`, with byte ranges,
+    a content-hash ETag (If-None-Match / If-Range) and long-lived Cache-Control.
+    """
+    path = video_store.path(filename)
+    try:
+        st = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+    etag = await asyncio.to_thread(etags.get, path, st)
+    video_store.touch(filename)
+    return video_response(request, path, st, etag,
+                          media_type=STORE_MEDIA_TYPES.get(os.path.splitext(filename)[1], "video/mp4"))
+
+HLS_MEDIA_TYPES = {".m3u8": "application/vnd.apple.mpegurl", ".ts": "video/mp2t"}
+
+@router.api_route("/videos/hls/{name}/{part}", methods=["GET", "HEAD"])
+async def download_hls(name: str, part: str, request: Request):
+    """Serve the HLS playlist and segments of a video packaged with VIDEO_HLS."""
+    media_type = HLS_MEDIA_TYPES.get(os.path.splitext(part)[1])
+    if media_type is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    path = os.path.join(video_store.hls_dir(f"{name}.mp4"), part)
+    try:
+        st = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found")
-    return FileResponse(path, media_type="video/mp4", filename=filename)
+    etag = await asyncio.to_thread(etags.get, path, st)
+    video_store.touch(f"{name}.mp4")
+    return video_response(request, path, st, etag, media_type=media_type)
@@ -1,6 +1,6 @@
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 import sys
 import os
 
@@ -25,6 +25,16 @@ def mock_supabase(mocker):
     mocker.patch("utils.supabase_client.get_supabase_client", return_value=mock_client)
     return mock_client
 
+@pytest.fixture
+def mock_async_supabase(mocker):
+    """
+    Mock the async Supabase client awaited by the chat routes. Query builders are
+    plain mocks; set `...execute.return_value.data` as with mock_supabase.
+    """
+    mock_client = MagicMock()
+    mocker.patch("routes.chats.get_async_supabase_client", AsyncMock(return_value=mock_client))
+    return mock_client
+
 @pytest.fixture
 def mock_user_auth(mocker):
     """
@@ -1,4 +1,5 @@
-from unittest.mock import MagicMock
+import pytest
+from unittest.mock import AsyncMock, MagicMock
 
 def test_signup_success(test_app, mock_supabase):
     # Mock supabase.auth.sign_up
@@ -49,3 +50,112 @@ def test_google_login_url(test_app, mock_supabase):
     response = test_app.get("/api/auth/google")
     assert response.status_code == 200
     assert response.json()["url"] == "https://accounts.google.com/o/oauth2/auth..."
+
+
+def test_get_current_user_caches_token_and_active_status(mocker):
+    import asyncio
+    import time
+    from jose import jwt
+    from fastapi.security import HTTPAuthorizationCredentials
+    from middlewares import auth
+
+    mocker.patch.object(auth, "SUPABASE_JWT_SECRET", "secret")
+    mocker.patch.object(auth, "_token_cache", auth.TTLCache(16, 60))
+    mocker.patch.object(auth, "_active_cache", auth.TTLCache(16, 60))
+    decode = mocker.spy(auth.jwt, "decode")
+    fetch_active = mocker.patch.object(auth, "_fetch_user_active", AsyncMock(side_effect=[True, False]))
+
+    token = jwt.encode({"sub": "user-1", "exp": int(time.time()) + 300}, "secret", algorithm="HS256")
+    creds = HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+    for _ in range(3):
+        assert asyncio.run(auth.get_current_user(creds)).id == "user-1"
+    assert decode.call_count == 1
+    assert fetch_active.call_count == 1
+
+    auth.invalidate_user("user-1")
+    with pytest.raises(auth.HTTPException) as exc:
+        asyncio.run(auth.get_current_user(creds))
+    assert exc.value.status_code == 403
+    assert decode.call_count == 2
+
+
+def test_concurrent_supabase_verifications_share_one_request(mocker):
+    import asyncio
+    from utils import supabase_client
+
+    calls = []
+
+    async def fake_fetch_user(token):
+        calls.append(token)
+        await asyncio.sleep(0.05)
+        return {"id": "user-1"}
+
+    mocker.patch.object(supabase_client, "SERVICE_ROLE_KEY", "service")
+    mocker.patch.object(supabase_client, "_fetch_user", fake_fetch_user)
+
+    async def scenario():
+        return await asyncio.gather(*(supabase_client.get_user_from_supabase("tok") for _ in range(5)),
+                                    supabase_client.get_user_from_supabase("other"))
+
+    results = asyncio.run(scenario())
+    assert [r["id"] for r in results] == ["user-1"] * 6
+    assert sorted(calls) == ["other", "tok"]
+    assert supabase_client._inflight == {}
+
+
+def test_http_client_from_previous_loop_is_closed():
+    import asyncio
+    from utils import supabase_client
+
+    first = asyncio.run(supabase_client.open_http_client())
+    second = asyncio.run(supabase_client.open_http_client())
+    assert second is not first
+    assert first.is_closed and not second.is_closed
+    asyncio.run(supabase_client.close_http_client())
+
+
+
+def test_async_supabase_client_uses_configured_pool(mocker):
+    import asyncio
+    from utils import supabase_client
+
+    mocker.patch.object(supabase_client, "SUPABASE_KEY", "anon-key")
+    mocker.patch.object(supabase_client, "SUPABASE_HTTP_KEEPALIVE_SECONDS", 7.0)
+
+    async def scenario():
+        client = await supabase_client.get_async_supabase_client()
+        session = client.postgrest.session
+        pool = session._transport._pool
+        await supabase_client.close_async_supabase_client()
+        return session, pool
+
+    session, pool = asyncio.run(scenario())
+    assert pool._max_connections == supabase_client.SUPABASE_HTTP_MAX_CONNECTIONS
+    assert pool._keepalive_expiry == 7.0
+    assert session.is_closed
+
+def test_failed_verification_with_cancelled_waiters_is_retrieved(mocker):
+    import gc
+    import asyncio
+    from utils import supabase_client
+
+    async def failing_fetch_user(token):
+        await asyncio.sleep(0.05)
+        raise RuntimeError("supabase down")
+
+    mocker.patch.object(supabase_client, "SERVICE_ROLE_KEY", "service")
+    mocker.patch.object(supabase_client, "_fetch_user", failing_fetch_user)
+    unretrieved = []
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, ctx: unretrieved.append(ctx["message"]))
+        waiter = asyncio.ensure_future(supabase_client.get_user_from_supabase("tok"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.1)
+        gc.collect()
+
+    asyncio.run(scenario())
+    assert supabase_client._inflight == {}
+    assert unretrieved == []
@@ -1,4 +1,4 @@
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 import pytest
 
 def test_list_chats(test_app, mock_user_auth, mock_supabase):
@@ -32,33 +32,105 @@ def test_create_chat_no_initial_prompt(test_app, mock_user_auth, mock_supabase):
     assert response.status_code == 200
     assert response.json()["title"] == "My New Chat"
 
-@pytest.mark.asyncio
-async def test_get_chat_details_found(test_app, mock_user_auth, mock_supabase):
+def _history_query(mock_async_supabase, data, before=False, paged=False):
+    query = mock_async_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value
+    query = query.order.return_value.order.return_value
+    if before:
+        query = query.or_.return_value
+    if paged:
+        query = query.limit.return_value
+    query = query.single.return_value
+    query.execute = AsyncMock(return_value=MagicMock(data=data))
+    return query
+
+def test_get_chat_details_found(test_app, mock_user_auth, mock_async_supabase):
     chat_id = "chat-123"
-    
-    # Mock chat fetch
-    mock_chat_query = mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.single.return_value
-    mock_chat_query.execute.return_value.data = {"id": chat_id, "title": "Found Chat"}
-    
-    # Mock messages fetch
-    mock_msgs_query = mock_supabase.table.return_value.select.return_value.eq.return_value.order.return_value
-    mock_msgs_query.execute.return_value.data = [
-        {"id": "msg-1", "content": "hello", "role": "user"},
-        {"id": "msg-2", "content": "hi", "role": "assistant"}
-    ]
+    # One request: the chat with its messages (newest first) and their videos embedded
+    query = _history_query(mock_async_supabase, {
+        "id": chat_id, "title": "Found Chat", "created_at": "2023-01-01T00:00:00Z",
+        "messages": [
+            {"id": "msg-2", "content": "hi", "role": "assistant", "created_at": "2023-01-01T00:00:02Z",
+             "generated_videos": [{"video_url": "https://cdn/render-0123abcd.mp4"}]},
+            {"id": "msg-1", "content": "hello", "role": "user", "created_at": "2023-01-01T00:00:01Z",
+             "generated_videos": []},
+        ],
+    })
 
     response = test_app.get(f"/api/chats/{chat_id}")
     assert response.status_code == 200
     data = response.json()
     assert data["id"] == chat_id
-    assert len(data["messages"]) == 2
+    assert [m["id"] for m in data["messages"]] == ["msg-1", "msg-2"]
+    assert data["messages"][1]["video_url"] == "https://cdn/render-0123abcd.mp4"
+    assert data["messages"][1]["sanitized_code"] is None
+    assert data["has_more"] is False
+    query.execute.assert_awaited_once()
+    select = mock_async_supabase.table.return_value.select.call_args[0][0]
+    assert "generated_videos(video_url)" in select
+    # Without before/limit the whole history is returned
+    ordered = mock_async_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.order.return_value.order.return_value
+    ordered.limit.assert_not_called()
+
+def test_get_chat_paginates_with_before_cursor(test_app, mock_user_auth, mock_async_supabase):
+    # msg-4a and msg-4b share a timestamp across the page boundary
+    rows = [{"id": msg_id, "content": "x", "role": "user", "created_at": created_at}
+            for msg_id, created_at in (("msg-5", "2023-01-01T00:00:05Z"), ("msg-4b", "2023-01-01T00:00:04Z"),
+                                       ("msg-4a", "2023-01-01T00:00:04Z"))]
+    _history_query(mock_async_supabase, {"id": "chat-1", "title": "t", "created_at": "now", "messages": rows},
+                   before=True, paged=True)
 
-def test_get_chat_details_not_found(test_app, mock_user_auth, mock_supabase):
+    cursor_id = "00000000-0000-4000-8000-000000000006"
+    response = test_app.get("/api/chats/chat-1", params={"before": f"2023-01-01T00:00:06Z|{cursor_id}", "limit": 2,
+                                                          "include_code": True})
+    assert response.status_code == 200
+    data = response.json()
+    assert [m["id"] for m in data["messages"]] == ["msg-4b", "msg-5"]
+    assert data["has_more"] is True
+    assert data["next_before"] == "2023-01-01T00:00:04Z|msg-4b"
+    ordered = mock_async_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.order.return_value.order.return_value
+    ordered.or_.assert_called_once_with(
+        'created_at.lt."2023-01-01T00:00:06+00:00",'
+        f'and(created_at.eq."2023-01-01T00:00:06+00:00",id.lt."{cursor_id}")',
+        reference_table="messages")
+    ordered.or_.return_value.limit.assert_called_once_with(3, foreign_table="messages")
+    assert "generated_videos(video_url, code)" in mock_async_supabase.table.return_value.select.call_args[0][0]
+
+def test_get_chat_details_not_found(test_app, mock_user_auth, mock_async_supabase):
     chat_id = "missing-chat"
     
     # Mock chat fetch returning None
-    mock_chat_query = mock_supabase.table.return_value.select.return_value.eq.return_value.eq.return_value.single.return_value
-    mock_chat_query.execute.return_value.data = None
+    _history_query(mock_async_supabase, None)
 
     response = test_app.get(f"/api/chats/{chat_id}")
     assert response.status_code == 404
+
+def test_list_chats_awaits_async_client(test_app, mock_user_auth, mock_async_supabase):
+    expected_data = [
+        {"id": "chat-1", "user_id": "test-user-id", "title": "Chat 1", "created_at": "2023-01-01T00:00:00Z"}
+    ]
+    query = mock_async_supabase.table.return_value.select.return_value.eq.return_value.order.return_value
+    query.execute = AsyncMock(return_value=MagicMock(data=expected_data))
+
+    response = test_app.get("/api/chats/")
+    assert response.status_code == 200
+    assert response.json()[0]["id"] == "chat-1"
+    query.execute.assert_awaited_once()
+
+def test_create_chat_with_initial_prompt_is_admitted(test_app, mock_user_auth, mock_async_supabase, mocker):
+    from controllers.render_pool import RenderSlotPool
+
+    full_pool = RenderSlotPool(slots=1, queue_limit=0)
+    full_pool.admitted = 1
+    mocker.patch("routes.chats.render_pool", full_pool)
+    process = mocker.patch("routes.chats.process_user_message", AsyncMock())
+
+    response = test_app.post("/api/chats/", json={"title": "t", "initial_prompt": "draw a circle"})
+    assert response.status_code == 429
+    mock_async_supabase.table.return_value.insert.assert_not_called()
+    process.assert_not_awaited()
+
+@pytest.mark.parametrize("before", ["x|y", "2023-01-01T00:00:06Z|msg-6", 'now")|00000000-0000-4000-8000-000000000006',
+                                    "2023-01-01T00:00:06Z"])
+def test_get_chat_rejects_malformed_cursor(test_app, mock_user_auth, mock_async_supabase, before):
+    response = test_app.get("/api/chats/chat-1", params={"before": before})
+    assert response.status_code == 400
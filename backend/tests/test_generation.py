@@ -16,7 +16,7 @@ def test_generate_endpoint(test_app, mocker):
     data = response.json()
     assert data["path"] == "test_path.py"
     assert data["code"] == "print('hello')"
-    mock_generate.assert_called_once_with("Create a blue circle")
+    mock_generate.assert_called_once_with("Create a blue circle", use_cache=True)
 
 def test_generate_endpoint_error(test_app, mocker):
     mock_generate = mocker.patch("routes.generation.generate_manim_code")
@@ -27,3 +27,69 @@ def test_generate_endpoint_error(test_app, mocker):
     
     assert response.status_code == 500
     assert response.json()["detail"] == "Generation failed"
+
+def test_generate_manim_code_uses_llm_cache(mocker, tmp_path, monkeypatch):
+    from controllers import generation_controller
+    from utils.llm_cache import LLMCache
+
+    monkeypatch.chdir(tmp_path)
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite3"), max_entries=10, ttl_seconds=60)
+    mocker.patch.object(generation_controller, "llm_cache", cache)
+
+    mock_client = MagicMock()
+    mock_client.models.generate_content.return_value.text = (
+        "```python\nfrom manim import *\n```\n///METADATA/// {\"duration_seconds\": 5}"
+    )
+    mocker.patch.object(generation_controller, "get_genai_client", return_value=mock_client)
+
+    first = generation_controller.generate_manim_code("explain  binary search")
+    second = generation_controller.generate_manim_code("explain binary search ")
+    assert first["cached"] is False
+    assert second["cached"] is True
+    assert second["code"] == "from manim import *"
+    assert second["metadata"] == {"duration_seconds": 5}
+    assert mock_client.models.generate_content.call_count == 1
+
+    bypassed = generation_controller.generate_manim_code("explain binary search", use_cache=False)
+    assert bypassed["cached"] is False
+    assert mock_client.models.generate_content.call_count == 2
+
+def test_stream_manim_code_returns_before_metadata(mocker, tmp_path, monkeypatch):
+    import asyncio
+    import threading
+    from controllers import generation_controller
+    from utils.llm_cache import LLMCache
+
+    monkeypatch.chdir(tmp_path)
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite3"), max_entries=10, ttl_seconds=60)
+    mocker.patch.object(generation_controller, "llm_cache", cache)
+
+    release_tail = threading.Event()
+
+    def chunks(**kwargs):
+        yield MagicMock(text="```python\nfrom manim import *\n")
+        yield MagicMock(text="class GeneratedScene(Scene): pass\n```\n")
+        release_tail.wait(5)
+        yield MagicMock(text="///METADATA/// {\"duration_seconds\": 5}")
+
+    mock_client = MagicMock()
+    mock_client.models.generate_content_stream.side_effect = chunks
+    mocker.patch.object(generation_controller, "get_genai_client", return_value=mock_client)
+
+    async def scenario():
+        result = await generation_controller.stream_manim_code("draw a square")
+        assert not release_tail.is_set()
+        release_tail.set()
+        for _ in range(100):
+            if cache.get(cache.key("draw a square", generation_controller.GENAI_MODEL, generation_controller.PROMPT_TEMPLATE)):
+                break
+            await asyncio.sleep(0.02)
+        return result
+
+    result = asyncio.run(scenario())
+    assert result["code"] == "from manim import *\nclass GeneratedScene(Scene): pass"
+    assert result["cached"] is False
+
+    cached = generation_controller.generate_manim_code("draw a square")
+    assert cached["cached"] is True
+    assert cached["metadata"] == {"duration_seconds": 5}
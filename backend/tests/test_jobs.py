@@ -0,0 +1,148 @@
+import time
+import asyncio
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from controllers import job_controller
+from controllers.render_pool import render_pool
+
+
+def _wait_for_job(client, job_id, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        data = client.get(f"/api/jobs/{job_id}").json()
+        if data["status"] in ("succeeded", "failed", "cancelled"):
+            return data
+        time.sleep(0.05)
+    raise AssertionError("job did not finish in time")
+
+
+def test_generate_and_render_background_job(mocker):
+    async def fake_generate_and_render(req, on_stage=None):
+        on_stage("render")
+        return {"success": True, "supabase_url": "http://vid.url"}
+
+    mocker.patch("routes.rendering.generate_and_render", side_effect=fake_generate_and_render)
+
+    with TestClient(app) as client:
+        response = client.post("/api/generate-and-render?background=true", json={"prompt": "make video"})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+
+        data = _wait_for_job(client, job_id)
+        assert data["status"] == "succeeded"
+        assert data["result"]["supabase_url"] == "http://vid.url"
+
+
+def test_background_job_failure_is_reported(mocker):
+    async def failing_generate_and_render(req, on_stage=None):
+        return {"success": False, "error": "Render failed: boom"}
+
+    mocker.patch("routes.rendering.generate_and_render", side_effect=failing_generate_and_render)
+
+    with TestClient(app) as client:
+        response = client.post("/api/generate-and-render?background=true", json={"prompt": "make video"})
+        data = _wait_for_job(client, response.json()["job_id"])
+        assert data["status"] == "failed"
+        assert data["error"] == "Render failed: boom"
+
+
+def test_job_not_found(test_app):
+    response = test_app.get("/api/jobs/does-not-exist")
+    assert response.status_code == 404
+
+
+def test_job_events_stream_progress(mocker):
+    import asyncio
+    import json
+    from utils.progress import ManimProgress
+
+    async def fake_generate_and_render(req, on_stage=None):
+        await asyncio.sleep(0.2)
+        on_stage("render")
+        ManimProgress(total_animations=2).feed("Animation 1: Create(Circle):  50%|#####     | 15/30 [00:01<00:01, 15.00it/s]")
+        return {"success": True, "supabase_url": "http://vid.url"}
+
+    mocker.patch("routes.rendering.generate_and_render", side_effect=fake_generate_and_render)
+
+    with TestClient(app) as client:
+        job_id = client.post("/api/generate-and-render?background=true", json={"prompt": "make video"}).json()["job_id"]
+        events = []
+        with client.stream("GET", f"/api/jobs/{job_id}/events") as response:
+            assert response.headers["content-type"].startswith("text/event-stream")
+            for line in response.iter_lines():
+                if line.startswith("data: "):
+                    events.append(json.loads(line[len("data: "):]))
+
+    progress = next(e for e in events if e["type"] == "progress")
+    assert (progress["animation"], progress["frame"], progress["frames"], progress["fps"]) == (1, 15, 30, 15.0)
+    assert progress["total_animations"] == 2
+    assert events[-1]["type"] == "done"
+    assert events[-1]["result"]["supabase_url"] == "http://vid.url"
+
+
+def test_cancel_running_job(mocker):
+    import asyncio
+
+    async def slow_generate_and_render(req, on_stage=None):
+        on_stage("render")
+        await asyncio.sleep(30)
+        return {"success": True}
+
+    mocker.patch("routes.rendering.generate_and_render", side_effect=slow_generate_and_render)
+
+    with TestClient(app) as client:
+        job_id = client.post("/api/generate-and-render?background=true", json={"prompt": "make video"}).json()["job_id"]
+        while client.get(f"/api/jobs/{job_id}").json()["stage"] != "render":
+            time.sleep(0.02)
+        assert client.delete(f"/api/jobs/{job_id}").status_code == 200
+        assert _wait_for_job(client, job_id)["status"] == "cancelled"
+
+
+def test_preview_queues_final_render(mocker):
+    async def fake_generate_and_render(req, on_stage=None):
+        assert req.preview
+        return {"success": True, "preview": True, "filename": "render-preview.mp4", "sanitized_code": "code"}
+
+    async def fake_render_final(sanitized_code, req, on_stage=None, media_key=None):
+        assert sanitized_code == "code" and req.quality == "high"
+        return {"success": True, "filename": "render-final.mp4", "supabase_url": "http://final.url"}
+
+    mocker.patch("routes.rendering.generate_and_render", side_effect=fake_generate_and_render)
+    mocker.patch("controllers.render_controller.render_final", side_effect=fake_render_final)
+
+    with TestClient(app) as client:
+        response = client.post("/api/generate-and-render", json={"prompt": "make video", "quality": "high", "preview": True})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["preview"] is True
+        assert data["filename"] == "render-preview.mp4"
+
+        final = _wait_for_job(client, data["final_job_id"])
+        assert final["status"] == "succeeded"
+        assert final["result"]["supabase_url"] == "http://final.url"
+
+
+@pytest.mark.asyncio
+async def test_cancelling_queued_job_releases_admission(mocker):
+    mocker.patch.object(job_controller, "JOB_WORKERS", 1)
+    gate = asyncio.Event()
+
+    async def blocked(on_stage=None):
+        await gate.wait()
+
+    before = render_pool.admitted
+    running = await job_controller.submit_admitted_job("test", blocked)
+    queued = await job_controller.submit_admitted_job("test", blocked)
+    await asyncio.sleep(0.05)
+    assert running["status"] == "running" and queued["status"] == "queued"
+    assert render_pool.admitted == before + 2
+
+    assert job_controller.cancel_job(queued)
+    assert render_pool.admitted == before + 1
+
+    gate.set()
+    await job_controller._queue.join()
+    assert running["status"] == "succeeded"
+    assert render_pool.admitted == before
@@ -15,3 +15,16 @@ def test_admin_only_endpoint_success(test_app, mock_admin_auth):
     response = test_app.get("/api/admin-only")
     assert response.status_code == 200
     assert response.json()["message"] == "Welcome admin"
+
+def test_admin_invalidate_user(test_app, mock_admin_auth, mocker):
+    invalidate = mocker.patch("routes.protected.invalidate_user")
+    response = test_app.post("/api/admin/users/user-42/invalidate")
+    assert response.status_code == 200
+    assert response.json() == {"invalidated": "user-42"}
+    invalidate.assert_called_once_with("user-42")
+
+def test_admin_invalidate_user_forbidden(test_app, mock_user_auth, mocker):
+    invalidate = mocker.patch("routes.protected.invalidate_user")
+    response = test_app.post("/api/admin/users/user-42/invalidate")
+    assert response.status_code == 403
+    invalidate.assert_not_called()
@@ -1,5 +1,6 @@
+import os
 import pytest
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 
 @pytest.mark.asyncio
 async def test_render_endpoint(test_app, mocker):
@@ -93,3 +94,682 @@ def test_download_video_found(test_app, mocker, tmp_path):
 def test_download_video_not_found(test_app):
     response = test_app.get("/api/videos/non_existent.mp4")
     assert response.status_code == 404
+
+def test_run_process_timeout_kills_process():
+    import asyncio
+    import subprocess
+    import time
+    from utils.process import run_process
+
+    start = time.time()
+    with pytest.raises(subprocess.TimeoutExpired):
+        asyncio.run(run_process(["sleep", "30"], timeout=0.2))
+    assert time.time() - start < 5
+
+def test_run_process_collects_output():
+    import asyncio
+    from utils.process import run_process
+
+    returncode, stdout, stderr = asyncio.run(run_process(["sh", "-c", "echo out; echo err >&2; exit 3"], timeout=5))
+    assert returncode == 3
+    assert stdout.strip() == "out"
+    assert stderr.strip() == "err"
+
+def test_render_pool_status(test_app):
+    response = test_app.get("/api/render/pool")
+    assert response.status_code == 200
+    data = response.json()
+    assert data["slots"] >= 1
+    assert "waiting" in data and "rejected" in data
+    assert data["job_queue"] == 0
+
+def test_render_rejected_when_queue_full(test_app, mocker):
+    from controllers.render_pool import RenderSlotPool
+
+    full_pool = RenderSlotPool(slots=1, queue_limit=0)
+    full_pool.admitted = 1
+    mocker.patch("routes.rendering.render_pool", full_pool)
+    mock_render = mocker.patch("routes.rendering.render_code")
+
+    response = test_app.post("/api/render", json={"code": "some code"})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+    assert full_pool.rejected == 1
+    mock_render.assert_not_called()
+
+def test_render_cache_hit_skips_render(test_app, mocker, tmp_path):
+    from controllers import render_controller
+    from controllers.render_controller import RenderCache
+
+    cache = RenderCache(max_entries=8, max_bytes=1024 * 1024)
+    mocker.patch.object(render_controller, "render_cache", cache)
+    mock_run = mocker.patch.object(render_controller, "run_manim")
+
+    video = tmp_path / "render-cached.mp4"
+    video.write_bytes(b"video content")
+    key = cache.key("from manim import *", "GeneratedScene", "low")
+    cache.put(key, str(video), "http://cached.url")
+
+    response = test_app.post("/api/render", json={"code": "from manim import *"})
+    assert response.status_code == 200
+    assert response.json()["supabase_url"] == "http://cached.url"
+    assert response.json()["cached"] is True
+    assert cache.hits == 1
+    mock_run.assert_not_called()
+
+def test_render_cache_evicts_least_recently_used(tmp_path):
+    from controllers.render_controller import RenderCache
+
+    cache = RenderCache(max_entries=2, max_bytes=1024)
+    for name in ("a", "b", "c"):
+        path = tmp_path / f"{name}.mp4"
+        path.write_bytes(b"x" * 10)
+        cache.put(name, str(path), None)
+
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+    assert cache.evictions == 1
+    assert cache.stats()["bytes"] == 20
+
+FAKE_MANIM_WORKER = """
+import sys, json, os
+print(json.dumps({"ready": True, "pid": os.getpid()}), flush=True)
+for line in sys.stdin:
+    job = json.loads(line)
+    with open(job["log_path"], "w") as log:
+        log.write(job["scene_class"] * job["config"].get("repeat", 1))
+    stderr = "x" * job["config"].get("stderr_bytes", 0)
+    print(json.dumps({"returncode": 0, "stderr": stderr, "rss_mb": 10}), flush=True)
+"""
+
+def test_manim_worker_pool_reuses_and_recycles_workers(mocker, tmp_path):
+    import asyncio
+    from controllers import manim_workers
+    from controllers.manim_workers import ManimWorkerPool
+
+    script = tmp_path / "fake_worker.py"
+    script.write_text(FAKE_MANIM_WORKER)
+    mocker.patch.object(manim_workers, "WORKER_SCRIPT", str(script))
+    mocker.patch.object(manim_workers, "MANIM_WORKER_MAX_JOBS", 2)
+
+    async def scenario():
+        pool = ManimWorkerPool(size=1)
+        results = []
+        for _ in range(3):
+            results.append(await pool.render("s.py", "GeneratedScene", "low", "media", "render",
+                                             str(tmp_path / "log"), timeout=10))
+        await asyncio.sleep(0.5)
+        stats = pool.stats()
+        for worker in pool._idle:
+            await worker.stop()
+        return results, stats
+
+    results, stats = asyncio.run(scenario())
+    assert results[0] == (0, "GeneratedScene", "")
+    assert stats["recycled"] >= 1
+    assert stats["started"] >= 2
+
+def test_manim_worker_handles_oversized_log_and_traceback(mocker, tmp_path):
+    import asyncio
+    from controllers import manim_workers
+    from controllers.manim_workers import ManimWorkerPool
+
+    script = tmp_path / "fake_worker.py"
+    script.write_text(FAKE_MANIM_WORKER)
+    mocker.patch.object(manim_workers, "WORKER_SCRIPT", str(script))
+
+    async def scenario():
+        pool = ManimWorkerPool(size=1)
+        # ~2 MB of log and a 200 KB reply line, both past asyncio's 64 KB readline limit
+        result = await pool.render("s.py", "GeneratedScene", "low", "media", "render", str(tmp_path / "log"),
+                                   timeout=10, config={"repeat": 150_000, "stderr_bytes": 200_000})
+        stats = pool.stats()
+        for worker in pool._idle:
+            await worker.stop()
+        return result, stats
+
+    (returncode, stdout, stderr), stats = asyncio.run(scenario())
+    assert returncode == 0
+    assert stdout == "GeneratedScene" * 150_000
+    assert len(stderr) == 200_000
+    assert stats["recycled"] == 0
+
+def test_container_pool_reuses_and_recycles_containers(mocker):
+    import asyncio
+    from unittest.mock import AsyncMock
+    from controllers import container_pool as container_pool_module
+    from controllers.container_pool import ContainerPool, SandboxContainer
+
+    mocker.patch.object(container_pool_module, "CONTAINER_POOL_MAX_JOBS", 2)
+    mocker.patch.object(SandboxContainer, "start", AsyncMock())
+    stop = mocker.patch.object(SandboxContainer, "stop", AsyncMock())
+    reset = mocker.patch.object(SandboxContainer, "reset", AsyncMock())
+
+    async def fake_render(self, *args, **kwargs):
+        self.jobs += 1
+        return 0, self.name, ""
+    mocker.patch.object(SandboxContainer, "render", fake_render)
+
+    async def scenario():
+        pool = ContainerPool(size=1)
+        results = []
+        for _ in range(3):
+            results.append(await pool.render("tmp", "script.py", "GeneratedScene", "-ql", "render", 10))
+            await pool.settle()
+        return results, pool
+
+    results, pool = asyncio.run(scenario())
+    names = [stdout for _, stdout, _ in results]
+    assert names[0] == names[1]
+    assert names[2] != names[1]
+    assert pool.stats()["recycled"] == 1
+    assert stop.await_count == 1
+    # Every container handed back to the pool is reset before its next job
+    assert reset.await_count == 2
+
+SEGMENTABLE_SCENE = """
+from manim import *
+
+class GeneratedScene(Scene):
+    def construct(self):
+        circle = Circle()
+        self.play(Create(circle))
+        self.wait(0.5)
+        self.play(circle.animate.shift(LEFT))
+        self.wait(0.5)
+"""
+
+def test_count_animations_and_plan_segments():
+    from controllers.segmented_render import count_animations, plan_segments
+
+    assert count_animations(SEGMENTABLE_SCENE, "GeneratedScene") == 4
+    looped = SEGMENTABLE_SCENE + "        for _ in range(3):\n            self.wait(0.1)\n"
+    assert count_animations(looped, "GeneratedScene") is None
+    assert plan_segments(4, 2) == [(0, 1), (2, 3)]
+    assert plan_segments(5, 8) == [(0, 2), (3, 4)]
+    assert plan_segments(3, 4) == []
+
+def test_render_segmented_concatenates_parts(mocker, tmp_path):
+    import asyncio
+    from controllers import segmented_render
+
+    mocker.patch.object(segmented_render, "SEGMENT_MAX_PARALLEL", 2)
+    (tmp_path / "script.py").write_text(SEGMENTABLE_SCENE)
+    ranges = []
+
+    async def fake_run_manim(tmp, filename, scene_class, quality, out_name, animation_range=None, total_animations=None):
+        ranges.append(animation_range)
+        out_dir = os.path.join(tmp, "media", "videos")
+        os.makedirs(out_dir)
+        open(os.path.join(out_dir, f"{out_name}.mp4"), "wb").close()
+        return 0, "", ""
+
+    concat_lists = []
+
+    async def fake_run_ffmpeg(args, workdir, timeout=300):
+        with open(os.path.join(workdir, args[args.index("-i") + 1])) as f:
+            concat_lists.append(f.read())
+        open(os.path.join(workdir, args[-1]), "wb").close()
+        return 0, "", ""
+
+    mocker.patch.object(segmented_render, "run_manim", fake_run_manim)
+    mocker.patch.object(segmented_render, "run_ffmpeg", fake_run_ffmpeg)
+
+    returncode, _, _ = asyncio.run(segmented_render.render_segmented(
+        str(tmp_path), "script.py", "GeneratedScene", "high", "render", SEGMENTABLE_SCENE))
+
+    assert returncode == 0
+    assert sorted(ranges) == [(0, 1), (2, 3)]
+    assert concat_lists[0].splitlines() == [
+        "file 'seg0/media/videos/render-0.mp4'",
+        "file 'seg1/media/videos/render-1.mp4'",
+    ]
+    assert (tmp_path / "render.mp4").exists()
+
+
+def test_media_cache_keeps_partials_and_evicts_unleased(tmp_path):
+    import asyncio
+    from controllers.media_cache import MediaCache
+
+    cache = MediaCache(str(tmp_path / "cache"), max_bytes=15)
+    work = tmp_path / "work"
+    work.mkdir()
+
+    async def scenario():
+        async with cache.attach("chat-1", str(work), "render") as media:
+            partial = os.path.join(media, "videos", "step", "480p15", "partial_movie_files", "Scene")
+            os.makedirs(partial)
+            open(os.path.join(partial, "abc.mp4"), "wb").write(b"x" * 10)
+            open(os.path.join(media, "videos", "step", "480p15", "render.mp4"), "wb").close()
+        assert (work / "render.mp4").exists()
+        assert not (work / "media").exists()
+
+        async with cache.lease("chat-1") as kept:
+            assert os.listdir(os.path.join(kept, "videos", "step", "480p15")) == ["partial_movie_files"]
+            async with cache.lease("chat-2") as other:
+                open(os.path.join(other, "big.bin"), "wb").write(b"x" * 10)
+            # Over budget: the older chat-1 dir is leased, so chat-2 goes instead
+            assert os.path.isdir(kept)
+
+    asyncio.run(scenario())
+    assert cache.evictions == 1
+    assert os.listdir(tmp_path / "cache") == ["chat-1"]
+    # Per-key locks do not outlive their leases
+    assert cache._locks == {} and cache._lock_refs == {}
+
+
+def test_segmented_render_skips_media_cache(mocker, tmp_path):
+    import asyncio
+    from controllers import render_controller
+
+    attach = mocker.patch.object(render_controller.media_cache, "attach")
+    mocker.patch.object(render_controller, "render_segmented", AsyncMock(return_value=(0, "", "")))
+    result = asyncio.run(render_controller.render_scene(str(tmp_path), "script.py", "GeneratedScene", "high",
+                                                        "render", SEGMENTABLE_SCENE, segmented=True,
+                                                        media_key="chat-1"))
+    assert result == (0, "", "")
+    attach.assert_not_called()
+
+
+def test_run_process_streams_progress_lines():
+    import asyncio
+    import sys
+    from utils.process import run_process
+
+    script = (
+        "import sys\n"
+        "for i in (10, 20):\n"
+        "    sys.stderr.write(f'\\rAnimation 0: FadeIn(Square): {i * 5}%|#| {i}/20 [00:01<00:00, 25.0it/s]')\n"
+        "    sys.stderr.flush()\n"
+        "print('done')\n"
+    )
+    lines = []
+    returncode, stdout, stderr = asyncio.run(run_process([sys.executable, "-c", script], 10, on_output=lines.append))
+
+    assert returncode == 0
+    assert stdout.strip() == "done"
+    assert "10/20" in stderr
+    assert [line for line in lines if line.startswith("Animation")] == [
+        "Animation 0: FadeIn(Square): 50%|#| 10/20 [00:01<00:00, 25.0it/s]",
+        "Animation 0: FadeIn(Square): 100%|#| 20/20 [00:01<00:00, 25.0it/s]",
+    ]
+    assert "done" in lines
+
+
+def test_speculative_generate_promotes_first_passing_candidate(mocker):
+    import asyncio
+    from controllers import render_controller
+    from models.schemas import CombinedGenerateRenderRequest
+
+    scripts = iter([
+        "from manim import *\nclass GeneratedScene(Scene):\n    def construct(self):\n        self.play(Broken())\n",
+        "from manim import *\nclass GeneratedScene(Scene):\n    def construct(self):\n        self.wait(5)\n",
+        "from manim import *\nclass GeneratedScene(Scene):\n    def construct(self):\n        self.wait(1)\n",
+    ])
+    mocker.patch.object(render_controller, "generate_manim_code",
+                        side_effect=lambda *args: {"code": next(scripts), "metadata": {}, "cached": False})
+    remember = mocker.patch.object(render_controller, "remember_generation")
+    cancelled = []
+
+    async def fake_dry_run(code, filename, scene_class):
+        if "Broken" in code:
+            return 1, "", "NameError: name 'Broken' is not defined"
+        if "wait(5)" in code:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(code)
+                raise
+        return 0, "", ""
+
+    mocker.patch.object(render_controller, "dry_run_scene", fake_dry_run)
+
+    req = CombinedGenerateRenderRequest(prompt="wait", candidates=3)
+    code, sanitized = asyncio.run(render_controller.speculative_generate(req, 3))
+
+    assert "wait(1)" in code and "wait(1)" in sanitized
+    assert len(cancelled) == 1
+    remember.assert_called_once()
+
+
+def test_retry_render_preflight_fixes_code_before_rendering(mocker):
+    import asyncio
+    from controllers import render_controller
+
+    dry_runs, renders = [], []
+
+    async def fake_dry_run(code, filename, scene_class):
+        dry_runs.append(code)
+        if "FRAME_X" in code:
+            return 1, "", "NameError: name 'FRAME_X' is not defined"
+        return 0, "", ""
+
+    async def fake_render_scene(tmp, filename, scene_class, quality, out_name, code, segmented=False, media_key=None):
+        renders.append(code)
+        open(os.path.join(tmp, f"{out_name}.mp4"), "wb").close()
+        return 0, "", ""
+
+    mocker.patch.object(render_controller, "dry_run_scene", fake_dry_run)
+    mocker.patch.object(render_controller, "render_scene", fake_render_scene)
+    mocker.patch.object(render_controller.video_store, "put", return_value="generated_videos/render-test.mp4")
+    mocker.patch.object(render_controller, "package_video", AsyncMock(return_value=False))
+
+    code = "from manim import *\nclass GeneratedScene(Scene):\n    def construct(self):\n        self.play(Create(Dot().shift(RIGHT * FRAME_X)))\n"
+    ok, _, _ = asyncio.run(render_controller.retry_render(code, "script.py", "GeneratedScene", "low"))
+
+    assert ok
+    assert len(dry_runs) == 2
+    assert len(renders) == 1 and "FRAME_X" not in renders[0]
+
+
+def test_retry_render_preflight_skips_render_without_fix(mocker):
+    import asyncio
+    from controllers import render_controller
+
+    async def fake_dry_run(code, filename, scene_class):
+        return 1, "", "ValueError: bad argument"
+
+    mocker.patch.object(render_controller, "dry_run_scene", fake_dry_run)
+    render = mocker.patch.object(render_controller, "render_scene")
+
+    ok, _, logs = asyncio.run(render_controller.retry_render("x = 1\n", "script.py", "GeneratedScene", "low"))
+
+    assert not ok
+    assert logs["error"] == "Preflight failed: ValueError: bad argument"
+    render.assert_not_called()
+
+
+def test_resumable_uploader_resumes_after_failed_chunk(mocker, tmp_path):
+    import httpx
+    from controllers import upload_controller
+    from controllers.upload_controller import ResumableUploader
+
+    mocker.patch.object(upload_controller.time, "sleep")
+    video = tmp_path / "render.mp4"
+    payload = os.urandom(25)
+    video.write_bytes(payload)
+    stored = bytearray()
+    patches = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "POST":
+            assert request.headers["upload-length"] == "25"
+            return httpx.Response(201, headers={"Location": "/storage/v1/upload/resumable/abc"})
+        if request.method == "HEAD":
+            return httpx.Response(200, headers={"Upload-Offset": str(len(stored))})
+        patches.append(int(request.headers["upload-offset"]))
+        assert int(request.headers["upload-offset"]) == len(stored)
+        stored.extend(request.content)
+        if len(patches) == 2:
+            # Server kept the chunk but the response got lost
+            return httpx.Response(500)
+        return httpx.Response(204, headers={"Upload-Offset": str(len(stored))})
+
+    uploader = ResumableUploader("http://supabase.test", "key", concurrency=2, chunk_bytes=10, retries=3,
+                                 transport=httpx.MockTransport(handler))
+    uploader.upload(str(video), "videos", "abc-render.mp4")
+
+    assert bytes(stored) == payload
+    assert patches == [0, 10, 20]
+    stats = uploader.stats()
+    assert (stats["succeeded"], stats["failed"], stats["chunk_retries"], stats["bytes_uploaded"]) == (1, 0, 1, 25)
+
+
+def test_write_behind_queue_persists_and_uploads(tmp_path):
+    import asyncio
+    from controllers.upload_controller import WriteBehindQueue
+
+    video = tmp_path / "render-abc.mp4"
+    video.write_bytes(b"video")
+    db = str(tmp_path / "pending.sqlite3")
+    attempts, uploaded = [], []
+
+    def flaky_upload(path):
+        attempts.append(path)
+        return None if len(attempts) == 1 else "https://cdn/render-abc.mp4"
+
+    # Queued by a process that exited before uploading it
+    WriteBehindQueue(db, flaky_upload, lambda *args: None, max_attempts=5)._add(str(video), "/api/videos/render-abc.mp4")
+
+    async def resume():
+        queue = WriteBehindQueue(db, flaky_upload, lambda *args: uploaded.append(args), max_attempts=5,
+                                 backoff_seconds=0)
+        assert queue.pending_paths() == [str(video)]
+        queue.start()
+        for _ in range(100):
+            if uploaded:
+                break
+            await asyncio.sleep(0.02)
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(resume())
+
+    assert uploaded == [(str(video), "/api/videos/render-abc.mp4", "https://cdn/render-abc.mp4")]
+    assert queue.uploaded_url("/api/videos/render-abc.mp4") == "https://cdn/render-abc.mp4"
+    assert queue.pending_paths() == []
+    assert queue.stats()["failed_attempts"] == 1
+
+
+def test_write_behind_queues_sharing_a_file_upload_each_video_once(tmp_path):
+    import time
+    import asyncio
+    from controllers.upload_controller import WriteBehindQueue
+
+    db = str(tmp_path / "pending.sqlite3")
+    videos = []
+    for i in range(4):
+        video = tmp_path / f"render-{i}.mp4"
+        video.write_bytes(b"video")
+        videos.append(str(video))
+    uploads, uploaded = [], []
+
+    def slow_upload(path):
+        uploads.append(path)
+        time.sleep(0.05)
+        return f"https://cdn/{os.path.basename(path)}"
+
+    async def two_workers():
+        # Two uvicorn workers with their own queue object on the same file
+        queues = [WriteBehindQueue(db, slow_upload, lambda *args: uploaded.append(args), max_attempts=5,
+                                   concurrency=2) for _ in range(2)]
+        for path in videos:
+            queues[0]._add(path, f"/api/videos/{os.path.basename(path)}")
+        for queue in queues:
+            queue.start()
+        for _ in range(200):
+            if len(uploaded) >= len(videos) and not queues[0].pending_paths():
+                break
+            await asyncio.sleep(0.02)
+        await asyncio.sleep(0.1)
+        for queue in queues:
+            await queue.stop()
+
+    asyncio.run(two_workers())
+    assert sorted(uploads) == sorted(videos)
+    assert len(uploaded) == len(videos)
+
+
+def test_write_behind_takes_over_stale_claims(tmp_path):
+    from controllers.upload_controller import WriteBehindQueue
+
+    db = str(tmp_path / "pending.sqlite3")
+    dead = WriteBehindQueue(db, lambda path: None, lambda *args: None, max_attempts=5)
+    dead._add("/videos/a.mp4", "/api/videos/a.mp4")
+    assert dead._claim_next()[1] is True
+
+    live = WriteBehindQueue(db, lambda path: None, lambda *args: None, max_attempts=5, claim_ttl=0)
+    fresh = WriteBehindQueue(db, lambda path: None, lambda *args: None, max_attempts=5)
+    assert fresh._claim_next() == (None, False)
+    row, claimed = live._claim_next()
+    assert row[0] == "/videos/a.mp4" and claimed
+
+
+def test_video_store_renames_and_reaper_discards_workspace(tmp_path):
+    from controllers.workspace import VideoStore, WorkspaceReaper, collect_output, output_path
+
+    work = tmp_path / "manimjob-1"
+    (work / "media" / "videos" / "scene" / "480p15").mkdir(parents=True)
+    rendered = work / "media" / "videos" / "scene" / "480p15" / "render.mp4"
+    rendered.write_bytes(b"frames")
+    inode = rendered.stat().st_ino
+
+    collect_output(str(work / "media"), "render", output_path(str(work), "render"))
+    store = VideoStore(str(tmp_path / "videos"))
+    dest = store.put(output_path(str(work), "render"), "render")
+
+    assert os.stat(dest).st_ino == inode
+    assert (store.stats()["renamed"], store.stats()["copied"]) == (1, 0)
+
+    reaper = WorkspaceReaper(str(tmp_path), max_age=0)
+    reaper.sweep()
+    reaper.drain()
+    assert not work.exists()
+    assert os.path.exists(dest)
+
+
+def test_video_download_ranges_and_etags(test_app, mocker, tmp_path):
+    from controllers.workspace import VideoStore
+    from routes import rendering
+
+    mocker.patch.object(rendering, "video_store", VideoStore(str(tmp_path)))
+    (tmp_path / "render-abc.mp4").write_bytes(b"0123456789")
+
+    full = test_app.get("/api/videos/render-abc.mp4")
+    assert full.status_code == 200
+    assert "immutable" in full.headers["cache-control"]
+    etag = full.headers["etag"]
+
+    assert test_app.get("/api/videos/render-abc.mp4", headers={"If-None-Match": etag}).status_code == 304
+
+    part = test_app.get("/api/videos/render-abc.mp4", headers={"Range": "bytes=2-5", "If-Range": etag})
+    assert part.status_code == 206
+    assert part.content == b"2345"
+    assert part.headers["content-range"] == "bytes 2-5/10"
+
+    stale = test_app.get("/api/videos/render-abc.mp4", headers={"Range": "bytes=2-5", "If-Range": '"stale"'})
+    assert stale.status_code == 200 and stale.content == b"0123456789"
+    assert test_app.get("/api/videos/missing.mp4").status_code == 404
+
+
+def test_video_store_evicts_least_recently_served_uploaded_videos(tmp_path):
+    import time
+    from controllers.workspace import VideoStore
+
+    store = VideoStore(str(tmp_path), max_bytes=25, min_age=0)
+    old = time.time() - 100
+    for i, name in enumerate(("a.mp4", "b.mp4", "c.mp4", "d.mp4")):
+        (tmp_path / name).write_bytes(b"x" * 10)
+        os.utime(tmp_path / name, (old + i, old + i))
+
+    for name in ("a.mp4", "c.mp4", "d.mp4"):  # b's upload is pending or failed: the only copy
+        store.mark_uploaded(str(tmp_path / name))
+    store.touch("a.mp4")  # served recently, so it outlives b and c
+    store.evict()
+
+    assert sorted(os.listdir(tmp_path)) == ["a.mp4", "a.uploaded", "b.mp4"]
+    stats = store.stats()
+    assert stats["bytes"] == 20 and stats["evictions"] == 2 and stats["evicted_bytes"] == 20
+
+
+def test_video_store_evicts_previews_and_removes_superseded_ones(tmp_path):
+    import time
+    from controllers.workspace import VideoStore
+
+    store = VideoStore(str(tmp_path), max_bytes=10, min_age=0)
+    old = time.time() - 100
+    for i, name in enumerate(("preview.mp4", "only-copy.mp4")):
+        (tmp_path / name).write_bytes(b"x" * 10)
+        os.utime(tmp_path / name, (old + i, old + i))
+    store.mark_disposable(str(tmp_path / "preview.mp4"))
+    store.evict()
+    assert sorted(os.listdir(tmp_path)) == ["only-copy.mp4"]
+
+    (tmp_path / "next-preview.mp4").write_bytes(b"x")
+    store.mark_disposable(str(tmp_path / "next-preview.mp4"))
+    store.remove("next-preview.mp4")
+    assert sorted(os.listdir(tmp_path)) == ["only-copy.mp4"]
+
+
+def test_video_store_counts_and_evicts_posters_with_their_video(tmp_path):
+    import time
+    from controllers.workspace import VideoStore
+
+    store = VideoStore(str(tmp_path), max_bytes=25, min_age=0)
+    old = time.time() - 100
+    (tmp_path / "render-a.mp4").write_bytes(b"x" * 10)
+    os.utime(tmp_path / "render-a.mp4", (old, old))
+    (tmp_path / "render-b.mp4").write_bytes(b"x" * 10)
+    poster = tmp_path / "render-a.poster.jpg.tmp"
+    poster.write_bytes(b"p" * 8)
+    store.put_artifact(str(poster), str(tmp_path / "render-a.mp4"), "poster.jpg")
+    store.mark_uploaded(str(tmp_path / "render-a.mp4"))
+    assert store.stats()["bytes"] == 28
+
+    store.evict()
+    assert sorted(os.listdir(tmp_path)) == ["render-b.mp4"]
+    assert store.stats()["bytes"] == 10
+
+
+def test_package_video_remuxes_faststart_and_cuts_hls(mocker, tmp_path):
+    import asyncio
+    from controllers import packaging
+
+    (tmp_path / "render.mp4").write_bytes(b"moov-at-end")
+    calls = []
+
+    async def fake_run_ffmpeg(args, workdir, timeout=300):
+        calls.append(args)
+        out = os.path.join(workdir, args[-1])
+        open(out, "wb").write(b"moov-first" if "+faststart" in args else b"#EXTM3U")
+        return 0, "", ""
+
+    mocker.patch.object(packaging, "run_ffmpeg", fake_run_ffmpeg)
+    assert asyncio.run(packaging.package_video(str(tmp_path), "render", hls=True))
+
+    assert (tmp_path / "render.mp4").read_bytes() == b"moov-first"
+    assert not (tmp_path / "render.faststart.mp4").exists()
+    assert (tmp_path / "hls" / "index.m3u8").exists()
+    assert all(args[args.index("-c") + 1] == "copy" for args in calls)
+
+
+def test_artifact_urls_follow_stored_and_uploaded_names(mocker, tmp_path):
+    from controllers import render_controller
+    from controllers.workspace import VideoStore
+
+    mocker.patch.object(render_controller, "video_store", VideoStore(str(tmp_path)))
+    (tmp_path / "render-0123abcd.poster.jpg").write_bytes(b"jpg")
+
+    local = render_controller.artifact_urls("/api/videos/render-0123abcd.mp4")
+    uploaded = render_controller.artifact_urls("https://x.supabase.co/storage/v1/object/public/videos/ff00ff00-render-0123abcd.mp4")
+
+    assert local == uploaded == {
+        "poster_url": "/api/videos/render-0123abcd.poster.jpg",
+        "sprite_url": None,
+        "animated_preview_url": None,
+    }
+    assert render_controller.artifact_urls(None)["poster_url"] is None
+
+
+def test_generate_and_render_caches_generation_only_after_render(mocker):
+    import asyncio
+    from controllers import render_controller
+    from models.schemas import CombinedGenerateRenderRequest
+
+    code = "from manim import *\nclass GeneratedScene(Scene):\n    def construct(self):\n        self.wait(1)\n"
+    generate = mocker.patch.object(render_controller, "generate_manim_code",
+                                   return_value={"code": code, "metadata": {}, "cached": False})
+    mocker.patch.object(render_controller, "GENAI_STREAM", False)
+    mocker.patch.object(render_controller, "SPECULATIVE_CANDIDATES", 1)
+    remember = mocker.patch.object(render_controller, "remember_generation")
+    render_final = mocker.patch.object(render_controller, "render_final",
+                                       AsyncMock(return_value={"success": False, "error": "render failed"}))
+
+    req = CombinedGenerateRenderRequest(prompt="wait", candidates=1)
+    assert asyncio.run(render_controller.generate_and_render(req))["success"] is False
+    assert generate.call_args[0][2] is False  # store=False: not cached before it is known to work
+    remember.assert_not_called()
+
+    render_final.return_value = {"success": True}
+    assert asyncio.run(render_controller.generate_and_render(req))["success"] is True
+    remember.assert_called_once_with("wait", generate.return_value)
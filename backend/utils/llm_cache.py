@@ -0,0 +1,114 @@
+# utils/llm_cache.py
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import unicodedata
+from contextlib import closing
+from typing import Any, Dict, Optional
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join("generated_scripts", "llm_cache.sqlite3"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Unicode-normalize and collapse whitespace. Case is kept since it can end up in on-screen text."""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", prompt or "")).strip()
+
+
+class LLMCache:
+    """
+    SQLite-backed LRU + TTL cache of generated code and metadata.
+    Keys hash the normalized prompt, the model name and the prompt template,
+    so editing the template or switching models never serves stale output.
+    A connection is opened per call so it can be used from worker threads.
+    """
+    def __init__(self, path: str, max_entries: int, ttl_seconds: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._initialized:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self._initialized:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                " key TEXT PRIMARY KEY, model TEXT, prompt TEXT, code TEXT, metadata TEXT,"
+                " created_at REAL, last_access REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache(last_access)")
+            self._initialized = True
+        return conn
+
+    @staticmethod
+    def key(prompt: str, model: str, template: str) -> str:
+        template_hash = hashlib.sha256(template.encode("utf-8")).hexdigest()
+        h = hashlib.sha256()
+        for part in (normalize_prompt(prompt), model, template_hash):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                row = conn.execute(
+                    "SELECT code, metadata FROM llm_cache WHERE key = ? AND created_at > ?",
+                    (key, now - self.ttl_seconds),
+                ).fetchone()
+                if row:
+                    conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+        except Exception as e:
+            print(f"[LLM cache] lookup failed: {e}")
+            row = None
+        if not row:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {"code": row[0], "metadata": json.loads(row[1] or "{}")}
+
+    def put(self, key: str, model: str, prompt: str, code: str, metadata: Dict[str, Any]):
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, model, prompt, code, metadata, created_at, last_access)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, model, normalize_prompt(prompt), code, json.dumps(metadata), now, now),
+                )
+                conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - self.ttl_seconds,))
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    " SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+        except Exception as e:
+            print(f"[LLM cache] store failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            with closing(self._connect()) as conn, conn:
+                entries = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        except Exception:
+            entries = None
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+llm_cache = LLMCache(LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_SECONDS)
@@ -0,0 +1,104 @@
+# utils/manim_worker.py
+"""
+Long-lived Manim render worker.
+
+Started by controllers/manim_workers.py with `python utils/manim_worker.py`. It imports
+Manim once, prints {"ready": true} and then serves one JSON job per stdin line:
+    {"script_path", "scene_class", "quality", "media_dir", "output_name", "log_path", "animation_range", "dry_run", "config"}
+and answers with one JSON line:
+    {"returncode", "stderr", "rss_mb"}
+Everything Manim prints during a job goes to `log_path`; the original stdout is kept
+exclusively for the protocol.
+"""
+import os
+import sys
+import json
+import uuid
+import traceback
+import importlib.util
+
+QUALITY_CONFIG = {"preview": "low_quality", "low": "low_quality", "medium": "medium_quality", "high": "high_quality"}
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except Exception:
+        return 0.0
+
+
+def _render(job: dict):
+    from manim import tempconfig
+
+    options = {
+        "quality": QUALITY_CONFIG.get(job.get("quality"), "low_quality"),
+        "media_dir": job["media_dir"],
+        "output_file": job["output_name"],
+        "write_to_movie": True,
+    }
+    if job.get("animation_range"):
+        # Same as `manim -n start,end`: skip earlier animations without writing frames.
+        options["from_animation_number"], options["upto_animation_number"] = job["animation_range"]
+    # Extra settings on top of the quality preset (e.g. the preview tier's resolution and fps).
+    options.update(job.get("config") or {})
+    if job.get("dry_run"):
+        # Same as `manim --dry_run`: run construct() without writing or encoding frames.
+        options["dry_run"] = True
+        options["write_to_movie"] = False
+    with tempconfig(options):
+        spec = importlib.util.spec_from_file_location(f"manimjob_{uuid.uuid4().hex}", job["script_path"])
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        scene_cls = getattr(module, job["scene_class"], None)
+        if scene_cls is None:
+            raise NameError(f"Scene class {job['scene_class']!r} is not defined in {job['script_path']}")
+        scene_cls().render()
+
+
+def _run_job(job: dict) -> dict:
+    returncode, error = 0, ""
+    saved_out, saved_err = os.dup(1), os.dup(2)
+    with open(job["log_path"], "w", encoding="utf-8") as log:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            _render(job)
+        except KeyboardInterrupt:
+            raise
+        except BaseException:
+            returncode, error = 1, traceback.format_exc()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_out, 1)
+            os.dup2(saved_err, 2)
+            os.close(saved_out)
+            os.close(saved_err)
+    # The log stays in log_path for the parent to read; protocol lines stay small
+    return {"returncode": returncode, "stderr": error, "rss_mb": round(_rss_mb(), 1)}
+
+
+def main():
+    # Keep a private handle on stdout for the protocol and send stray prints to stderr.
+    proto = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+
+    import manim  # noqa: F401  (pre-warm: numpy, cairo, pango, moderngl)
+
+    proto.write(json.dumps({"ready": True, "pid": os.getpid()}) + "\n")
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            result = _run_job(json.loads(line))
+        except Exception:
+            result = {"returncode": 1, "stderr": traceback.format_exc(), "rss_mb": round(_rss_mb(), 1)}
+        proto.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# utils/process.py
+import re
+import codecs
+import asyncio
+import subprocess
+from typing import Callable, List, Optional, Tuple
+
+
+async def _kill_container(name: str):
+    """Force-remove a docker container; killing the `docker run` client alone leaves it running."""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            "docker", "rm", "-f", name,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        await asyncio.wait_for(proc.wait(), timeout=30)
+    except Exception as e:
+        print(f"Failed to remove container {name}: {e}")
+
+
+async def _terminate(proc: asyncio.subprocess.Process, container_name: Optional[str]):
+    if container_name:
+        await _kill_container(container_name)
+    if proc.returncode is None:
+        try:
+            proc.kill()
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+
+
+async def _pump(stream: asyncio.StreamReader, on_output: Callable[[str], None]) -> bytes:
+    """Read `stream` to EOF, passing each line (split on \r or \n, as progress bars redraw with \r) to `on_output`."""
+    chunks, pending = [], ""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+    while True:
+        data = await stream.read(4096)
+        if not data:
+            break
+        chunks.append(data)
+        *lines, pending = re.split(r"[\r\n]", pending + decoder.decode(data))
+        for line in lines:
+            if line.strip():
+                on_output(line)
+    if pending.strip():
+        on_output(pending)
+    return b"".join(chunks)
+
+
+async def _communicate(proc: asyncio.subprocess.Process, on_output: Optional[Callable[[str], None]]) -> Tuple[bytes, bytes]:
+    if on_output is None:
+        return await proc.communicate()
+    out, err = await asyncio.gather(_pump(proc.stdout, on_output), _pump(proc.stderr, on_output))
+    await proc.wait()
+    return out, err
+
+
+async def run_process(cmd: List[str], timeout: float, container_name: Optional[str] = None, cwd: Optional[str] = None,
+                      on_output: Optional[Callable[[str], None]] = None) -> Tuple[int, str, str]:
+    """
+    Run `cmd` without blocking the event loop and return (returncode, stdout, stderr).
+    With `on_output`, stdout/stderr lines are also passed to it as they are printed.
+    On timeout raises subprocess.TimeoutExpired; on timeout or cancellation the process
+    (and `container_name`, for docker runs) is killed before returning.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+    )
+    try:
+        out, err = await asyncio.wait_for(_communicate(proc, on_output), timeout=timeout)
+    except asyncio.TimeoutError:
+        await _terminate(proc, container_name)
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    except asyncio.CancelledError:
+        await asyncio.shield(_terminate(proc, container_name))
+        raise
+    return proc.returncode, out.decode(errors="ignore"), err.decode(errors="ignore")
@@ -0,0 +1,120 @@
+# utils/progress.py
+"""
+Render progress reporting.
+
+Whoever wants progress events (the background job runner) installs a listener with
+`listen(fn)`; it is stored in a context variable, so it follows the request through
+awaits, tasks and worker threads without being passed down every call. Render code
+feeds Manim output lines to a `ManimProgress`, which emits
+    {"type": "progress", "animation", "total_animations", "frame", "frames",
+     "percent", "fps", "eta_seconds"}
+"""
+import os
+import re
+import time
+import asyncio
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Tuple
+
+_listener: ContextVar[Optional[Callable[[Dict[str, Any]], None]]] = ContextVar("progress_listener", default=None)
+
+# tqdm bar as printed by Manim, e.g.
+# "Animation 2: Create(Circle):  45%|####5     | 27/60 [00:01<00:01, 20.12it/s]"
+_BAR_RE = re.compile(
+    r"Animation\s+(\d+)\s*:.*?(\d+)%\|.*?\|\s*(\d+)/(\d+)\s*\[[\d:]+<([\d:?]+),\s*([\d.]+|\?)\s*it/s"
+)
+
+
+def listen(fn: Optional[Callable[[Dict[str, Any]], None]]):
+    """Install `fn` as the progress listener for the current context; returns a reset token."""
+    return _listener.set(fn)
+
+
+def stop_listening(token):
+    _listener.reset(token)
+
+
+def listening() -> bool:
+    return _listener.get() is not None
+
+
+def emit(event: Dict[str, Any]):
+    fn = _listener.get()
+    if fn is None:
+        return
+    try:
+        fn(event)
+    except Exception as e:
+        print(f"Progress listener failed: {type(e).__name__}: {e}")
+
+
+def _seconds(clock: str) -> Optional[int]:
+    if "?" in clock:
+        return None
+    seconds = 0
+    for part in clock.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+class ManimProgress:
+    """
+    Turns Manim progress-bar lines into progress events. The ETA covers the rest of this
+    process's animations (`animation_range`, or all `total_animations` when known),
+    extrapolated from the time spent so far.
+    """
+    def __init__(self, total_animations: Optional[int] = None,
+                 animation_range: Optional[Tuple[int, int]] = None):
+        self.total_animations = total_animations
+        self.first, self.last = animation_range or (0, (total_animations - 1) if total_animations else None)
+        self.started = time.monotonic()
+        self._last_key = None
+
+    def feed(self, line: str):
+        m = _BAR_RE.search(line)
+        if not m:
+            return
+        animation, percent, frame, frames = (int(m.group(i)) for i in range(1, 5))
+        if (animation, frame) == self._last_key:
+            return
+        self._last_key = (animation, frame)
+        fps = None if m.group(6) == "?" else float(m.group(6))
+        eta = _seconds(m.group(5))
+        if self.last is not None and frames:
+            done = (animation - self.first) + frame / frames
+            remaining = (self.last + 1 - animation) - frame / frames
+            if done > 0:
+                eta = round((time.monotonic() - self.started) / done * max(remaining, 0), 1)
+        emit({
+            "type": "progress",
+            "animation": animation,
+            "total_animations": self.total_animations,
+            "frame": frame,
+            "frames": frames,
+            "percent": percent,
+            "fps": fps,
+            "eta_seconds": eta,
+        })
+
+
+async def tail_file(path: str, on_line: Callable[[str], None], interval: float = 0.5):
+    """Call `on_line` for each line (split on \\r or \\n) appended to `path` until cancelled."""
+    pos, pending = 0, ""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                f.seek(pos)
+                data = f.read()
+                pos = f.tell()
+            if data:
+                *lines, pending = re.split(r"[\r\n]", pending + data)
+                for line in lines:
+                    if line.strip():
+                        on_line(line)
+    except asyncio.CancelledError:
+        if pending.strip():
+            on_line(pending)
+        raise
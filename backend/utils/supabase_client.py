@@ -1,5 +1,9 @@
 # utils/supabase_client.py
 import os
+import asyncio
+import hashlib
+from typing import Dict
+
 import httpx
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -8,26 +12,107 @@ SERVICE_ROLE_KEY = os.getenv("SERVICE_ROLE_KEY")
 if not SUPABASE_URL:
     raise RuntimeError("SUPABASE_URL must be set in environment")
 
-async def get_user_from_supabase(token: str) -> dict | None:
+SUPABASE_HTTP_MAX_CONNECTIONS = int(os.getenv("SUPABASE_HTTP_MAX_CONNECTIONS", "20"))
+SUPABASE_HTTP_KEEPALIVE_SECONDS = float(os.getenv("SUPABASE_HTTP_KEEPALIVE_SECONDS", "60"))
+
+# Application-lifetime pooled client for auth calls (opened/closed by the FastAPI lifespan)
+_http_client: httpx.AsyncClient | None = None
+_http_loop: asyncio.AbstractEventLoop | None = None
+# In-flight verifications by token hash, so concurrent requests with one token share a call
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _pooled_client(**kwargs) -> httpx.AsyncClient:
+    """Keep-alive client sized by SUPABASE_HTTP_MAX_CONNECTIONS / SUPABASE_HTTP_KEEPALIVE_SECONDS."""
+    return httpx.AsyncClient(
+        http2=_http2_available(),
+        limits=httpx.Limits(
+            max_connections=SUPABASE_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_HTTP_MAX_CONNECTIONS,
+            keepalive_expiry=SUPABASE_HTTP_KEEPALIVE_SECONDS,
+        ),
+        **kwargs,
+    )
+
+
+async def open_http_client() -> httpx.AsyncClient:
     """
-    Verifies the token by calling Supabase's /auth/v1/user endpoint.
-    Returns user dict on success, else None.
+    Return the pooled keep-alive client (HTTP/2 when the h2 package is installed), creating
+    it on first use. A client belongs to one event loop, so a new loop gets a new client.
     """
-    if not SERVICE_ROLE_KEY:
-        raise RuntimeError("SUPABASE_SERVICE_ROLE_KEY not set; cannot call Supabase admin endpoint")
+    global _http_client, _http_loop
+    loop = asyncio.get_running_loop()
+    if _http_client is None or _http_loop is not loop:
+        if _http_client is not None:
+            await _close_quietly(_http_client.aclose)
+        _http_client = _pooled_client(timeout=10.0)
+        _http_loop = loop
+    return _http_client
+
+
+async def _close_quietly(aclose):
+    """Close a client left over from another event loop; its connections may already be gone with that loop."""
+    try:
+        await aclose()
+    except Exception as e:
+        print(f"Dropping HTTP client from a previous event loop: {type(e).__name__}: {e}")
+
+
+def _settle_inflight(key: str, pending: asyncio.Future):
+    if _inflight.get(key) is pending:
+        del _inflight[key]
+    # Mark a failure as retrieved even if every waiter was cancelled before it arrived
+    if not pending.cancelled():
+        pending.exception()
+
+
+async def close_http_client():
+    global _http_client, _http_loop
+    if _http_client is not None:
+        await _http_client.aclose()
+    _http_client, _http_loop = None, None
+
 
+async def _fetch_user(token: str) -> dict | None:
     headers = {
         "Authorization": f"Bearer {token}",
         "apikey": SERVICE_ROLE_KEY,            # required by Supabase admin endpoints
     }
     url = f"{SUPABASE_URL}/auth/v1/user"
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        r = await client.get(url, headers=headers)
-        if r.status_code == 200:
-            return r.json()
-        return None
+    client = await open_http_client()
+    r = await client.get(url, headers=headers)
+    if r.status_code == 200:
+        return r.json()
+    return None
 
-from supabase import create_client, Client
+
+async def get_user_from_supabase(token: str) -> dict | None:
+    """
+    Verifies the token by calling Supabase's /auth/v1/user endpoint.
+    Returns user dict on success, else None. Concurrent calls for the same token
+    share one request.
+    """
+    if not SERVICE_ROLE_KEY:
+        raise RuntimeError("SUPABASE_SERVICE_ROLE_KEY not set; cannot call Supabase admin endpoint")
+
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    pending = _inflight.get(key)
+    if pending is None or pending.get_loop() is not asyncio.get_running_loop():
+        pending = asyncio.ensure_future(_fetch_user(token))
+        _inflight[key] = pending
+        pending.add_done_callback(lambda fut: _settle_inflight(key, fut))
+    # shield: one caller going away must not cancel the others' shared request
+    return await asyncio.shield(pending)
+
+from supabase import create_client, Client, acreate_client, AsyncClient, AsyncClientOptions
 
 _supabase_client: Client | None = None
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
@@ -44,3 +129,37 @@ def get_supabase_client() -> Client:
             raise RuntimeError("SUPABASE_URL and SUPABASE_KEY (Anon) must be set in environment")
         _supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
     return _supabase_client
+
+
+_async_supabase_client: AsyncClient | None = None
+_async_supabase_loop: asyncio.AbstractEventLoop | None = None
+
+
+async def get_async_supabase_client() -> AsyncClient:
+    """
+    Async counterpart of get_supabase_client (same ANON key) for request handlers: queries are
+    awaited (`await ....execute()`) instead of blocking the event loop. PostgREST requests go
+    through one pooled keep-alive session with the same limits as the auth client, so the
+    client is created once per event loop and reused.
+    """
+    global _async_supabase_client, _async_supabase_loop
+    loop = asyncio.get_running_loop()
+    if _async_supabase_client is None or _async_supabase_loop is not loop:
+        if _async_supabase_client is not None:
+            await _close_quietly(_async_supabase_client.postgrest.aclose)
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise RuntimeError("SUPABASE_URL and SUPABASE_KEY (Anon) must be set in environment")
+        # The session is used as-is: PostgREST sends full URLs and auth headers per request
+        session = _pooled_client(timeout=120.0, follow_redirects=True)
+        _async_supabase_client = await acreate_client(
+            SUPABASE_URL, SUPABASE_KEY, options=AsyncClientOptions(httpx_client=session)
+        )
+        _async_supabase_loop = loop
+    return _async_supabase_client
+
+
+async def close_async_supabase_client():
+    global _async_supabase_client, _async_supabase_loop
+    if _async_supabase_client is not None:
+        await _async_supabase_client.postgrest.aclose()
+    _async_supabase_client, _async_supabase_loop = None, None
@@ -0,0 +1,77 @@
+# utils/video_response.py
+"""
+Conditional, cacheable responses for stored videos.
+
+Starlette's FileResponse already answers Range requests (206, multipart ranges, 416) and
+honours If-Range against the ETag it is given; on servers advertising the ASGI pathsend
+extension it hands the whole file to the server to send with sendfile. This adds strong
+ETags from a hash of the content, 304s for If-None-Match, and Cache-Control.
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import FileResponse, Response
+
+# Stored video names are unique per render and never rewritten, so they can be cached forever.
+VIDEO_CACHE_CONTROL = os.getenv("VIDEO_CACHE_CONTROL", "public, max-age=31536000, immutable")
+ETAG_MEMO_ENTRIES = 4096
+
+
+class VideoFileResponse(FileResponse):
+    # Fewer, larger reads when the server streams the file itself
+    chunk_size = 1024 * 1024
+
+
+class ETagMemo:
+    """sha256-based ETags, remembered per (path, mtime, size) so each file is hashed once."""
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[int, int, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, st: os.stat_result) -> str:
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[:2] == (st.st_mtime_ns, st.st_size):
+                self._entries.move_to_end(path)
+                return entry[2]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        etag = f'"{h.hexdigest()[:32]}"'
+        with self._lock:
+            self._entries[path] = (st.st_mtime_ns, st.st_size, etag)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag
+
+
+etags = ETagMemo(ETAG_MEMO_ENTRIES)
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+def video_response(request: Request, path: str, st: os.stat_result, etag: str,
+                   media_type: str = "video/mp4") -> Response:
+    """
+    304 when the client's If-None-Match still matches, else the file (or the requested
+    byte ranges, if If-Range still matches) with validators and Cache-Control.
+    """
+    headers = {"ETag": etag, "Cache-Control": VIDEO_CACHE_CONTROL}
+    if _matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return VideoFileResponse(path, media_type=media_type, headers=headers, stat_result=st,
+                             filename=os.path.basename(path), content_disposition_type="inline")
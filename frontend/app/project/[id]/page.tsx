@@ -25,6 +25,10 @@ interface Message {
   created_at: string;
 }
 
+// Videos still uploading (and previews) are served by the backend under a relative /api/videos/ URL.
+const resolveVideoUrl = (url: string) =>
+  url.startsWith("/") ? `${process.env.NEXT_PUBLIC_BACKEND_SERVER_URL}${url}` : url;
+
 interface Chat {
   id: string;
   title: string;
@@ -77,7 +81,7 @@ export default function ProjectPage() {
           .reverse()
           .find((m) => m.video_url);
         if (latestVideoMsg?.video_url) {
-          setCurrentVideoUrl(latestVideoMsg.video_url);
+          setCurrentVideoUrl(resolveVideoUrl(latestVideoMsg.video_url));
         }
       } catch (err) {
         console.error(err);
@@ -137,7 +141,7 @@ export default function ProjectPage() {
       setMessages((prev) => [...prev, assistantMsg]);
 
       if (assistantMsg.video_url) {
-        setCurrentVideoUrl(assistantMsg.video_url);
+        setCurrentVideoUrl(resolveVideoUrl(assistantMsg.video_url));
       }
     } catch (err) {
       console.error(err);